@@ -4,6 +4,8 @@ import matplotlib
 import matplotlib.font_manager as fm
 from .exchange_rate_manager import ExchangeRateManager
 from .scheduler import init_scheduler
+from .compression import init_compression
+from .assets import init_assets
 
 class Config:
     """應用程式設定"""
@@ -20,6 +22,7 @@ def create_app():
 
     # 建立服務實例並附加到 app
     app.manager = ExchangeRateManager()
+    app.manager.jobs.init_app(app)
 
     with app.app_context():
         # 設定中文字體
@@ -40,13 +43,17 @@ def create_app():
         # 引入並註冊藍圖
         from . import routes
         app.register_blueprint(routes.bp)
+        # JSON 與 SSE 回應依 Accept-Encoding 壓縮
+        init_compression(app)
+        # 帶內容指紋、可永久快取的 JS/CSS 與貨幣列表
+        init_assets(app)
 
         # 在應用程式啟動時執行一次性任務
         print("🧹 清理舊的圖表文件...")
         app.manager._cleanup_charts_directory(app.manager.charts_dir, max_age_days=0)
         
         print("🔄 啟動時更新數據...")
-        app.manager.update_data(180)
+        app.manager.update_data()
         
         print("📊 預生成圖表...")
         app.manager.warm_up_chart_cache()
@@ -0,0 +1,220 @@
+import os
+import json
+import time
+import uuid
+import bisect
+from threading import Lock
+
+import requests
+
+from . import metrics
+from .utils import atomic_write_json
+
+# 匯率提醒規則的存放位置
+ALERTS_FILE = os.path.join('data', 'alerts.json')
+
+# 全部貨幣對合計最多可登記的提醒數
+MAX_ALERTS = int(os.environ.get('MAX_ALERTS', 10000))
+
+# 觸發時推送的本地 webhook（留空則只經由 SSE 通知）
+ALERT_WEBHOOK_URL = os.environ.get('ALERT_WEBHOOK_URL', '')
+ALERT_WEBHOOK_TIMEOUT = float(os.environ.get('ALERT_WEBHOOK_TIMEOUT', 5))
+
+ABOVE = 'above'
+BELOW = 'below'
+DIRECTIONS = (ABOVE, BELOW)
+
+# 規則 ID 為 12 位十六進位字串；二分搜尋以這兩個值代表同一門檻下最小/最大的 ID
+_MIN_ID = ''
+_MAX_ID = 'g'
+
+
+class _PairIndex:
+    __slots__ = ('above', 'below', 'last_rate', 'last_date')
+
+    def __init__(self):
+        """單一貨幣對的門檻索引：各方向一個依 (門檻, 規則 ID) 排序的列表"""
+        self.above = []
+        self.below = []
+        self.last_rate = None
+        self.last_date = None
+
+    def side(self, direction):
+        return self.above if direction == ABOVE else self.below
+
+
+class AlertEngine:
+    def __init__(self, path=ALERTS_FILE, max_alerts=MAX_ALERTS):
+        """
+        匯率門檻提醒。每組貨幣對把「高於」與「低於」的門檻各存成一個排序列表，
+        新匯率到達時以前一筆與新匯率做兩次二分搜尋，只取出被跨越的那一段：
+        上漲時觸發 前值 < 門檻 <= 新值 的 above 規則，下跌時觸發 新值 <= 門檻 < 前值 的 below 規則。
+        評估成本為 O(log n + 觸發數)，與登記的規則總數無關。
+        """
+        self.path = path
+        self.max_alerts = max_alerts
+        self.lock = Lock()
+        self._rules = {}    # 規則 ID -> 規則 dict
+        self._pairs = {}    # (buy, sell) -> _PairIndex
+        self._dirty = False
+        self._load()
+
+    def _load(self):
+        if not os.path.exists(self.path):
+            return
+        try:
+            with open(self.path, 'r', encoding='utf-8') as f:
+                state = json.load(f)
+        except (json.JSONDecodeError, IOError) as e:
+            print(f"載入匯率提醒時發生錯誤: {e}")
+            return
+        for rule in state.get('rules', []):
+            self._index(rule)
+        for key, last in state.get('last_rates', {}).items():
+            index = self._pair(*key.split('-'))
+            index.last_rate, index.last_date = last['rate'], last['date']
+
+    def save(self):
+        """有變更時才落盤"""
+        with self.lock:
+            if not self._dirty:
+                return
+            state = {
+                'rules': list(self._rules.values()),
+                'last_rates': {f"{b}-{s}": {'rate': index.last_rate, 'date': index.last_date}
+                               for (b, s), index in self._pairs.items() if index.last_rate is not None},
+            }
+            self._dirty = False
+        os.makedirs(os.path.dirname(self.path) or '.', exist_ok=True)
+        atomic_write_json(self.path, state, ensure_ascii=False)
+
+    def _pair(self, buy_currency, sell_currency):
+        """取得（必要時建立）貨幣對索引（內部方法，呼叫端需持有鎖或在初始化中）"""
+        index = self._pairs.get((buy_currency, sell_currency))
+        if index is None:
+            index = self._pairs[(buy_currency, sell_currency)] = _PairIndex()
+        return index
+
+    def _index(self, rule):
+        self._rules[rule['id']] = rule
+        index = self._pair(rule['buy_currency'], rule['sell_currency'])
+        bisect.insort(index.side(rule['direction']), (rule['threshold'], rule['id']))
+
+    def add(self, buy_currency, sell_currency, direction, threshold, repeat=False, note=None):
+        """
+        登記提醒，返回規則 dict。repeat 為 False 時觸發一次後自動移除，
+        否則每次匯率重新跨越門檻都會再觸發。
+        """
+        if direction not in DIRECTIONS:
+            raise ValueError(f"direction 必須是 {' 或 '.join(DIRECTIONS)}")
+        threshold = float(threshold)
+        if not threshold > 0:
+            raise ValueError('threshold 必須是正數')
+        rule = {
+            'id': uuid.uuid4().hex[:12],
+            'buy_currency': buy_currency,
+            'sell_currency': sell_currency,
+            'direction': direction,
+            'threshold': threshold,
+            'repeat': bool(repeat),
+            'note': (str(note)[:200] if note else None),
+            'created_at': time.time(),
+            'triggered_count': 0,
+        }
+        with self.lock:
+            if len(self._rules) >= self.max_alerts:
+                raise OverflowError(f'提醒數量已達上限 {self.max_alerts}')
+            self._index(rule)
+            self._dirty = True
+        return dict(rule)
+
+    def remove(self, rule_id):
+        """移除提醒，返回被移除的規則（不存在時為 None）"""
+        with self.lock:
+            rule = self._rules.pop(rule_id, None)
+            if rule is None:
+                return None
+            side = self._pairs[(rule['buy_currency'], rule['sell_currency'])].side(rule['direction'])
+            position = bisect.bisect_left(side, (rule['threshold'], rule_id))
+            if position < len(side) and side[position][1] == rule_id:
+                del side[position]
+            self._dirty = True
+        return rule
+
+    def list(self, pairs=None):
+        with self.lock:
+            rules = [dict(rule) for rule in self._rules.values()
+                     if pairs is None or (rule['buy_currency'], rule['sell_currency']) in pairs]
+        return sorted(rules, key=lambda rule: rule['created_at'])
+
+    def last_rate(self, buy_currency, sell_currency):
+        with self.lock:
+            index = self._pairs.get((buy_currency, sell_currency))
+            return (index.last_rate, index.last_date) if index else (None, None)
+
+    def count(self):
+        with self.lock:
+            return len(self._rules)
+
+    def seed(self, buy_currency, sell_currency, rate, date_str):
+        """登記提醒時以目前已知的匯率作為比較基準（已有基準時不覆寫）"""
+        with self.lock:
+            index = self._pair(buy_currency, sell_currency)
+            if index.last_rate is None and rate is not None:
+                index.last_rate, index.last_date = rate, date_str
+                self._dirty = True
+
+    def observe(self, buy_currency, sell_currency, rate, date_str):
+        """
+        新匯率到達時呼叫，返回被觸發的規則列表（附 rate、previous_rate、date）。
+        早於上次評估日期的數據（例如回填舊日期）不會觸發；沒有任何規則的貨幣對只記錄基準。
+        """
+        with self.lock:
+            index = self._pair(buy_currency, sell_currency)
+            if index.last_date is not None and date_str < index.last_date:
+                return []
+            previous = index.last_rate
+            index.last_rate, index.last_date = rate, date_str
+            self._dirty = True
+            if previous is None or rate == previous:
+                return []
+
+            # 上漲只可能跨越 above 門檻，下跌只可能跨越 below 門檻；被跨越的規則在排序列表中是連續的一段
+            if rate > previous:
+                side = index.above
+                lo = bisect.bisect_right(side, (previous, _MAX_ID))
+                hi = bisect.bisect_right(side, (rate, _MAX_ID))
+            else:
+                side = index.below
+                lo = bisect.bisect_left(side, (rate, _MIN_ID))
+                hi = bisect.bisect_left(side, (previous, _MIN_ID))
+            if lo >= hi:
+                return []
+
+            crossed = side[lo:hi]
+            side[lo:hi] = [entry for entry in crossed if self._rules[entry[1]]['repeat']]
+            triggered = []
+            for _, rule_id in crossed:
+                rule = self._rules[rule_id]
+                rule['triggered_count'] += 1
+                rule['last_triggered_at'] = time.time()
+                if not rule['repeat']:
+                    del self._rules[rule_id]
+                triggered.append({**rule, 'rate': rate, 'previous_rate': previous, 'date': date_str})
+        return triggered
+
+
+def deliver_webhook(alerts, url=None, timeout=ALERT_WEBHOOK_TIMEOUT):
+    """把一批觸發的提醒以 JSON POST 到 webhook；失敗只記錄，不重試"""
+    url = url or ALERT_WEBHOOK_URL
+    if not url:
+        return False
+    try:
+        response = requests.post(url, json={'alerts': alerts}, timeout=timeout)
+        response.raise_for_status()
+    except requests.exceptions.RequestException as e:
+        print(f"❌ 匯率提醒 webhook 推送失敗: {e}")
+        metrics.ALERT_WEBHOOK_DELIVERIES.inc('failed')
+        return False
+    metrics.ALERT_WEBHOOK_DELIVERIES.inc('ok')
+    return True
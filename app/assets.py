@@ -0,0 +1,183 @@
+import os
+import json
+import hashlib
+from threading import Lock
+
+from flask import Response, current_app, request, abort
+from markupsafe import Markup
+
+from .compression import choose_encoding, compress_bytes, COMPRESS_MIN_BYTES
+
+# 加上內容指紋並長期快取的靜態資源（圖表圖片另有自己的檔名雜湊，不在此列）
+ASSET_DIRS = ('js', 'css')
+ASSET_FILES = ('currency_list.json',)
+ASSET_URL_PREFIX = '/assets'
+
+# 是否把貨幣列表直接嵌入頁面，省下首次載入的一個請求
+INLINE_CURRENCY_LIST = os.environ.get('INLINE_CURRENCY_LIST', '1').lower() not in ('0', 'false', 'no')
+
+HASH_LENGTH = 10
+IMMUTABLE_CACHE = 'public, max-age=31536000, immutable'
+
+# 圖表圖片的檔名含數據雜湊，內容不會改變；保留一天（伺服器也只保留一天內的圖表檔）
+CHART_IMAGE_PREFIX = '/static/charts/'
+CHART_IMAGE_CACHE = 'public, max-age=86400'
+
+MIMETYPES = {
+    '.js': 'text/javascript; charset=utf-8',
+    '.css': 'text/css; charset=utf-8',
+    '.json': 'application/json; charset=utf-8',
+}
+
+
+class Asset:
+    __slots__ = ('path', 'digest', 'mtime', 'size', 'body', 'encoded')
+
+    def __init__(self, path, body, mtime):
+        """單一靜態資源：原始內容與預先壓縮好的各編碼版本"""
+        self.path = path
+        self.body = body
+        self.mtime = mtime
+        self.size = len(body)
+        self.digest = hashlib.blake2b(body, digest_size=16).hexdigest()[:HASH_LENGTH]
+        self.encoded = {}
+
+    @property
+    def fingerprinted_path(self):
+        """js/main.js -> js/main.3f2a9c1b0d.js"""
+        stem, ext = os.path.splitext(self.path)
+        return f"{stem}.{self.digest}{ext}"
+
+    def get_body(self, encoding):
+        """返回指定編碼的內容；壓縮結果只算一次"""
+        if encoding is None or self.size < COMPRESS_MIN_BYTES:
+            return self.body, None
+        if encoding not in self.encoded:
+            self.encoded[encoding] = compress_bytes(self.body, encoding)
+        return self.encoded[encoding], encoding
+
+
+class AssetManifest:
+    def __init__(self, static_dir):
+        """
+        靜態資源清單：邏輯路徑（例如 js/main.js）-> Asset。
+        啟動時建立一次；只有在 debug 模式下才於每次請求前以檔案修改時間檢查是否需要重新載入，
+        開發時修改檔案不必重啟，正式環境不必每個請求都 stat 整個資源目錄。
+        """
+        self.static_dir = static_dir
+        self.lock = Lock()
+        self._assets = {}
+        self._by_fingerprint = {}
+        self.refresh()
+
+    def _scan(self):
+        paths = [name for name in ASSET_FILES if os.path.isfile(os.path.join(self.static_dir, name))]
+        for directory in ASSET_DIRS:
+            root = os.path.join(self.static_dir, directory)
+            if not os.path.isdir(root):
+                continue
+            for dirpath, _, filenames in os.walk(root):
+                for filename in filenames:
+                    if os.path.splitext(filename)[1] in MIMETYPES:
+                        full_path = os.path.join(dirpath, filename)
+                        paths.append(os.path.relpath(full_path, self.static_dir).replace(os.path.sep, '/'))
+        return sorted(paths)
+
+    def refresh(self):
+        """重新載入有變動的檔案（只在修改時間改變時讀檔）"""
+        with self.lock:
+            assets = {}
+            for path in self._scan():
+                full_path = os.path.join(self.static_dir, path)
+                mtime = os.path.getmtime(full_path)
+                current = self._assets.get(path)
+                if current is not None and current.mtime == mtime:
+                    assets[path] = current
+                    continue
+                with open(full_path, 'rb') as f:
+                    assets[path] = Asset(path, f.read(), mtime)
+            self._assets = assets
+            self._by_fingerprint = {asset.fingerprinted_path: asset for asset in assets.values()}
+
+    def refresh_if_debug(self):
+        """debug 模式下重新載入有變動的檔案（正式環境的清單在啟動時就固定）"""
+        if current_app.debug:
+            self.refresh()
+
+    def get(self, path):
+        return self._assets.get(path)
+
+    def url(self, path):
+        """模板使用的資源網址；不在清單中的檔案退回一般的 /static 網址"""
+        asset = self._assets.get(path)
+        if asset is None:
+            return f"/static/{path}"
+        return f"{ASSET_URL_PREFIX}/{asset.fingerprinted_path}"
+
+    def import_map(self):
+        """
+        ES 模組的 import map：模組內的相對匯入（./api.js）解析成 /assets/js/api.js，
+        再由瀏覽器對應到帶指紋的網址，模組原始碼不必改寫。
+        """
+        imports = {f"{ASSET_URL_PREFIX}/{path}": self.url(path)
+                   for path in self._assets if path.endswith('.js')}
+        return Markup(json.dumps({'imports': imports}, indent=2))
+
+    def module_urls(self):
+        return [self.url(path) for path in self._assets if path.endswith('.js')]
+
+    def inline_json(self, path):
+        """嵌入頁面的 JSON（轉義 </ 避免提早結束 script 標籤）"""
+        asset = self._assets.get(path)
+        if asset is None:
+            return None
+        return Markup(asset.body.decode('utf-8').replace('</', '<\\/'))
+
+    def serve(self, filename):
+        """
+        提供 /assets/ 下的檔案：帶指紋的網址永久快取；不帶指紋的網址（舊瀏覽器不支援 import map 時）
+        每次都要重新驗證。指紋與目前內容不符時返回 404，避免把新內容以舊網址長期快取。
+        """
+        self.refresh_if_debug()
+        asset = self._by_fingerprint.get(filename)
+        immutable = asset is not None
+        if asset is None:
+            asset = self._assets.get(filename)
+        if asset is None:
+            abort(404)
+
+        encoding = choose_encoding(request.headers.get('Accept-Encoding'))
+        body, encoding = asset.get_body(encoding)
+        response = Response(body, content_type=MIMETYPES[os.path.splitext(asset.path)[1]])
+        if encoding:
+            response.headers['Content-Encoding'] = encoding
+        response.headers['Vary'] = 'Accept-Encoding'
+        response.set_etag(f"{asset.digest}-{encoding or 'identity'}")
+        response.headers['Cache-Control'] = IMMUTABLE_CACHE if immutable else 'no-cache'
+        return response.make_conditional(request)
+
+
+def init_assets(app):
+    """建立資源清單、註冊 /assets 路由與模板函式"""
+    manifest = AssetManifest(app.static_folder)
+    app.assets = manifest
+    app.add_url_rule(f"{ASSET_URL_PREFIX}/<path:filename>", 'assets', manifest.serve)
+
+    @app.after_request
+    def cache_chart_images(response):
+        # 預設的靜態檔案每次都要重新驗證，圖表圖片換成可直接使用的快取，重複瀏覽不必再發請求
+        if request.path.startswith(CHART_IMAGE_PREFIX) and response.status_code in (200, 304):
+            response.headers['Cache-Control'] = CHART_IMAGE_CACHE
+        return response
+
+    @app.context_processor
+    def asset_helpers():
+        manifest.refresh_if_debug()
+        return {
+            'asset_url': manifest.url,
+            'asset_import_map': manifest.import_map,
+            'asset_module_urls': manifest.module_urls,
+            'inline_currency_list': manifest.inline_json('currency_list.json') if INLINE_CURRENCY_LIST else None,
+        }
+
+    return manifest
@@ -0,0 +1,99 @@
+import io
+import os
+from collections import namedtuple
+
+from PIL import Image
+
+from .utils import temp_path
+
+# 支援的圖表格式與對應的 MIME 類型
+FORMATS = {'png': 'image/png', 'webp': 'image/webp', 'svg': 'image/svg+xml'}
+
+# 預設輸出：1500px 寬的 PNG（與原本 15x8.5 吋、100 DPI 的圖表相同）
+DEFAULT_FORMAT = 'png'
+DEFAULT_WIDTH = 1500
+DEFAULT_DPI = 100
+ASPECT_RATIO = 8.5 / 15
+
+MIN_WIDTH, MAX_WIDTH = 320, 2400
+MIN_DPI, MAX_DPI = 50, 300
+
+# 量化時保留的顏色數；圖表只有少數幾種線色與文字反鋸齒，256 色已看不出差異
+PALETTE_COLORS = int(os.environ.get('CHART_PALETTE_COLORS', 256))
+
+
+class ChartVariant(namedtuple('ChartVariant', ['format', 'width', 'dpi'])):
+    """圖表的輸出格式、像素寬度與 DPI；同一份數據的各變體以不同檔名並存"""
+    __slots__ = ()
+
+    @property
+    def is_default(self):
+        return self == DEFAULT_VARIANT
+
+    @property
+    def key(self):
+        """檔名與快取鍵的後綴，例如 'webp-600w-100dpi'"""
+        return f"{self.format}-{self.width}w-{self.dpi}dpi"
+
+    @property
+    def extension(self):
+        return self.format
+
+    @property
+    def mimetype(self):
+        return FORMATS[self.format]
+
+    @property
+    def figsize(self):
+        width_inches = self.width / self.dpi
+        return width_inches, width_inches * ASPECT_RATIO
+
+    @property
+    def scale(self):
+        """小圖縮小字級與邊界，避免文字擠滿畫面；12 吋以上維持原本大小"""
+        return max(0.7, min(1.0, self.figsize[0] / 12))
+
+
+DEFAULT_VARIANT = ChartVariant(DEFAULT_FORMAT, DEFAULT_WIDTH, DEFAULT_DPI)
+
+
+def parse_variant(args):
+    """
+    從請求參數 format/width/dpi 解析圖表變體；都沒提供時返回 None（使用預設圖表）。
+    格式不支援時拋出 ValueError，寬度與 DPI 會限制在合理範圍內。
+    """
+    if not any(args.get(name) for name in ('format', 'width', 'dpi')):
+        return None
+    fmt = (args.get('format') or DEFAULT_FORMAT).lower()
+    if fmt not in FORMATS:
+        raise ValueError(f"不支援的圖表格式: {fmt}（可用 {', '.join(FORMATS)}）")
+    try:
+        width = int(args.get('width') or DEFAULT_WIDTH)
+        dpi = int(args.get('dpi') or DEFAULT_DPI)
+    except ValueError:
+        raise ValueError('width 與 dpi 必須是整數')
+    variant = ChartVariant(fmt, max(MIN_WIDTH, min(MAX_WIDTH, width)), max(MIN_DPI, min(MAX_DPI, dpi)))
+    return None if variant.is_default else variant
+
+
+def save_figure(fig, path, variant):
+    """
+    依變體輸出圖表，先寫暫存檔再替換，讀取端不會看到寫到一半的檔案。
+    點陣格式只繪製一次，先轉為調色盤圖片（圖表顏色很少，畫質不變），
+    PNG 以最佳化壓縮輸出，WebP 以無損壓縮輸出（大片單色的圖表有損壓縮反而較大）；SVG 直接交給 matplotlib。
+    """
+    tmp_path = temp_path(path)
+    if variant.format == 'svg':
+        fig.savefig(tmp_path, format='svg', facecolor='white')
+    else:
+        fig.canvas.draw()
+        image = Image.frombuffer('RGBA', fig.canvas.get_width_height(), fig.canvas.buffer_rgba(), 'raw', 'RGBA', 0, 1)
+        image = image.convert('RGB').quantize(colors=PALETTE_COLORS, method=Image.Quantize.FASTOCTREE)
+        buffer = io.BytesIO()
+        if variant.format == 'png':
+            image.save(buffer, format='PNG', optimize=True)
+        else:
+            image.save(buffer, format='WEBP', lossless=True, method=4)
+        with open(tmp_path, 'wb') as f:
+            f.write(buffer.getvalue())
+    os.replace(tmp_path, path)
@@ -0,0 +1,24 @@
+import pandas as pd
+
+# 一張比較圖最多幾組貨幣對
+MAX_COMPARE_PAIRS = 6
+
+# 各貨幣對的線條顏色（第一條與單一貨幣對圖表相同）
+COMPARE_COLORS = ('#2E86AB', '#A23B72', '#F18F01', '#C73E1D', '#6A994E', '#5C4D7D')
+
+
+def align_series(series_by_label, rebase=False):
+    """
+    把多條 (dates_str, rates) 序列以日期外連接對齊成一個 DataFrame（欄為貨幣對）。
+    各貨幣對的發布日不同（例如各地假日），缺值以前一個發布日的匯率補上，
+    並從所有貨幣對都有數據的第一天開始；rebase 時以該天為 100 換算成指數。
+    """
+    frame = pd.concat(
+        {label: pd.Series(rates, index=pd.DatetimeIndex(dates), dtype='float64')
+         for label, (dates, rates) in series_by_label.items()},
+        axis=1, join='outer',
+    ).sort_index()
+    frame = frame.ffill().dropna()
+    if rebase and not frame.empty:
+        frame = frame.div(frame.iloc[0]).mul(100)
+    return frame
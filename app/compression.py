@@ -0,0 +1,158 @@
+import os
+import zlib
+
+from flask import request
+
+from . import metrics
+
+try:
+    import brotli
+except ImportError:  # Brotli 為選用套件，未安裝時只提供 gzip
+    brotli = None
+
+# 小於此大小的回應不壓縮（壓縮標頭與 CPU 成本不划算）
+COMPRESS_MIN_BYTES = int(os.environ.get('COMPRESS_MIN_BYTES', 1024))
+GZIP_LEVEL = int(os.environ.get('COMPRESS_GZIP_LEVEL', 6))
+# Brotli 品質 0-11；動態內容取中等品質，壓縮率已明顯優於 gzip
+BROTLI_QUALITY = int(os.environ.get('COMPRESS_BROTLI_QUALITY', 5))
+
+# 會壓縮的內容類型（圖片等已壓縮的格式不處理）
+COMPRESSIBLE_TYPES = ('application/json', 'text/html', 'text/plain', 'text/css',
+                      'text/javascript', 'application/javascript', 'image/svg+xml')
+SSE_TYPE = 'text/event-stream'
+# 串流回應逐塊壓縮（SSE 與大量匯出）；其他串流回應維持原樣
+STREAM_TYPES = (SSE_TYPE, 'text/csv', 'application/x-ndjson')
+
+
+def available_encodings():
+    return ('br', 'gzip') if brotli is not None else ('gzip',)
+
+
+def choose_encoding(accept_encoding):
+    """
+    依 Accept-Encoding 挑選編碼，優先 br 再 gzip；q=0 表示明確拒絕。
+    都不接受時返回 None（不壓縮）。
+    """
+    accepted = {}
+    for item in (accept_encoding or '').split(','):
+        name, _, params = item.strip().partition(';')
+        name = name.strip().lower()
+        if not name:
+            continue
+        quality = 1.0
+        for param in params.split(';'):
+            key, _, value = param.strip().partition('=')
+            if key.strip() == 'q':
+                try:
+                    quality = float(value)
+                except ValueError:
+                    quality = 0.0
+        accepted[name] = quality
+
+    best, best_quality = None, 0.0
+    for encoding in available_encodings():
+        quality = accepted.get(encoding, accepted.get('*', 0.0))
+        if quality > best_quality:
+            best, best_quality = encoding, quality
+    return best
+
+
+class StreamCompressor:
+    def __init__(self, encoding):
+        """
+        串流壓縮器：每次 compress 都把目前為止的內容完整送出（SSE 每個事件都要立即到達）。
+        整條連線共用同一個壓縮字典，重複的事件內容之後只需幾個位元組。
+        """
+        self.encoding = encoding
+        if encoding == 'br':
+            self._compressor = brotli.Compressor(quality=BROTLI_QUALITY)
+        else:
+            # wbits=31 產生帶 gzip 標頭的串流
+            self._compressor = zlib.compressobj(GZIP_LEVEL, zlib.DEFLATED, 31)
+
+    def compress(self, data):
+        if self.encoding == 'br':
+            return self._compressor.process(data) + self._compressor.flush()
+        return self._compressor.compress(data) + self._compressor.flush(zlib.Z_SYNC_FLUSH)
+
+    def finish(self):
+        if self.encoding == 'br':
+            return self._compressor.finish()
+        return self._compressor.flush(zlib.Z_FINISH)
+
+
+def compress_bytes(data, encoding):
+    """一次壓縮完整的回應主體"""
+    if encoding == 'br':
+        return brotli.compress(data, quality=BROTLI_QUALITY)
+    compressor = zlib.compressobj(GZIP_LEVEL, zlib.DEFLATED, 31)
+    return compressor.compress(data) + compressor.flush()
+
+
+def _compressed_stream(chunks, encoding, kind):
+    """逐塊壓縮串流回應；客戶端斷線時關閉原本的產生器，讓其清理邏輯照常執行"""
+    compressor = StreamCompressor(encoding)
+    try:
+        for chunk in chunks:
+            if isinstance(chunk, str):
+                chunk = chunk.encode('utf-8')
+            compressed = compressor.compress(chunk)
+            metrics.RESPONSE_RAW_BYTES.inc(kind, encoding, amount=len(chunk))
+            metrics.RESPONSE_SENT_BYTES.inc(kind, encoding, amount=len(compressed))
+            yield compressed
+        yield compressor.finish()
+    finally:
+        close = getattr(chunks, 'close', None)
+        if close is not None:
+            close()
+
+
+def _add_vary(response):
+    vary = {value.strip().lower() for value in response.headers.get('Vary', '').split(',') if value.strip()}
+    if 'accept-encoding' not in vary:
+        response.headers.add('Vary', 'Accept-Encoding')
+
+
+def compress_response(response):
+    """
+    after_request：依 Accept-Encoding 壓縮 JSON/文字回應、SSE 與匯出串流。
+    可壓縮的內容一律加上 Vary: Accept-Encoding，讓快取依編碼分開存放。
+    """
+    mimetype = response.mimetype or ''
+    is_stream = mimetype in STREAM_TYPES and response.is_streamed
+    if not is_stream and mimetype not in COMPRESSIBLE_TYPES:
+        return response
+    # 靜態檔案等直接傳遞的回應不讀入記憶體，也不壓縮
+    if not is_stream and (response.direct_passthrough or response.is_streamed):
+        return response
+    _add_vary(response)
+
+    if (request.method == 'HEAD' or response.status_code < 200 or response.status_code in (204, 304)
+            or 'Content-Encoding' in response.headers):
+        return response
+    encoding = choose_encoding(request.headers.get('Accept-Encoding'))
+    if encoding is None:
+        return response
+
+    if is_stream:
+        kind = 'sse' if mimetype == SSE_TYPE else 'export'
+        response.response = _compressed_stream(response.response, encoding, kind)
+        response.headers['Content-Encoding'] = encoding
+        response.headers.pop('Content-Length', None)
+        # 避免反向代理再緩衝或重新壓縮串流
+        response.headers['X-Accel-Buffering'] = 'no'
+        return response
+
+    data = response.get_data()
+    if len(data) < COMPRESS_MIN_BYTES:
+        return response
+    compressed = compress_bytes(data, encoding)
+    metrics.RESPONSE_RAW_BYTES.inc('body', encoding, amount=len(data))
+    metrics.RESPONSE_SENT_BYTES.inc('body', encoding, amount=len(compressed))
+    response.set_data(compressed)
+    response.headers['Content-Encoding'] = encoding
+    return response
+
+
+def init_compression(app):
+    app.after_request(compress_response)
@@ -0,0 +1,51 @@
+import numpy as np
+
+
+def lttb_indices(x, y, threshold):
+    """
+    Largest-Triangle-Three-Buckets 降採樣，返回保留點的索引（已排序，含首尾）。
+    每個區間內的三角形面積以 NumPy 一次算完，迴圈次數只和 threshold 有關，與原始點數無關。
+    """
+    x = np.asarray(x, dtype=np.float64)
+    y = np.asarray(y, dtype=np.float64)
+    n = len(x)
+    if threshold >= n or threshold < 3:
+        return np.arange(n)
+
+    # 首尾兩點固定保留，中間 n-2 個點平均分成 threshold-2 個區間
+    edges = np.floor(np.linspace(1, n - 1, threshold - 1)).astype(np.int64)
+    selected = np.empty(threshold, dtype=np.int64)
+    selected[0] = 0
+    selected[-1] = n - 1
+
+    prev = 0
+    for i in range(threshold - 2):
+        start, end = edges[i], edges[i + 1]
+        # 下一個區間的平均點（最後一個區間以終點代替）
+        if i + 2 < len(edges):
+            next_start, next_end = edges[i + 1], edges[i + 2]
+            avg_x = x[next_start:next_end].mean()
+            avg_y = y[next_start:next_end].mean()
+        else:
+            avg_x, avg_y = x[n - 1], y[n - 1]
+
+        bucket_x = x[start:end]
+        bucket_y = y[start:end]
+        areas = np.abs((x[prev] - avg_x) * (bucket_y - y[prev]) - (x[prev] - bucket_x) * (avg_y - y[prev]))
+        prev = start + int(np.argmax(areas))
+        selected[i + 1] = prev
+
+    return selected
+
+
+def lttb(dates, values, threshold, x=None):
+    """
+    對日期/數值序列做 LTTB 降採樣，返回 (dates, values) 列表。
+    x 預設使用索引；傳入日期序數可讓不等距的資料以真實時間計算面積。
+    """
+    if threshold is None or len(values) <= threshold:
+        return list(dates), list(values)
+    if x is None:
+        x = np.arange(len(values))
+    indices = lttb_indices(x, values, threshold)
+    return [dates[i] for i in indices], [values[i] for i in indices]
@@ -3,25 +3,74 @@ import json
 import time
 import hashlib
 import requests
+import numpy as np
 import matplotlib.pyplot as plt
 from datetime import datetime, timedelta
 from threading import Lock, Thread
-from concurrent.futures import ThreadPoolExecutor, as_completed
 import concurrent.futures
 from matplotlib.ticker import MaxNLocator, FuncFormatter
 from flask import current_app
 
-from .utils import LRUCache, RateLimiter
+from .utils import LRUCache, RateLimiter, atomic_write_json
 from .sse import send_sse_event
+from .rate_store import RateStore
+from .rate_series import RateSeries, load_series, save_binary
+from .rollups import RollupStore, WEEKLY, MONTHLY, aggregate, merge_buckets
+from .downsample import lttb_indices
+from .fetch_planner import FetchPlanner
+from .job_scheduler import JobScheduler, SchedulerBusyError, INTERACTIVE, PROGRESSIVE, WARMUP
+from .interest import InterestTracker
+from .popularity import PopularityTracker
+from .window_stats import SlidingWindowStats, series_hash
+from . import metrics
+from .tracing import traced, span
+from .upstream_archive import UpstreamArchive
+from .chart_variants import DEFAULT_VARIANT, save_figure
+from .sparklines import render_sparklines
+from .comparison import align_series, COMPARE_COLORS
+from .alerts import AlertEngine, ABOVE, ALERT_WEBHOOK_URL, deliver_webhook
+from .indicators import (IndicatorCache, align as align_indicator, compute_for_dates, is_price_scale, spec_label,
+                         to_dates, to_json)
 
 # 數據文件路徑
 DATA_FILE = 'TWD-HKD_180d.json'
-rate_limiter = RateLimiter(max_requests_per_second=5)
+# 上游每秒請求上限；對本地模擬服務做負載測試時可調高
+UPSTREAM_RPS = float(os.environ.get('RATE_UPSTREAM_RPS', 5))
+rate_limiter = RateLimiter(max_requests_per_second=UPSTREAM_RPS)
+
+# 上游匯率 API，可透過環境變數改指向本地模擬服務
+UPSTREAM_URL = os.environ.get(
+    'RATE_UPSTREAM_URL',
+    "https://www.mastercard.com/marketingservices/public/mccom-services/currency-conversions/conversion-rates"
+)
+
+# 各期間生成圖表前需要的最少數據點（約為期間內的工作日數）
+CHART_GENERATION_CHECKPOINTS = {7: 5, 30: 21, 90: 65, 180: 129}
+
+# 分層保留：近 RAW_RETENTION_DAYS 天保留日資料，更舊的折疊為週 OHLC，
+# 週資料超過 WEEKLY_RETENTION_DAYS 天後再折疊為月 OHLC
+RAW_RETENTION_DAYS = int(os.environ.get('RATE_RETENTION_DAYS', 180))
+WEEKLY_RETENTION_DAYS = int(os.environ.get('ROLLUP_WEEKLY_DAYS', 1830))
+
+# HTTP 請求等待排程任務（互動繪圖、抓取最新匯率）的時限（秒），逾時回 503 或提供本地舊值
+INTERACTIVE_WAIT_SECONDS = float(os.environ.get('INTERACTIVE_WAIT_SECONDS', 20))
+
+# 背景任務為新貨幣對抓取的日資料天數；不超過日資料保留期，否則會把已折疊進彙總的日期再抓回來
+BACKGROUND_FETCH_DAYS = min(180, RAW_RETENTION_DAYS)
+
+# 長區間期間（1年/5年），由日資料加彙總數據提供
+LONG_RANGE_PERIODS = (365, 1825)
+
+# 疊加指標的線條顏色
+INDICATOR_COLORS = ('#6A994E', '#A23B72', '#5C4D7D', '#C73E1D', '#8D6A9F')
 
 
 class ExchangeRateManager:
-    def __init__(self):
+    def __init__(self, upstream_url=None):
         self.data = self.load_data()
+        self.upstream_url = upstream_url or UPSTREAM_URL
+        # 上游錄製/回放（RATE_UPSTREAM_MODE=record/replay），live 模式為 None
+        self.archive = UpstreamArchive.from_env()
         self._network_paused = False
         self._pause_until = 0
         self._pause_lock = Lock()
@@ -35,50 +84,78 @@ class ExchangeRateManager:
         # 初始化 LRU 快取
         self.lru_cache = LRUCache(capacity=60, ttl_seconds=86400)
 
+        # 圖表變體（格式、寬度、DPI）的快取，以 (貨幣對, 期間, 內容雜湊, 變體) 為鍵
+        self.variant_cache = LRUCache(capacity=120, ttl_seconds=86400)
+
+        # 歷史記錄縮圖的快取，以 (貨幣對, 期間, 內容雜湊) 為鍵
+        self.sparkline_cache = LRUCache(capacity=200, ttl_seconds=86400)
+
+        # 技術指標（移動平均、布林通道等）的完整歷史計算結果，新數據寫入時增量延伸
+        self.indicator_cache = IndicatorCache()
+
         # 新增：用於今日匯率的快取 (與圖表快取使用相同的 TTL)
         self.latest_rate_cache = LRUCache(capacity=50, ttl_seconds=86400) # 24 hours
 
-        # 新增：用於協調背景抓取的屬性
-        self.background_executor = ThreadPoolExecutor(max_workers=5, thread_name_prefix='ChartGen')
-        self._active_fetch_lock = Lock()
-        self._active_fetches = set()
+        # 統一的背景工作排程器（抓取、繪圖、預熱），同一貨幣對的背景抓取以任務 key 去重
+        self.jobs = JobScheduler()
+        # 貨幣對關注度（SSE 客戶端與近期請求），無人關注的背景抓取會被取消
+        self.interest = InterestTracker()
+        # 貨幣對存取頻率（指數衰減），定時刷新據此挑選熱門貨幣對
+        self.popularity = PopularityTracker()
+        # 匯率門檻提醒：新匯率寫入時只評估被跨越的門檻區段
+        self.alerts = AlertEngine()
+
+        # 日資料期間的滑動窗口統計 (buy, sell, days) -> SlidingWindowStats，用於增量更新圖表
+        self.windows = {}
+        self._windows_lock = Lock()
 
         # 主數據鎖
         self.data_lock = Lock()
 
+        # 其他貨幣對的本地歷史數據
+        self.store = RateStore()
+        # 超過保留期的週/月彙總數據（所有貨幣對，包括 TWD-HKD）
+        self.rollups = RollupStore()
+
+        # 抓取規劃器：發布日曆與負面快取，並以既有的 TWD-HKD 數據初始化日曆
+        self.planner = FetchPlanner()
+        self.planner.learn_from_series('TWD', 'HKD', self.data.rates_between())
+
     def load_data(self):
-        """載入本地數據"""
-        if os.path.exists(DATA_FILE):
-            try:
-                with open(DATA_FILE, 'r', encoding='utf-8') as f:
-                    return json.load(f)
-            except (json.JSONDecodeError, IOError) as e:
-                print(f"載入數據時發生錯誤: {e}")
-                return {}
-        return {}
+        """載入本地數據（優先以 mmap 映射 .fxs 二進位檔，不存在或過期時解析 JSON 並重建）"""
+        try:
+            return load_series(DATA_FILE)
+        except (json.JSONDecodeError, IOError) as e:
+            print(f"載入數據時發生錯誤: {e}")
+            return RateSeries()
 
     def save_data(self):
         """保存數據到本地"""
         with self.data_lock:
-            with open(DATA_FILE, 'w', encoding='utf-8') as f:
-                json.dump(self.data, f, ensure_ascii=False, indent=2)
+            atomic_write_json(DATA_FILE, self.data.to_json_dict(), ensure_ascii=False, indent=2)
+            save_binary(self.data, DATA_FILE)
 
     def get_sorted_dates(self):
-        """獲取排序後的日期列表"""
-        dates = list(self.data.keys())
-        dates.sort()
-        return dates
+        """獲取排序後的日期列表（RateSeries 本身即按日期排序）"""
+        return self.data.keys()
 
     
 
+    @traced()
     def get_exchange_rate(self, date, buy_currency='TWD', sell_currency='HKD'):
         """獲取指定日期的匯率"""
+        if self.archive is not None and self.archive.replaying:
+            if self.archive.latency_scale:
+                rate_limiter.wait_if_needed()  # 重現延遲時也重現速率限制，冷啟動量測才有意義
+            return self.archive.replay(buy_currency, sell_currency, date.strftime('%Y-%m-%d'))
+
         with self._pause_lock:
             if self._network_paused:
                 if time.time() < self._pause_until:
                     if not self._pause_message_printed:
                         print(f"⏸️ 網路請求已暫停，將於 {datetime.fromtimestamp(self._pause_until).strftime('%H:%M:%S')} 恢復。")
                         self._pause_message_printed = True
+                    metrics.UPSTREAM_SKIPPED.inc('paused')
                     return None
                 else:
                     self._network_paused = False
@@ -86,7 +163,7 @@ class ExchangeRateManager:
                     self._pause_message_printed = False
                     print("🟢 網路請求暫停已解除，嘗試恢復。")
 
-        url = "https://www.mastercard.com/marketingservices/public/mccom-services/currency-conversions/conversion-rates"
+        url = self.upstream_url
 
         params = {
             'exchange_date': date.strftime('%Y-%m-%d'),
@@ -109,16 +186,27 @@ class ExchangeRateManager:
             "Referer": "https://www.mastercard.com/us/en/personal/get-support/currency-exchange-rate-converter.html"
         }
 
+        started = None
         try:
             print(f"🔍 發送 API 請求獲取 {date.strftime('%Y-%m-%d')} 的匯率數據")
+            wait_started = time.perf_counter()
             rate_limiter.wait_if_needed()
+            started = time.perf_counter()
+            metrics.RATE_LIMIT_WAIT_SECONDS.observe(started - wait_started)
             response = requests.get(url, params=params, headers=headers,
                                   timeout=(5, 15))  # 連接超時5秒，讀取超時15秒
             response.raise_for_status()
             data = response.json()
 
+            latency = time.perf_counter() - started
+            outcome = 'ok' if isinstance(data, dict) and 'data' in data else 'no_data'
+            metrics.UPSTREAM_REQUEST_SECONDS.observe(latency, outcome)
+            if self.archive is not None:
+                self.archive.record(buy_currency, sell_currency, date.strftime('%Y-%m-%d'), data, latency)
             return data
         except requests.exceptions.RequestException as e:
+            if started is not None:
+                metrics.UPSTREAM_REQUEST_SECONDS.observe(time.perf_counter() - started, 'error')
             # 觸發熔斷機制
             with self._pause_lock:
                 if not self._network_paused:
@@ -132,40 +220,29 @@ class ExchangeRateManager:
             print(f"獲取 {date.strftime('%Y-%m-%d')} 數據時{error_type}: {e}")
             return None
         except Exception as e:
+            if started is not None:
+                metrics.UPSTREAM_REQUEST_SECONDS.observe(time.perf_counter() - started, 'error')
             print(f"獲取 {date.strftime('%Y-%m-%d')} 數據時發生錯誤: {e}")
             return None
 
-    def update_data(self, days=180):  # 默認更新近180天數據
-        """數據更新：從最新日期開始補齊到今天，清理舊數據"""
+    def update_data(self, days=None):
+        """數據更新：從最新日期開始補齊到今天，並將超過保留期的舊數據折疊為週/月彙總"""
+        days = days or RAW_RETENTION_DAYS
         end_date = datetime.now().replace(hour=0, minute=0, second=0, microsecond=0)
         start_date = end_date - timedelta(days=days)
-        
+
         print(f"🔍 開始極簡數據更新（從最新日期補齊到今天）...")
-        
-        # 第一步：找出並清理180天以外的舊數據
-        old_count = len(self.data)
-        cleaned_data = {}
-        removed_count = 0
-        removed_dates = []
-        
-        for date_str, data_entry in self.data.items():
-            date_obj = datetime.strptime(date_str, '%Y-%m-%d')
-            # 保留從 start_date 開始的180天數據（包含 start_date）
-            if date_obj >= start_date:
-                # 保留180天內的數據
-                cleaned_data[date_str] = data_entry
-            else:
-                # 刪除 start_date 之前的數據
-                removed_dates.append(date_str)
-                removed_count += 1
-        
+
+        # 第一步：將保留期以外的舊數據折疊進彙總層級
+        removed_count = self.compact_pair('TWD', 'HKD', days)
         if removed_count > 0:
-            print(f"🗑️ 清理了 {removed_count} 筆180天以外的舊數據")
-            self.data = cleaned_data
-        
-        # 第二步：找到數據中的最新日期
-        if self.data:
-            latest_date_str = max(self.data.keys())
+            print(f"🗑️ 已將 {removed_count} 筆{days}天以外的舊數據折疊為週/月彙總")
+
+        # 第二步：找到數據中的最新日期（先改映射其他行程寫入的新檔）
+        with self.data_lock:
+            self.data.refresh()
+            latest_date_str = self.data.last_date
+        if latest_date_str:
             latest_date = datetime.strptime(latest_date_str, '%Y-%m-%d')
             print(f"📅 數據中最新日期：{latest_date_str}")
         else:
@@ -180,28 +257,27 @@ class ExchangeRateManager:
         if start_fetch_date <= end_date:
             print(f"🚀 從 {start_fetch_date.strftime('%Y-%m-%d')} 獲取到 {end_date.strftime('%Y-%m-%d')}")
             
+            candidate_dates = []
             current_date = start_fetch_date
             while current_date <= end_date:
-                date_str = current_date.strftime('%Y-%m-%d')
-                
-                # 跳過週末
-                if current_date.weekday() < 5:  # Monday=0, Friday=4
-                    data = self.get_exchange_rate(current_date)
-                    
-                    if data and 'data' in data:
-                        try:
-                            conversion_rate = float(data['data']['conversionRate'])
-                            self.data[date_str] = {
-                                'rate': conversion_rate,
-                                'updated': datetime.now().isoformat()
-                            }
-                            updated_count += 1
-                        except (KeyError, ValueError) as e:
-                            print(f"    ❌ 解析失敗：{e}")
-                    else:
-                        print(f"    ⚠️ 無法獲取 {date_str} 的數據")
-                
+                candidate_dates.append(current_date)
                 current_date += timedelta(days=1)
+
+            # 由規劃器略過非發布日（週末、學習到的休市日）與近期確認無數據的日期
+            fetched = {}
+            for current_date in self.planner.plan('TWD', 'HKD', candidate_dates):
+                date_str, conversion_rate = self._fetch_single_rate(current_date, 'TWD', 'HKD')
+                if conversion_rate is not None:
+                    fetched[date_str] = conversion_rate
+                else:
+                    print(f"    ⚠️ 無法獲取 {date_str} 的數據")
+            self.planner.save()
+            # 抓取期間其他行程可能已寫入，寫入前先改映射最新的檔案，避免以舊數據覆寫
+            if fetched:
+                with self.data_lock:
+                    self.data.refresh()
+                    self.data.update_rates(fetched)
+                updated_count = len(fetched)
         else:
             print("✅ 數據已是最新狀態，無需API請求")
         
@@ -222,7 +298,7 @@ class ExchangeRateManager:
         return updated_count
 
     def _fetch_single_rate(self, date, buy_currency, sell_currency, max_retries=1):
-        """獲取單一日期的匯率數據（用於並行查詢，含重試機制）"""
+        """獲取單一日期的匯率數據（用於並行查詢，含重試機制），結果會回饋給抓取規劃器"""
         date_str = date.strftime('%Y-%m-%d')
 
         for attempt in range(max_retries):
@@ -231,10 +307,12 @@ class ExchangeRateManager:
 
                 if data and 'data' in data:
                     conversion_rate = float(data['data']['conversionRate'])
+                    self.planner.record(buy_currency, sell_currency, date, published=True, rate=conversion_rate)
                     return date_str, conversion_rate
 
                 # 如果 get_exchange_rate 回傳 None (網路暫停或已處理的錯誤)，直接返回
                 if data is None:
+                    self.planner.record_failure(buy_currency, sell_currency, date)
                     return date_str, None
 
                 # 如果 API 回傳的 JSON 結構不完整，但不是網路錯誤
@@ -243,6 +321,7 @@ class ExchangeRateManager:
                     time.sleep(1)  # 等待1秒後重試
                     continue
                 else:
+                    self.planner.record(buy_currency, sell_currency, date, published=False)
                     return date_str, None
 
             except Exception as e:
@@ -251,59 +330,257 @@ class ExchangeRateManager:
 
         return date_str, None
 
+    def get_stored_rates(self, buy_currency, sell_currency, start_str=None, end_str=None):
+        """從本地數據取出 {date_str: rate}：TWD-HKD 來自主數據文件，其他貨幣對來自 RateStore"""
+        if buy_currency == 'TWD' and sell_currency == 'HKD':
+            with self.data_lock:
+                self.data.refresh()
+                return self.data.rates_between(start_str, end_str)
+        return self.store.get_rates(buy_currency, sell_currency, start_str, end_str)
+
+    def store_rates(self, buy_currency, sell_currency, rates):
+        """將抓取到的 {date_str: rate} 寫入本地數據並落盤，返回新增筆數"""
+        if not rates:
+            return 0
+        if buy_currency == 'TWD' and sell_currency == 'HKD':
+            with self.data_lock:
+                self.data.refresh()
+                added = self.data.update_rates(rates)
+            self.save_data()
+        else:
+            added = self.store.put_rates(buy_currency, sell_currency, rates)
+        self._advance_windows(buy_currency, sell_currency, rates)
+        self.indicator_cache.extend(buy_currency, sell_currency, rates)
+        latest_date = max(rates)
+        self.check_alerts(buy_currency, sell_currency, rates[latest_date], latest_date)
+        return added
+
+    def series_memory(self):
+        """各貨幣對日資料序列的 {(buy, sell): (天數, 私有位元組數, 映射位元組數)}"""
+        usage = self.store.memory_usage()
+        with self.data_lock:
+            usage[('TWD', 'HKD')] = (len(self.data), self.data.memory_usage(), self.data.mapped_bytes)
+        return usage
+
+    def check_alerts(self, buy_currency, sell_currency, rate, date_str):
+        """以新匯率評估提醒；觸發的提醒經 SSE 推送，設定了 ALERT_WEBHOOK_URL 時另在背景 POST 到 webhook"""
+        triggered = self.alerts.observe(buy_currency, sell_currency, rate, date_str)
+        if not triggered:
+            return []
+        for alert in triggered:
+            relation = '高於' if alert['direction'] == ABOVE else '低於'
+            print(f"🔔 匯率提醒 {alert['id']}: {buy_currency}-{sell_currency} {rate:.4f} 已{relation} {alert['threshold']}")
+            metrics.ALERTS_TRIGGERED.inc(alert['direction'])
+            send_sse_event('rate_alert', {
+                **alert,
+                'message': f"{buy_currency}-{sell_currency} 匯率 {rate:.4f} 已{relation}提醒門檻 {alert['threshold']}"
+            })
+        if ALERT_WEBHOOK_URL:
+            Thread(target=deliver_webhook, args=(triggered,), daemon=True).start()
+        self.alerts.save()
+        return triggered
+
+    def add_alert(self, buy_currency, sell_currency, direction, threshold, repeat=False, note=None):
+        """
+        登記提醒，並以本地已知的最新匯率作為跨越判斷的基準。
+        返回的規則附上 current_rate 與 already_met（登記時是否已滿足條件；提醒只在之後跨越門檻時觸發）。
+        """
+        rule = self.alerts.add(buy_currency, sell_currency, direction, threshold, repeat, note)
+        if buy_currency == 'TWD' and sell_currency == 'HKD':
+            latest = self._latest_from_local_data()
+        else:
+            latest = self.latest_rate_cache.get((buy_currency, sell_currency))
+            if not latest:
+                stored = self.store.sorted_rates(buy_currency, sell_currency)
+                latest = {'date': stored[-1][0], 'rate': stored[-1][1]} if stored else None
+        if latest:
+            self.alerts.seed(buy_currency, sell_currency, latest['rate'], latest['date'])
+        self.alerts.save()
+
+        current_rate, _ = self.alerts.last_rate(buy_currency, sell_currency)
+        rule['current_rate'] = current_rate
+        rule['already_met'] = current_rate is not None and (
+            current_rate >= rule['threshold'] if direction == ABOVE else current_rate <= rule['threshold'])
+        return rule
+
+    def _advance_windows(self, buy_currency, sell_currency, rates):
+        """
+        將新寫入的數據推進該貨幣對已建立的滑動窗口。
+        只接受晚於窗口最後一天的日期；補入較舊的日期時捨棄窗口，下次使用時再完整重建。
+        """
+        with self._windows_lock:
+            for key in [k for k in self.windows if k[0] == buy_currency and k[1] == sell_currency]:
+                window = self.windows[key]
+                new_dates = sorted(rates)
+                if window.last_date is not None and new_dates[0] <= window.last_date:
+                    del self.windows[key]
+                    continue
+                for date_str in new_dates:
+                    window.append(date_str, rates[date_str])
+
+    def _get_window(self, days, buy_currency, sell_currency):
+        """取得（必要時以完整序列建立）期間的滑動窗口（內部方法，呼叫端需持有 _windows_lock）"""
+        key = (buy_currency, sell_currency, days)
+        window = self.windows.get(key)
+        if window is None:
+            dates_str, rates, _ = self.get_period_series(days, buy_currency, sell_currency)
+            window = self.windows[key] = SlidingWindowStats(dates_str, rates)
+        return window
+
+    def compact_pair(self, buy_currency, sell_currency, retention_days=None):
+        """
+        將超過保留期的日資料移出並增量折疊進週彙總，同時把過舊的週彙總轉為月彙總。
+        返回被折疊的日資料筆數。
+        """
+        retention_days = retention_days or RAW_RETENTION_DAYS
+        today = datetime.now().replace(hour=0, minute=0, second=0, microsecond=0)
+        cutoff_str = (today - timedelta(days=retention_days)).strftime('%Y-%m-%d')
+        weekly_cutoff_str = (today - timedelta(days=WEEKLY_RETENTION_DAYS)).strftime('%Y-%m-%d')
+
+        if buy_currency == 'TWD' and sell_currency == 'HKD':
+            with self.data_lock:
+                self.data.refresh()
+                expired = self.data.pop_before(cutoff_str)
+            if expired:
+                self.save_data()
+        else:
+            expired = self.store.pop_before(buy_currency, sell_currency, cutoff_str)
+
+        folded, aged_weeks = self.rollups.fold(buy_currency, sell_currency, expired, weekly_cutoff_str)
+        if folded or aged_weeks:
+            print(f"📦 {buy_currency}-{sell_currency}: 折疊 {folded} 筆日資料進週彙總，{aged_weeks} 個週彙總轉為月彙總")
+        return folded
+
+    def is_rolled_up(self, buy_currency, sell_currency, date_str):
+        """日期是否早於保留期且已被折疊進彙總（回填時無需再抓取）"""
+        today = datetime.now().replace(hour=0, minute=0, second=0, microsecond=0)
+        cutoff_str = (today - timedelta(days=RAW_RETENTION_DAYS)).strftime('%Y-%m-%d')
+        return date_str < cutoff_str and self.rollups.is_covered(buy_currency, sell_currency, date_str)
+
+    def get_rollup_buckets(self, days, buy_currency, sell_currency, live_rates_data=None):
+        """
+        長區間數據：合併保留期內的日資料與已折疊的彙總，統一降採樣為週或月 OHLC。
+        返回 {bucket_key: bucket}，以區間起始日期為鍵。
+        """
+        end_date = datetime.now()
+        start_str = (end_date - timedelta(days=days)).strftime('%Y-%m-%d')
+        end_str = end_date.strftime('%Y-%m-%d')
+        tier = WEEKLY if days <= WEEKLY_RETENTION_DAYS else MONTHLY
+
+        raw_rates = self.get_stored_rates(buy_currency, sell_currency, start_str, end_str)
+        if live_rates_data:
+            raw_rates.update({d: r for d, r in live_rates_data.items() if start_str <= d <= end_str})
+
+        buckets = self.rollups.get_buckets(buy_currency, sell_currency, tier, start_str, end_str)
+        return merge_buckets(buckets, aggregate(raw_rates, tier))
+
+    @traced()
     def extract_local_rates(self, days):
         """獲取指定天數的匯率數據"""
         end_date = datetime.now()
         start_date = end_date - timedelta(days=days)
 
-        dates = []
-        rates = []
-
-        current_date = start_date
-        while current_date <= end_date:
-            date_str = current_date.strftime('%Y-%m-%d')
-            if date_str in self.data:
-                dates.append(current_date)
-                # 顯示 1/rate，即 1 港幣等於多少台幣
-                rates.append(self.data[date_str]['rate'])
-            current_date += timedelta(days=1)
-
-        return dates, rates
+        with self.data_lock:
+            self.data.refresh()
+            return self.data.datetimes_between(start_date.strftime('%Y-%m-%d'), end_date.strftime('%Y-%m-%d'))
 
-    def _background_fetch_and_generate(self, buy_currency, sell_currency, flask_app):
+    def _background_fetch_and_generate(self, buy_currency, sell_currency, flask_app, priority=PROGRESSIVE,
+                                       require_interest=True):
         """
         [REFACTORED]
         非同步抓取180天歷史數據，並在過程中流式生成圖表、發送進度。
+        本地已儲存的日期不再重新抓取，新抓到的數據會分批寫回 RateStore。
+        各日期以子任務提交給排程器：最近7天以本任務的優先級整批先抓，其餘日期最高為漸進優先級。
+        require_interest 為 True 時，貨幣對已無人關注（SSE 客戶端離開且近期無請求）就取消其餘日期，
+        已抓到的數據照常保存。
         """
         with flask_app.app_context():
+            pending_rates = {}
+            abandoned = False
+
+            def lost_interest():
+                nonlocal abandoned
+                if require_interest and not self.interest.is_interested(buy_currency, sell_currency):
+                    abandoned = True
+                return abandoned
+
             try:
+                if lost_interest():
+                    print(f"🛑 {buy_currency}-{sell_currency} 在排隊期間已無人關注，略過背景抓取。")
+                    return
+
                 print(f"🌀 事件驅動背景任務開始：為 {buy_currency}-{sell_currency} 抓取180天數據。")
 
-                # 1. 收集日期，從最新到最舊
+                # 1. 收集日期，從最新到最舊，並扣除本地已有的日期
                 end_date = datetime.now()
-                start_date = end_date - timedelta(days=180)
-                query_dates = sorted([d for d in (end_date - timedelta(days=i) for i in range(181)) if d.weekday() < 5], reverse=True)
+                start_date = end_date - timedelta(days=BACKGROUND_FETCH_DAYS)
+                all_dates = [end_date - timedelta(days=i) for i in range(BACKGROUND_FETCH_DAYS + 1)]
+                rates_data = self.get_stored_rates(buy_currency, sell_currency,
+                                                   start_date.strftime('%Y-%m-%d'), end_date.strftime('%Y-%m-%d'))
+                query_dates = self.planner.plan(buy_currency, sell_currency,
+                                                [d for d in all_dates if d.strftime('%Y-%m-%d') not in rates_data])
                 total_days_to_fetch = len(query_dates)
 
-                if total_days_to_fetch == 0:
-                    print(f"🔚 {buy_currency}-{sell_currency}: 無需抓取任何日期。")
-                    return
+                if rates_data:
+                    print(f"📦 {buy_currency}-{sell_currency}: 本地已有 {len(rates_data)} 筆數據，只需抓取 {total_days_to_fetch} 天。")
 
                 # 2. 初始化變量
-                rates_data = {}
                 fetched_count = 0
                 generated_periods = set()
-                chart_generation_checkpoints = {7: 5, 30: 21, 90: 65, 180: 129}
-
-                # 3. 並行抓取
-                with ThreadPoolExecutor(max_workers=5, thread_name_prefix='RateFetch') as executor:
-                    future_to_date = {executor.submit(self._fetch_single_rate, d, buy_currency, sell_currency): d for d in query_dates}
-                    
-                    for future in as_completed(future_to_date):
-                        date_str, rate = future.result()
+                chart_generation_checkpoints = CHART_GENERATION_CHECKPOINTS
+
+                def generate_ready_periods():
+                    """帶前置條件的漸進式生成"""
+                    for period in chart_generation_checkpoints:
+                        if period not in generated_periods and len(rates_data) >= chart_generation_checkpoints[period]:
+                            # 檢查是否有足夠時間範圍的數據
+                            required_start_date = end_date - timedelta(days=period)
+                            has_relevant_data = any(datetime.strptime(d, '%Y-%m-%d') >= required_start_date for d in rates_data)
+
+                            if has_relevant_data:
+                                chart_info = self.build_chart_with_cache(period, buy_currency, sell_currency, live_rates_data=rates_data)
+                                if chart_info:
+                                    print(f"✅ 背景任務：成功生成並快取了 {period} 天圖表。")
+                                    generated_periods.add(period)
+                                    # 修正：傳送前端期望的扁平化資料結構
+                                    send_sse_event('chart_ready', {
+                                        'buy_currency': buy_currency,
+                                        'sell_currency': sell_currency,
+                                        'period': period,
+                                        'chart_url': chart_info['chart_url'],
+                                        'stats': chart_info['stats']
+                                    })
+
+                # 本地數據已足夠的期間可立即生成
+                if rates_data:
+                    generate_ready_periods()
+
+                # 3. 並行抓取（經由排程器，與其他貨幣對公平分享工作槽）
+                if total_days_to_fetch > 0:
+                    first_batch_start = end_date - timedelta(days=min(CHART_GENERATION_CHECKPOINTS))
+                    future_to_date = {}
+                    for d in query_dates:
+                        date_priority = priority if d >= first_batch_start else max(priority, PROGRESSIVE)
+                        future = self.jobs.submit(self._fetch_single_rate, d, buy_currency, sell_currency,
+                                                  priority=date_priority, pair=(buy_currency, sell_currency),
+                                                  name=f"fetch {buy_currency}-{sell_currency} {d.strftime('%Y-%m-%d')}")
+                        future_to_date[future] = d
+
+                    for future in self.jobs.as_completed(future_to_date, should_cancel=lost_interest):
+                        try:
+                            date_str, rate = future.result()
+                        except Exception as e:
+                            print(f"❌ 抓取 {buy_currency}-{sell_currency} {future_to_date[future].strftime('%Y-%m-%d')} 時出錯: {e}")
+                            date_str, rate = future_to_date[future].strftime('%Y-%m-%d'), None
                         fetched_count += 1
                         if rate is not None:
                             rates_data[date_str] = rate
+                            pending_rates[date_str] = rate
+
+                        # 每累積一批就寫回本地，中斷時已抓到的數據不會遺失
+                        if len(pending_rates) >= 20:
+                            self.store_rates(buy_currency, sell_currency, pending_rates)
+                            pending_rates = {}
 
                         # 發送進度更新（加入各 period 進度）
                         progress = int((fetched_count / total_days_to_fetch) * 100)
@@ -328,26 +605,22 @@ class ExchangeRateManager:
                             'period_needed': period_needed
                         })
 
-                        # 4. 帶前置條件的漸進式生成
-                        for period in chart_generation_checkpoints:
-                            if period not in generated_periods and len(rates_data) >= chart_generation_checkpoints[period]:
-                                # 檢查是否有足夠時間範圍的數據
-                                required_start_date = end_date - timedelta(days=period)
-                                has_relevant_data = any(datetime.strptime(d, '%Y-%m-%d') >= required_start_date for d in rates_data)
-                                
-                                if has_relevant_data:
-                                    chart_info = self.build_chart_with_cache(period, buy_currency, sell_currency, live_rates_data=rates_data)
-                                    if chart_info:
-                                        print(f"✅ 背景任務：成功生成並快取了 {period} 天圖表。")
-                                        generated_periods.add(period)
-                                        # 修正：傳送前端期望的扁平化資料結構
-                                        send_sse_event('chart_ready', {
-                                            'buy_currency': buy_currency,
-                                            'sell_currency': sell_currency,
-                                            'period': period,
-                                            'chart_url': chart_info['chart_url'],
-                                            'stats': chart_info['stats']
-                                        })
+                        # 4. 帶前置條件的漸進式生成（已無人關注就不再繪圖）
+                        if not abandoned:
+                            generate_ready_periods()
+
+                    if abandoned:
+                        print(f"🛑 {buy_currency}-{sell_currency} 已無人關注：取消其餘 {total_days_to_fetch - fetched_count} 天的抓取，"
+                              f"已抓取的 {fetched_count} 天照常保存。")
+                        send_sse_event('fetch_cancelled', {
+                            'buy_currency': buy_currency,
+                            'sell_currency': sell_currency,
+                            'fetched_count': fetched_count,
+                            'cancelled_count': total_days_to_fetch - fetched_count
+                        })
+                        return
+                else:
+                    print(f"🔚 {buy_currency}-{sell_currency}: 本地數據已完整，無需抓取任何日期。")
 
                 # 5. 最終補全
                 final_periods_to_generate = set(chart_generation_checkpoints.keys()) - generated_periods
@@ -366,6 +639,22 @@ class ExchangeRateManager:
                                 'stats': chart_info['stats']
                             })
 
+                # 5b. 長區間圖表：先寫回並折疊過期數據，再由日資料與彙總數據生成
+                if pending_rates:
+                    self.store_rates(buy_currency, sell_currency, pending_rates)
+                    pending_rates = {}
+                self.compact_pair(buy_currency, sell_currency)
+                for period in LONG_RANGE_PERIODS:
+                    chart_info = self.build_chart_with_cache(period, buy_currency, sell_currency)
+                    if chart_info:
+                        send_sse_event('chart_ready', {
+                            'buy_currency': buy_currency,
+                            'sell_currency': sell_currency,
+                            'period': period,
+                            'chart_url': chart_info['chart_url'],
+                            'stats': chart_info['stats']
+                        })
+
                 # 6. 最終日誌
                 if len(generated_periods) == 4:
                     print(f"✅ 背景任務圓滿完成: {buy_currency}-{sell_currency} 的全部4張圖表均已生成。")
@@ -373,154 +662,511 @@ class ExchangeRateManager:
                     print(f"⚠️ 背景任務結束，但有缺漏: 為 {buy_currency}-{sell_currency} 生成了 {len(generated_periods)}/{4} 張圖表。")
 
             except Exception as e:
-                print(f"❌ 背景任務失敗 ({buy_currency}-{sell_currency}): {e}", exc_info=True)
+                print(f"❌ 背景任務失敗 ({buy_currency}-{sell_currency}): {e}")
             finally:
-                with self._active_fetch_lock:
-                    self._active_fetches.discard((buy_currency, sell_currency))
-                    print(f"🔑 背景任務解鎖: {buy_currency}-{sell_currency}。")
+                try:
+                    if pending_rates:
+                        self.store_rates(buy_currency, sell_currency, pending_rates)
+                    self.planner.save()
+                except Exception as e:
+                    print(f"❌ 寫回 {buy_currency}-{sell_currency} 數據時出錯: {e}")
 
     def create_chart(self, days, buy_currency, sell_currency):
         """創建圖表（帶 LRU Cache 和背景抓取協調）"""
         cache_key = f"chart_{buy_currency}_{sell_currency}_{days}"
+        self.interest.touch(buy_currency, sell_currency)
 
         # 1. 檢查快取
-        cached_info = self.lru_cache.get(cache_key)
-        if cached_info:
-            chart_url = cached_info.get('chart_url', '')
-            if chart_url and os.path.exists(os.path.join(self.charts_dir, os.path.basename(chart_url))):
-                return cached_info
+        with span('cache_lookup'):
+            cached_info = self.lru_cache.get(cache_key)
+            cache_hit = bool(cached_info) and self._chart_file_exists(cached_info)
+        if cache_hit:
+            return cached_info
 
         # --- 快取未命中 ---
         
         # 對於 TWD-HKD，邏輯很簡單，直接同步重新生成
         if buy_currency == 'TWD' and sell_currency == 'HKD':
-            return self.build_chart_with_cache(days, buy_currency, sell_currency)
+            return self._render_interactive(days, buy_currency, sell_currency)
 
-        # --- 對於其他貨幣對，需要協調背景抓取 ---
-        with self._active_fetch_lock:
-            if (buy_currency, sell_currency) not in self._active_fetches:
-                print(f"🌀 {buy_currency}-{sell_currency} 的背景抓取尚未啟動，現在於背景開始...")
-                self._active_fetches.add((buy_currency, sell_currency))
-                # 傳入 Flask app 物件，確保背景執行可建立 app_context
-                flask_app = current_app._get_current_object()
-                self.background_executor.submit(self._background_fetch_and_generate, buy_currency, sell_currency, flask_app)
-            else:
-                print(f"✅ 預生成: {buy_currency}-{sell_currency} 的背景抓取已在進行中。")
+        # --- 本地已預先回填足夠數據時，直接同步生成 ---
+        if self._store_covers_period(days, buy_currency, sell_currency):
+            return self._render_interactive(days, buy_currency, sell_currency)
+
+        # --- 對於其他貨幣對，需要協調背景抓取（使用者正在等待，以互動優先級執行） ---
+        self._start_background_fetch(buy_currency, sell_currency, INTERACTIVE)
 
         # 改為快速返回，讓前端透過 SSE 的 chart_ready 事件更新，不阻塞請求
         return None
 
-    def build_chart_with_cache(self, days, buy_currency, sell_currency, live_rates_data=None):
+    def _render_interactive(self, days, buy_currency, sell_currency):
         """
-        內部輔助函數：重新生成圖表並更新快取。
-        可選擇傳入已獲取的即時數據以避免重複請求。
+        同步生成圖表，但仍經由排程器執行以遵守全域並行上限；
+        同一期間的預熱任務若仍在排隊，會被提升為互動優先級並共用結果。
         """
-        all_dates_str, all_rates = [], []
-        is_pinned = False
+        if self.jobs.current_job() is not None:
+            # 已在排程任務中（例如預熱），直接生成避免等待自己
+            return self.build_chart_with_cache(days, buy_currency, sell_currency)
+        future = self.jobs.submit(self.build_chart_with_cache, days, buy_currency, sell_currency,
+                                  priority=INTERACTIVE, pair=(buy_currency, sell_currency),
+                                  name=f"render {buy_currency}-{sell_currency} {days}d",
+                                  key=f"render:{buy_currency}-{sell_currency}:{days}")
+        try:
+            result = future.result(timeout=INTERACTIVE_WAIT_SECONDS)
+        except concurrent.futures.TimeoutError:
+            # 任務仍在排隊，之後完成時會寫入快取；這次請求不再等待
+            raise SchedulerBusyError(f"{buy_currency}-{sell_currency} {days} 天圖表排隊逾時")
+        # 共用預熱任務的結果時，預熱任務返回的是 None，改讀快取
+        return result if isinstance(result, dict) else self.lru_cache.get(f"chart_{buy_currency}_{sell_currency}_{days}")
+
+    def _start_background_fetch(self, buy_currency, sell_currency, priority):
+        """啟動（或提升）貨幣對的背景抓取任務，同一貨幣對同時只會有一個"""
+        pair = (buy_currency, sell_currency)
+        self.interest.touch(buy_currency, sell_currency)
+        key = f"fetch:{buy_currency}-{sell_currency}"
+        if self.jobs.is_pending(key):
+            # 已在進行中：把尚在排隊的日期提升到不低於漸進優先級
+            promoted = self.jobs.promote(pair, max(priority, PROGRESSIVE))
+            print(f"✅ {buy_currency}-{sell_currency} 的背景抓取已在進行中（提升 {promoted} 個排隊任務）。")
+        else:
+            print(f"🌀 {buy_currency}-{sell_currency} 的背景抓取尚未啟動，現在於背景開始...")
+        # 傳入 Flask app 物件，確保背景執行可建立 app_context；相同 key 不會重複建立任務
+        flask_app = current_app._get_current_object()
+        self.jobs.submit(self._background_fetch_and_generate, buy_currency, sell_currency, flask_app, priority,
+                         priority=priority, pair=pair, name=f"background fetch {buy_currency}-{sell_currency}", key=key)
+
+    def _chart_file_exists(self, chart_info):
+        """快取的圖表檔案是否仍在（圖表目錄可能被清理）"""
+        chart_url = chart_info.get('chart_url', '')
+        return bool(chart_url) and os.path.exists(os.path.join(self.charts_dir, os.path.basename(chart_url)))
+
+    def _store_covers_period(self, days, buy_currency, sell_currency):
+        """本地儲存的數據點是否已足以生成指定期間的圖表"""
+        if days > RAW_RETENTION_DAYS:
+            # 長區間至少要有相當於最長日資料期間的數據量
+            buckets = self.get_rollup_buckets(days, buy_currency, sell_currency)
+            return sum(b['count'] for b in buckets.values()) >= max(CHART_GENERATION_CHECKPOINTS.values())
+        needed = CHART_GENERATION_CHECKPOINTS.get(days, int(days * 5 / 7))
+        end_date = datetime.now()
+        start_date = end_date - timedelta(days=days)
+        stored_rates = self.get_stored_rates(buy_currency, sell_currency,
+                                             start_date.strftime('%Y-%m-%d'), end_date.strftime('%Y-%m-%d'))
+        return len(stored_rates) >= needed
+
+    @traced()
+    def get_period_series(self, days, buy_currency, sell_currency, live_rates_data=None):
+        """
+        取得指定期間的序列，返回 (dates_str, rates, bands)。
+        bands 只在使用週/月彙總時提供 (最低, 最高) 列表，否則為 None。
+        """
+        if days > RAW_RETENTION_DAYS:
+            # 超過日資料保留期：使用週/月 OHLC 彙總，收盤價作為折線，高低價作為區間帶
+            buckets = self.get_rollup_buckets(days, buy_currency, sell_currency, live_rates_data)
+            all_dates_str = sorted(buckets.keys())
+            all_rates = [buckets[k]['close'] for k in all_dates_str]
+            bands = [(buckets[k]['low'], buckets[k]['high']) for k in all_dates_str]
+            return all_dates_str, all_rates, bands
 
         if buy_currency == 'TWD' and sell_currency == 'HKD':
             # 對於 TWD-HKD，從本地數據獲取
             all_dates_obj, all_rates = self.extract_local_rates(days)
-            if not all_dates_obj:
-                return None
-            all_dates_str = [d.strftime('%Y-%m-%d') for d in all_dates_obj]
-            is_pinned = True
-        elif live_rates_data:
-            # 如果傳入了預加載的數據，直接使用
-            all_dates_str_sorted = sorted(live_rates_data.keys())
-            
-            # 根據天數篩選數據
-            end_date = datetime.now()
-            start_date = end_date - timedelta(days=days)
-            
-            # 從已有的數據中篩選出符合期間的
-            filtered_dates = [d for d in all_dates_str_sorted if start_date <= datetime.strptime(d, '%Y-%m-%d') <= end_date]
-            
-            # 如果篩選後數據不足，則不生成圖表
-            if not filtered_dates:
-                 return None
+            return [d.strftime('%Y-%m-%d') for d in all_dates_obj], all_rates, None
+
+        end_date = datetime.now()
+        start_date = end_date - timedelta(days=days)
+        if live_rates_data:
+            # 如果傳入了預加載的數據，從中篩選出符合期間的
+            all_dates_str = [d for d in sorted(live_rates_data.keys())
+                             if start_date <= datetime.strptime(d, '%Y-%m-%d') <= end_date]
+            return all_dates_str, [live_rates_data[d] for d in all_dates_str], None
+
+        # 對於其他貨幣對，從本地 RateStore 獲取（由背景任務或離線回填寫入）
+        stored_rates = self.get_stored_rates(buy_currency, sell_currency,
+                                             start_date.strftime('%Y-%m-%d'), end_date.strftime('%Y-%m-%d'))
+        all_dates_str = sorted(stored_rates.keys())
+        return all_dates_str, [stored_rates[d] for d in all_dates_str], None
+
+    def get_range_series(self, start_str, end_str, buy_currency, sell_currency):
+        """
+        取得任意日期範圍的序列，返回 (dates_str, rates, bands)。
+        保留期內使用日資料，更早的部分以週/月彙總補上（日期為區間最後一天）。
+        """
+        raw_rates = self.get_stored_rates(buy_currency, sell_currency, start_str, end_str)
+        earliest_raw = min(raw_rates) if raw_rates else None
+
+        points = {}
+        for bucket in self.rollups.get_points(buy_currency, sell_currency, start_str, end_str):
+            if earliest_raw is None or bucket['last'] < earliest_raw:
+                points[bucket['last']] = (bucket['close'], bucket['low'], bucket['high'])
+        for date_str, rate in raw_rates.items():
+            points[date_str] = (rate, rate, rate)
+
+        all_dates_str = sorted(points.keys())
+        all_rates = [points[d][0] for d in all_dates_str]
+        has_rollups = len(points) > len(raw_rates)
+        bands = [(points[d][1], points[d][2]) for d in all_dates_str] if has_rollups else None
+        return all_dates_str, all_rates, bands
+
+    def iter_export_rows(self, pairs, start_str=None, end_str=None):
+        """
+        逐列產生匯出數據，一次只處理一組貨幣對：
+        (buy, sell, date, rate, granularity, period_start, low, high)。
+        日資料保留期之前的部分以週/月彙總列補上（rate 為收盤價）。
+        日資料以二分搜尋定位範圍後逐筆走訪序列陣列，不先建立整段清單。
+        """
+        for buy_currency, sell_currency in pairs:
+            if buy_currency == 'TWD' and sell_currency == 'HKD':
+                with self.data_lock:
+                    self.data.refresh()
+                    raw_rows = self.data.iter_between(start_str, end_str)
+            else:
+                raw_rows = self.store.iter_rates(buy_currency, sell_currency, start_str, end_str)
+            first_raw = next(raw_rows, None)
+            earliest_raw = first_raw[0] if first_raw else None
+
+            for bucket in self.rollups.get_points(buy_currency, sell_currency, start_str, end_str):
+                if earliest_raw is None or bucket['last'] < earliest_raw:
+                    yield (buy_currency, sell_currency, bucket['last'], bucket['close'], bucket['tier'],
+                           bucket['first'], bucket['low'], bucket['high'])
+            if first_raw is None:
+                continue
+            yield (buy_currency, sell_currency, earliest_raw, first_raw[1], 'daily', earliest_raw, None, None)
+            for date_str, rate in raw_rows:
+                yield (buy_currency, sell_currency, date_str, rate, 'daily', date_str, None, None)
 
-            all_dates_str = filtered_dates
-            all_rates = [live_rates_data[d] for d in all_dates_str]
-            is_pinned = False
+    @staticmethod
+    def _downsample_series(all_dates_str, all_rates, bands, max_points):
+        """以 LTTB 將序列縮減到 max_points 點內，x 軸使用日期序數以反映真實時間間隔"""
+        if not max_points or len(all_rates) <= max_points:
+            return all_dates_str, all_rates, bands
+        ordinals = [datetime.strptime(d, '%Y-%m-%d').toordinal() for d in all_dates_str]
+        indices = lttb_indices(ordinals, all_rates, max_points)
+        return ([all_dates_str[i] for i in indices],
+                [all_rates[i] for i in indices],
+                [bands[i] for i in indices] if bands else None)
+
+    def _daily_history(self, buy_currency, sell_currency):
+        """貨幣對完整的日資料歷史 (datetime64[D] 日期陣列, float64 匯率陣列)，按日期排序"""
+        if buy_currency == 'TWD' and sell_currency == 'HKD':
+            with self.data_lock:
+                self.data.refresh()
+                return self.data.columns()
+        return self.store.columns(buy_currency, sell_currency)
+
+    def compute_indicators(self, specs, buy_currency, sell_currency, all_dates_str, all_rates, rolled_up=False,
+                           out_dates=None):
+        """
+        計算指標並對齊到 out_dates（預設為 all_dates_str），返回 [(spec, {欄位: 陣列})]。
+        日資料取自以整段歷史計算、增量延伸的快取，期間開頭也有完整的窗口；
+        含週/月彙總的序列直接以序列本身計算（點數少，不快取）。
+        """
+        wanted = to_dates(all_dates_str if out_dates is None else out_dates)
+        dates = to_dates(all_dates_str) if rolled_up else None
+        results = []
+        for spec in specs:
+            if rolled_up:
+                results.append((spec, compute_for_dates(spec, dates, all_rates, wanted)))
+                continue
+            entry = self.indicator_cache.get(buy_currency, sell_currency, spec,
+                                             lambda: self._daily_history(buy_currency, sell_currency))
+            results.append((spec, align_indicator(entry, wanted)))
+        return results
+
+    @staticmethod
+    def _latest_indicator_values(indicators):
+        """圖表 API 附帶的各指標最新一筆數值"""
+        return {spec_label(spec): {field: to_json(values[-1:])[0] for field, values in fields.items()}
+                for spec, fields in indicators}
+
+    def get_series(self, buy_currency, sell_currency, days=None, start_str=None, end_str=None, max_points=None,
+                   indicators=None):
+        """提供序列 API 使用的 JSON 結構，依點數預算降採樣；indicators 為 IndicatorSpec 列表"""
+        if start_str and end_str:
+            all_dates_str, all_rates, bands = self.get_range_series(start_str, end_str, buy_currency, sell_currency)
         else:
-            # 對於其他貨幣對，從即時 API 獲取
-            live_rates_data = self.get_live_rates_for_period(days, buy_currency, sell_currency)
-            if not live_rates_data:
-                return None
-            all_dates_str = sorted(live_rates_data.keys())
-            all_rates = [live_rates_data[d] for d in all_dates_str]
-            is_pinned = False
+            all_dates_str, all_rates, bands = self.get_period_series(days, buy_currency, sell_currency)
+        if not all_dates_str:
+            return None
 
-        # --- 數據獲取完成後 ---
+        stats = self._calculate_stats(all_rates, all_dates_str)
+        dates_out, rates_out, bands_out = self._downsample_series(all_dates_str, all_rates, bands, max_points)
+        series = {
+            'buy_currency': buy_currency,
+            'sell_currency': sell_currency,
+            'dates': dates_out,
+            'rates': rates_out,
+            'points': len(dates_out),
+            'original_points': len(all_dates_str),
+            'stats': stats
+        }
+        if bands_out:
+            series['lows'] = [b[0] for b in bands_out]
+            series['highs'] = [b[1] for b in bands_out]
+        if indicators:
+            computed = self.compute_indicators(indicators, buy_currency, sell_currency, all_dates_str, all_rates,
+                                               rolled_up=bands is not None, out_dates=dates_out)
+            series['indicators'] = {spec_label(spec): {field: to_json(values) for field, values in fields.items()}
+                                    for spec, fields in computed}
+        return series
+
+    def chart_variant(self, days, buy_currency, sell_currency, chart_info, variant, indicators=None):
+        """
+        由預設圖表資訊衍生指定格式/尺寸或疊加指標的變體（統計等欄位沿用，只替換圖片網址）。
+        以預設圖表的內容雜湊為快取鍵，數據未變時同一變體只繪製一次。
+        """
+        if (variant is None and not indicators) or not chart_info:
+            return chart_info
+        base_hash = chart_info.get('content_hash')
+        cache_key = f"variant_{buy_currency}_{sell_currency}_{days}_{base_hash}_{(variant or DEFAULT_VARIANT).key}"
+        if indicators:
+            cache_key += '_' + '-'.join(spec_label(spec) for spec in indicators)
+        cached_info = self.variant_cache.get(cache_key)
+        if cached_info and self._chart_file_exists(cached_info):
+            return cached_info
+
+        all_dates_str, all_rates, bands = self.get_period_series(days, buy_currency, sell_currency)
         if not all_dates_str or not all_rates:
-            return None # 沒有足夠數據生成圖表
+            return chart_info
+        computed = self.compute_indicators(indicators, buy_currency, sell_currency, all_dates_str, all_rates,
+                                           rolled_up=bands is not None) if indicators else None
+        chart_url = self.render_chart_image(days, all_dates_str, all_rates, buy_currency, sell_currency,
+                                            bands=bands, variant=variant, indicators=computed)
+        if not chart_url:
+            return chart_info
+
+        variant_info = {**chart_info, 'chart_url': chart_url}
+        if variant is not None:
+            variant_info.update(format=variant.format, width=variant.width, dpi=variant.dpi)
+        if computed:
+            variant_info['indicators'] = self._latest_indicator_values(computed)
+        # 數據已在取得預設圖表後更新時，以實際繪製的內容為準
+        if base_hash and series_hash(all_dates_str, all_rates, bands) == base_hash:
+            self.variant_cache.put(cache_key, variant_info)
+        return variant_info
+
+    def get_sparklines(self, pairs, days=30):
+        """
+        批次取得多組貨幣對的走勢縮圖（只用本地已有的數據，不觸發抓取）。
+        以內容雜湊快取，未命中的貨幣對在同一次向量化計算中一起繪製。
+        返回 ({'BUY-SELL': {...}}, [沒有數據的貨幣對])。
+        """
+        results, missing, pending = {}, [], []
+        for buy_currency, sell_currency in pairs:
+            pair_key = f"{buy_currency}-{sell_currency}"
+            all_dates_str, all_rates, _ = self.get_period_series(days, buy_currency, sell_currency)
+            if len(all_rates) < 2:
+                missing.append(pair_key)
+                continue
+            content_hash = series_hash(all_dates_str, all_rates)
+            cache_key = f"spark_{buy_currency}_{sell_currency}_{days}_{content_hash}"
+            cached = self.sparkline_cache.get(cache_key)
+            if cached:
+                results[pair_key] = cached
+            else:
+                pending.append((pair_key, cache_key, content_hash, all_dates_str, all_rates))
+
+        if pending:
+            svgs = render_sparklines([item[4] for item in pending])
+            for (pair_key, cache_key, content_hash, all_dates_str, all_rates), svg in zip(pending, svgs):
+                first, last = all_rates[0], all_rates[-1]
+                sparkline = {
+                    'svg': svg,
+                    'first': first,
+                    'last': last,
+                    'change_pct': round((last - first) / first * 100, 2) if first else None,
+                    'start_date': all_dates_str[0],
+                    'end_date': all_dates_str[-1],
+                    'content_hash': content_hash
+                }
+                self.sparkline_cache.put(cache_key, sparkline)
+                results[pair_key] = sparkline
+        return results, missing
 
-        # --- 生成圖表和統計數據 ---
-        chart_url = self.render_chart_image(days, all_dates_str, all_rates, buy_currency, sell_currency)
+    def create_range_chart(self, start_str, end_str, buy_currency, sell_currency, max_points, variant=None,
+                           indicators=None):
+        """
+        生成任意日期範圍的圖表（帶 LRU Cache）。
+        數據超過點數預算時先以 LTTB 降採樣，渲染成本只與預算有關、與範圍長度無關。
+        variant 為可選的 ChartVariant，indicators 為疊加的指標，不同組合分開快取。
+        快取鍵含序列的內容雜湊，範圍內的數據更新後不會沿用舊圖。
+        """
+        all_dates_str, all_rates, bands = self.get_range_series(start_str, end_str, buy_currency, sell_currency)
+        if not all_dates_str:
+            return None
+        content_hash = series_hash(all_dates_str, all_rates, bands)
+
+        cache_key = f"chart_{buy_currency}_{sell_currency}_{start_str}_{end_str}_{max_points}_{content_hash}"
+        if variant is not None:
+            cache_key += f"_{variant.key}"
+        if indicators:
+            cache_key += '_' + '-'.join(spec_label(spec) for spec in indicators)
+        cached_info = self.lru_cache.get(cache_key)
+        if cached_info:
+            chart_url = cached_info.get('chart_url', '')
+            if chart_url and os.path.exists(os.path.join(self.charts_dir, os.path.basename(chart_url))):
+                return cached_info
+
+        stats = self._calculate_stats(all_rates, all_dates_str)
+        dates_out, rates_out, bands_out = self._downsample_series(all_dates_str, all_rates, bands, max_points)
+        days = (datetime.strptime(end_str, '%Y-%m-%d') - datetime.strptime(start_str, '%Y-%m-%d')).days
+        computed = self.compute_indicators(indicators, buy_currency, sell_currency, all_dates_str, all_rates,
+                                           rolled_up=bands is not None, out_dates=dates_out) if indicators else None
+        chart_url = self.render_chart_image(days, dates_out, rates_out, buy_currency, sell_currency,
+                                            bands=bands_out, period_label=f"{start_str} 至 {end_str}",
+                                            variant=variant, indicators=computed)
         if not chart_url:
             return None
 
-        all_dates_obj = [datetime.strptime(d, '%Y-%m-%d') for d in all_dates_str]
-        stats = self._calculate_stats(all_rates, [d.strftime('%Y-%m-%d') for d in all_dates_obj])
-        
-        # --- 建立完整的圖表資訊對象 (已移除數據指紋) ---
         chart_info = {
             'chart_url': chart_url,
             'stats': stats,
+            'points': len(dates_out),
+            'original_points': len(all_dates_str),
             'generated_at': datetime.now().isoformat(),
-            'is_pinned': is_pinned
+            'content_hash': content_hash,
+            'is_pinned': False
         }
-        
-        # --- 更新快取 ---
-        # 這是關鍵的修復：確保 build_chart_with_cache 自身就能更新快取
-        cache_key = f"chart_{buy_currency}_{sell_currency}_{days}"
+        if variant is not None:
+            chart_info.update(format=variant.format, width=variant.width, dpi=variant.dpi)
+        if computed:
+            chart_info['indicators'] = self._latest_indicator_values(computed)
         self.lru_cache.put(cache_key, chart_info)
-        current_app.logger.info(f"💾 CACHE SET (from regenerate): Stored chart for {buy_currency}-{sell_currency} ({days} days)")
-
+        current_app.logger.info(f"💾 CACHE SET (range): Stored chart for {buy_currency}-{sell_currency} ({start_str} ~ {end_str})")
         return chart_info
 
-    def render_chart_image(self, days, all_dates_str, all_rates, buy_currency, sell_currency):
+    def create_comparison_chart(self, pairs, days=None, start_str=None, end_str=None, rebase=False, variant=None):
         """
-        從提供的數據生成圖表，並將其保存為文件，返回其 URL 路徑。
-        all_dates_str 應為 'YYYY-MM-DD' 格式的字符串列表。
+        在同一張圖上比較多組貨幣對。各組序列以日期外連接對齊後一次繪製，rebase 時換算成起點=100 的指數。
+        本地數據不足的貨幣對同時提交背景抓取（排程器會並行執行），返回 {'pending_pairs': [...]}，
+        前端等各組的 chart_ready 事件後再重新請求。指定的期間完全早於背景抓取能補的範圍
+        （最近 BACKGROUND_FETCH_DAYS 天）時不提交抓取，返回 {'unavailable_pairs': [...]}。
         """
-        if not all_dates_str or not all_rates:
+        fetchable_from = (datetime.now() - timedelta(days=BACKGROUND_FETCH_DAYS)).strftime('%Y-%m-%d')
+        series_by_label, pending, unavailable = {}, [], []
+        for buy_currency, sell_currency in pairs:
+            self.interest.touch(buy_currency, sell_currency)
+            if start_str and end_str:
+                all_dates_str, all_rates, _ = self.get_range_series(start_str, end_str, buy_currency, sell_currency)
+            else:
+                is_local = buy_currency == 'TWD' and sell_currency == 'HKD'
+                if not is_local and not self._store_covers_period(days, buy_currency, sell_currency):
+                    pending.append((buy_currency, sell_currency))
+                    continue
+                all_dates_str, all_rates, _ = self.get_period_series(days, buy_currency, sell_currency)
+            if len(all_rates) < 2:
+                if start_str and end_str and end_str < fetchable_from:
+                    unavailable.append(f"{buy_currency}-{sell_currency}")
+                else:
+                    pending.append((buy_currency, sell_currency))
+                continue
+            series_by_label[f"{buy_currency}-{sell_currency}"] = (all_dates_str, all_rates)
+
+        if unavailable:
+            return {'unavailable_pairs': unavailable}
+        if pending:
+            for buy_currency, sell_currency in pending:
+                self._start_background_fetch(buy_currency, sell_currency, INTERACTIVE)
+            return {'pending_pairs': [f"{b}-{s}" for b, s in pending]}
+
+        combined_hash = hashlib.md5('|'.join(
+            f"{label}:{series_hash(dates, rates)}" for label, (dates, rates) in series_by_label.items()
+        ).encode('utf-8')).hexdigest()[:16]
+        period_key = f"{start_str}_{end_str}" if start_str and end_str else str(days)
+        cache_key = f"compare_{'_'.join(series_by_label)}_{period_key}_{int(rebase)}_{combined_hash}"
+        if variant is not None:
+            cache_key += f"_{variant.key}"
+        cached_info = self.lru_cache.get(cache_key)
+        if cached_info and self._chart_file_exists(cached_info):
+            return cached_info
+
+        with span('align'):
+            frame = align_series(series_by_label, rebase=rebase)
+        if len(frame) < 2:
+            return None
+        if start_str and end_str:
+            days = (datetime.strptime(end_str, '%Y-%m-%d') - datetime.strptime(start_str, '%Y-%m-%d')).days
+            period_label = f"{start_str} 至 {end_str}"
+        else:
+            period_label = None
+        chart_url = self.render_comparison_image(days, frame, rebase=rebase, period_label=period_label,
+                                                 chart_hash=combined_hash, variant=variant)
+        if not chart_url:
             return None
 
-        # 生成可讀性更高且唯一的檔名
-        latest_date_str = all_dates_str[-1] if all_dates_str else "nodate"
-        data_str = f"{days}-{buy_currency}-{sell_currency}-{''.join(all_dates_str)}-{''.join(map(str, all_rates))}"
-        chart_hash = hashlib.md5(data_str.encode('utf-8')).hexdigest()
-        filename = f"chart_{buy_currency}-{sell_currency}_{days}d_{latest_date_str}_{chart_hash[:8]}.png"
+        first, last = frame.iloc[0], frame.iloc[-1]
+        change_pct = (last / first - 1).mul(100).round(2)
+        chart_info = {
+            'chart_url': chart_url,
+            'pairs': list(series_by_label),
+            'rebase': rebase,
+            'start_date': frame.index[0].strftime('%Y-%m-%d'),
+            'end_date': frame.index[-1].strftime('%Y-%m-%d'),
+            'points': len(frame),
+            'stats': {label: {
+                'first': round(float(first[label]), 6),
+                'last': round(float(last[label]), 6),
+                'min': round(float(frame[label].min()), 6),
+                'max': round(float(frame[label].max()), 6),
+                'change_pct': float(change_pct[label]),
+            } for label in frame.columns},
+            'generated_at': datetime.now().isoformat(),
+            'content_hash': combined_hash,
+            'is_pinned': False
+        }
+        if variant is not None:
+            chart_info.update(format=variant.format, width=variant.width, dpi=variant.dpi)
+        self.lru_cache.put(cache_key, chart_info)
+        current_app.logger.info(f"💾 CACHE SET (compare): Stored chart for {', '.join(series_by_label)} ({period_key})")
+        return chart_info
 
-        relative_path = os.path.join('charts', filename)
-        full_path = os.path.join(self.charts_dir, filename)
+    @traced()
+    def build_chart_with_cache(self, days, buy_currency, sell_currency, live_rates_data=None):
+        """
+        內部輔助函數：重新生成圖表並更新快取。
+        可選擇傳入已獲取的即時數據以避免重複請求。
+        """
+        all_dates_str, all_rates, bands = self.get_period_series(days, buy_currency, sell_currency, live_rates_data)
+        is_pinned = buy_currency == 'TWD' and sell_currency == 'HKD'
 
-        if os.path.exists(full_path):
-            return f"/static/{relative_path.replace(os.path.sep, '/')}"
+        # --- 數據獲取完成後 ---
+        if not all_dates_str or not all_rates:
+            return None # 沒有足夠數據生成圖表
 
-        # 創建圖表
-        fig, ax = plt.subplots(figsize=(15, 8.5))
-        
-        # 轉換日期
-        dates = [datetime.strptime(d, '%Y-%m-%d') for d in all_dates_str]
-        rates = all_rates
+        # --- 內容雜湊與快取相同時，不必重繪，只延長快取時效 ---
+        cache_key = f"chart_{buy_currency}_{sell_currency}_{days}"
+        content_hash = series_hash(all_dates_str, all_rates, bands)
+        cached_info = self.lru_cache.get(cache_key)
+        if cached_info and cached_info.get('content_hash') == content_hash and self._chart_file_exists(cached_info):
+            self.lru_cache.put(cache_key, cached_info)
+            return cached_info
 
-        # 改成使用索引作為 X 軸，以確保間距相等
-        x_indices = range(len(dates))
-        ax.plot(x_indices, rates, marker='o', linewidth=2, markersize=4, color='#2E86AB')
-        
-        # 設定標題
-        period_names = {7: '近1週', 30: '近1個月', 90: '近3個月', 180: '近6個月'}
-        # 假設匯率是 TWD -> HKD，標題顯示 HKD -> TWD，所以是 1 TWD = X HKD
-        title = f'{buy_currency} 到 {sell_currency} 匯率走勢圖 ({period_names.get(days, f"近{days}天")})'
-        ax.set_title(title, fontsize=16, fontweight='bold', pad=20)
-        ax.set_xlabel('日期', fontsize=12)
-        ax.set_ylabel('匯率', fontsize=12)
+        # --- 生成圖表和統計數據 ---
+        chart_url = self.render_chart_image(days, all_dates_str, all_rates, buy_currency, sell_currency, bands=bands)
+        if not chart_url:
+            return None
+
+        stats = self._calculate_stats(all_rates, all_dates_str)
         
-        # 使用 MaxNLocator 自動決定 X 軸刻度，並確保最後一天總是被顯示
+        # --- 建立完整的圖表資訊對象，content_hash 供增量更新判斷內容是否改變 ---
+        chart_info = {
+            'chart_url': chart_url,
+            'stats': stats,
+            'generated_at': datetime.now().isoformat(),
+            'is_pinned': is_pinned,
+            'content_hash': content_hash
+        }
         
+        # --- 更新快取 ---
+        # 這是關鍵的修復：確保 build_chart_with_cache 自身就能更新快取
+        self.lru_cache.put(cache_key, chart_info)
+        current_app.logger.info(f"💾 CACHE SET (from regenerate): Stored chart for {buy_currency}-{sell_currency} ({days} days)")
+
+        return chart_info
+
+    @staticmethod
+    def _apply_date_ticks(ax, dates, days):
+        """以索引為 X 軸時設定日期刻度：MaxNLocator 自動決定刻度，並確保最後一天總是被顯示"""
+        x_indices = range(len(dates))
         # 根據圖表天數設定理想的刻度數量
         if days <= 10:
             nbins = 10
@@ -555,9 +1201,98 @@ class ExchangeRateManager:
         if tick_indices:
             # 設置刻度和標籤
             ax.set_xticks(tick_indices)
-            ax.set_xticklabels([dates[i].strftime('%m/%d') for i in tick_indices])
+            label_format = '%m/%d' if days <= 180 else '%Y/%m'
+            ax.set_xticklabels([dates[i].strftime(label_format) for i in tick_indices])
+
+    @staticmethod
+    def _draw_indicators(ax, x_indices, indicators, scale):
+        """疊加指標：移動平均與布林通道畫在主軸，波動率與漲跌幅（%）畫在右側副軸"""
+        secondary = None
+        for (spec, fields), color in zip(indicators, INDICATOR_COLORS):
+            label = f"{spec.name.upper()}({spec.window})"
+            if spec.name == 'bollinger':
+                ax.fill_between(x_indices, fields['lower'], fields['upper'], color=color, alpha=0.12, linewidth=0,
+                                label=label)
+                ax.plot(x_indices, fields['middle'], color=color, linewidth=1 * scale, linestyle=':')
+            elif is_price_scale(spec):
+                ax.plot(x_indices, fields[spec.name], color=color, linewidth=1.5 * scale, label=label)
+            else:
+                if secondary is None:
+                    secondary = ax.twinx()
+                    secondary.set_ylabel('%', fontsize=12 * scale)
+                    secondary.tick_params(axis='y', labelsize=10 * scale)
+                secondary.plot(x_indices, fields[spec.name], color=color, linewidth=1 * scale, alpha=0.7,
+                               label=f"{label} %")
+        if secondary is not None:
+            secondary.legend(loc='upper left', fontsize=9 * scale)
+
+    @traced()
+    def render_chart_image(self, days, all_dates_str, all_rates, buy_currency, sell_currency, bands=None, period_label=None,
+                           variant=None, indicators=None):
+        """
+        從提供的數據生成圖表，並將其保存為文件，返回其 URL 路徑。
+        all_dates_str 應為 'YYYY-MM-DD' 格式的字符串列表。
+        bands 為可選的 (最低, 最高) 列表，用於彙總數據的高低區間帶。
+        period_label 可覆寫標題中的期間文字（例如自訂日期範圍）。
+        variant 為 ChartVariant（格式、寬度、DPI），省略時輸出預設的 1500px PNG。
+        indicators 為 compute_indicators 的結果（與 all_dates_str 對齊），疊加在圖上。
+        檔名含數據雜湊與變體，同一份數據的同一變體只會繪製一次。
+        """
+        if not all_dates_str or not all_rates:
+            return None
+        variant = variant or DEFAULT_VARIANT
+
+        # 生成可讀性更高且唯一的檔名
+        latest_date_str = all_dates_str[-1] if all_dates_str else "nodate"
+        data_str = f"{days}-{buy_currency}-{sell_currency}-{''.join(all_dates_str)}-{''.join(map(str, all_rates))}"
+        if bands:
+            data_str += f"-{bands}"
+        chart_hash = hashlib.md5(data_str.encode('utf-8')).hexdigest()
+        suffix = '' if variant.is_default else f"_{variant.key}"
+        if indicators:
+            suffix += '_' + '-'.join(spec_label(spec) for spec, _ in indicators)
+        filename = f"chart_{buy_currency}-{sell_currency}_{days}d_{latest_date_str}_{chart_hash[:8]}{suffix}.{variant.extension}"
+
+        relative_path = os.path.join('charts', filename)
+        full_path = os.path.join(self.charts_dir, filename)
+
+        if os.path.exists(full_path):
+            return f"/static/{relative_path.replace(os.path.sep, '/')}"
+
+        render_started = time.perf_counter()
+
+        # 創建圖表（小尺寸變體同比例縮小字級、線寬與邊界）
+        scale = variant.scale
+        fig, ax = plt.subplots(figsize=variant.figsize, dpi=variant.dpi)
+        
+        # 轉換日期
+        with span('strptime'):
+            dates = [datetime.strptime(d, '%Y-%m-%d') for d in all_dates_str]
+        rates = all_rates
+
+        # 改成使用索引作為 X 軸，以確保間距相等
+        x_indices = range(len(dates))
+        ax.plot(x_indices, rates, marker='o', linewidth=2 * scale, markersize=4 * scale, color='#2E86AB')
+        if bands:
+            ax.fill_between(x_indices, [b[0] for b in bands], [b[1] for b in bands],
+                            color='#2E86AB', alpha=0.15, linewidth=0)
+        
+        if indicators:
+            self._draw_indicators(ax, x_indices, indicators, scale)
+
+        # 設定標題
+        period_names = {7: '近1週', 30: '近1個月', 90: '近3個月', 180: '近6個月', 365: '近1年', 1825: '近5年'}
+        # 假設匯率是 TWD -> HKD，標題顯示 HKD -> TWD，所以是 1 TWD = X HKD
+        title = f'{buy_currency} 到 {sell_currency} 匯率走勢圖 ({period_label or period_names.get(days, f"近{days}天")})'
+        ax.set_title(title, fontsize=16 * scale, fontweight='bold', pad=20 * scale)
+        ax.set_xlabel('日期', fontsize=12 * scale)
+        ax.set_ylabel('匯率', fontsize=12 * scale)
+        
+        # 使用 MaxNLocator 自動決定 X 軸刻度，並確保最後一天總是被顯示
+        self._apply_date_ticks(ax, dates, days)
 
-        ax.tick_params(axis='x', which='major', pad=8)
+        ax.tick_params(axis='x', which='major', pad=8 * scale)
+        ax.tick_params(axis='both', labelsize=10 * scale)
         
         # 添加網格
         ax.grid(True, alpha=0.3)
@@ -569,12 +1304,19 @@ class ExchangeRateManager:
         # 添加平均線
         if rates:
             avg_rate = sum(rates) / len(rates)
-            ax.axhline(y=avg_rate, color='orange', linestyle='--', linewidth=1.5, alpha=0.8, label=f'平均值: {avg_rate:.4f}')
-            ax.legend(loc='upper right', fontsize=10)
+            ax.axhline(y=avg_rate, color='orange', linestyle='--', linewidth=1.5 * scale, alpha=0.8, label=f'平均值: {avg_rate:.4f}')
+            ax.legend(loc='upper right', fontsize=10 * scale)
         
         # 設定 Y 軸範圍
         if rates:
-            y_min, y_max = min(rates), max(rates)
+            # 彙總數據的高低區間帶與布林通道也算入 Y 軸範圍
+            rates_for_range = [v for band in bands for v in band] if bands else rates
+            y_min, y_max = min(rates_for_range), max(rates_for_range)
+            for spec, fields in indicators or ():
+                if is_price_scale(spec):
+                    for values in fields.values():
+                        if not np.isnan(values).all():
+                            y_min, y_max = min(y_min, np.nanmin(values)), max(y_max, np.nanmax(values))
             y_range = y_max - y_min if y_max > y_min else 0.1
             if days >= 30:
                 ax.set_ylim(y_min - y_range * 0.05, y_max + y_range * 0.15)
@@ -595,7 +1337,7 @@ class ExchangeRateManager:
                        xytext=(0,10), 
                        ha='center',
                        va='bottom',
-                       fontsize=9,
+                       fontsize=9 * scale,
                        color='red',
                        fontweight='bold',
                        bbox=dict(boxstyle="round", facecolor='white', alpha=0.6, edgecolor='none'))
@@ -607,29 +1349,107 @@ class ExchangeRateManager:
                        xytext=(0,10), # 調整y偏移以避免重疊
                        ha='center',
                        va='bottom',
-                       fontsize=9,
+                       fontsize=9 * scale,
                        color='green',
                        fontweight='bold',
                        bbox=dict(boxstyle="round", facecolor='white', alpha=0.6, edgecolor='none'))
         
-        # 手動調整佈局
-        fig.subplots_adjust(left=0.08, right=0.95, top=0.85, bottom=0.20)
-        
+        # 以固定的吋數留邊（不用 bbox_inches='tight'，省下一次額外繪製，輸出尺寸也固定為要求的寬度）
+        # 有右側副軸（百分比指標）時多留刻度標籤的空間
+        width_inches, height_inches = variant.figsize
+        has_secondary = any(not is_price_scale(spec) for spec, _ in indicators or ())
+        right_margin = 0.9 if has_secondary else 0.35
+        fig.subplots_adjust(left=1.0 * scale / width_inches, right=1 - right_margin * scale / width_inches,
+                            top=1 - 0.8 * scale / height_inches, bottom=0.85 * scale / height_inches)
+        fig.patch.set_facecolor('white')
+
         try:
-            fig.savefig(full_path, format='png', transparent=False, bbox_inches='tight', facecolor='white')
+            with span('savefig'):
+                save_figure(fig, full_path, variant)
         except Exception as e:
             print(f"儲存圖表時出錯: {e}")
             plt.close(fig)
             return None
         finally:
             plt.close(fig)
-        
+
+        # 自訂日期範圍的天數不固定，統一歸為 custom 以免標籤無限增長
+        period = str(days) if days in period_names and not period_label else 'custom'
+        metrics.CHART_RENDER_SECONDS.observe(time.perf_counter() - render_started, period)
+
         self._cleanup_charts_directory(self.charts_dir, max_age_days=1)
         
         # 返回 Flask 能識別的靜態文件 URL
         return f"/static/{relative_path.replace(os.path.sep, '/')}"
 
-    def warm_up_chart_cache(self, buy_currency='TWD', sell_currency='HKD'):
+    @traced()
+    def render_comparison_image(self, days, frame, rebase=False, period_label=None, chart_hash='', variant=None):
+        """
+        把 align_series 對齊好的 DataFrame（每欄一組貨幣對）畫成一張比較圖，返回圖表 URL。
+        所有貨幣對共用同一個 X 軸索引，一次建立圖形、一次存檔。
+        """
+        if frame.empty:
+            return None
+        variant = variant or DEFAULT_VARIANT
+
+        labels = list(frame.columns)
+        latest_date_str = frame.index[-1].strftime('%Y-%m-%d')
+        suffix = '' if variant.is_default else f"_{variant.key}"
+        filename = (f"chart_compare_{'_'.join(labels)}_{days}d_{latest_date_str}_{int(rebase)}_"
+                    f"{chart_hash[:8]}{suffix}.{variant.extension}")
+        relative_path = os.path.join('charts', filename)
+        full_path = os.path.join(self.charts_dir, filename)
+        if os.path.exists(full_path):
+            return f"/static/{relative_path.replace(os.path.sep, '/')}"
+
+        render_started = time.perf_counter()
+        scale = variant.scale
+        fig, ax = plt.subplots(figsize=variant.figsize, dpi=variant.dpi)
+
+        dates = frame.index.to_pydatetime()
+        x_indices = range(len(dates))
+        values = frame.to_numpy()
+        change_pct = (values[-1] / values[0] - 1) * 100
+        for column, label in enumerate(labels):
+            ax.plot(x_indices, values[:, column], linewidth=2 * scale, color=COMPARE_COLORS[column % len(COMPARE_COLORS)],
+                    label=f"{label} ({change_pct[column]:+.2f}%)")
+        if rebase:
+            ax.axhline(y=100, color='gray', linestyle='--', linewidth=1 * scale, alpha=0.6)
+
+        period_names = {7: '近1週', 30: '近1個月', 90: '近3個月', 180: '近6個月', 365: '近1年', 1825: '近5年'}
+        title = f'匯率比較 ({period_label or period_names.get(days, f"近{days}天")})'
+        ax.set_title(title, fontsize=16 * scale, fontweight='bold', pad=20 * scale)
+        ax.set_xlabel('日期', fontsize=12 * scale)
+        ax.set_ylabel('指數（起點=100）' if rebase else '匯率', fontsize=12 * scale)
+
+        self._apply_date_ticks(ax, dates, days)
+        ax.tick_params(axis='x', which='major', pad=8 * scale)
+        ax.tick_params(axis='both', labelsize=10 * scale)
+        ax.grid(True, alpha=0.3)
+        ax.yaxis.set_major_locator(MaxNLocator(nbins=10, prune='both', min_n_ticks=5))
+        ax.yaxis.set_major_formatter(FuncFormatter(lambda y, _: f'{y:.2f}' if rebase else f'{y:.4f}'))
+        ax.legend(loc='upper left', fontsize=10 * scale)
+
+        width_inches, height_inches = variant.figsize
+        fig.subplots_adjust(left=1.0 * scale / width_inches, right=1 - 0.35 * scale / width_inches,
+                            top=1 - 0.8 * scale / height_inches, bottom=0.85 * scale / height_inches)
+        fig.patch.set_facecolor('white')
+
+        try:
+            with span('savefig'):
+                save_figure(fig, full_path, variant)
+        except Exception as e:
+            print(f"儲存比較圖表時出錯: {e}")
+            return None
+        finally:
+            plt.close(fig)
+
+        period = str(days) if days in period_names and not period_label else 'custom'
+        metrics.CHART_RENDER_SECONDS.observe(time.perf_counter() - render_started, period)
+        self._cleanup_charts_directory(self.charts_dir, max_age_days=1)
+        return f"/static/{relative_path.replace(os.path.sep, '/')}"
+
+    def warm_up_chart_cache(self, buy_currency='TWD', sell_currency='HKD', priority=WARMUP):
         """
         為常用週期預熱圖表快取。
         此函數只提交任務，不阻塞。
@@ -641,7 +1461,7 @@ class ExchangeRateManager:
         if buy_currency == 'TWD' and sell_currency == 'HKD':
             print(f"[{datetime.now().strftime('%Y-%m-%d %H:%M:%S')}] 觸發 {buy_currency}-{sell_currency} 圖表直接生成...")
 
-            for period in [7, 30, 90, 180]:
+            for period in [7, 30, 90, 180, *LONG_RANGE_PERIODS]:
                 def generate_and_notify(manager_instance, period, app_context):
                     with app_context.app_context():
                         try:
@@ -666,18 +1486,161 @@ class ExchangeRateManager:
                                 'sell_currency': sell_currency, 'period': period
                             })
                 
-                self.background_executor.submit(generate_and_notify, self, period, flask_app)
+                self.jobs.submit(generate_and_notify, self, period, flask_app,
+                                 priority=priority, pair=(buy_currency, sell_currency),
+                                 name=f"warm-up {buy_currency}-{sell_currency} {period}d",
+                                 key=f"render:{buy_currency}-{sell_currency}:{period}")
 
         # 策略二：對於其他貨幣對，我們需要先抓取數據，然後再生成圖表
         else:
-            with self._active_fetch_lock:
-                if (buy_currency, sell_currency) not in self._active_fetches:
-                    print(f"🌀 {buy_currency}-{sell_currency} 的背景抓取任務已啟動...")
-                    self._active_fetches.add((buy_currency, sell_currency))
-                    # 提交的是 _background_fetch_and_generate 任務，並傳遞 flask_app
-                    self.background_executor.submit(self._background_fetch_and_generate, buy_currency, sell_currency, flask_app)
-                else:
-                    print(f"✅ {buy_currency}-{sell_currency} 的背景抓取已在進行中，無需重複啟動。")
+            self._start_background_fetch(buy_currency, sell_currency, priority)
+
+    def refresh_pair(self, buy_currency, sell_currency, priority=WARMUP):
+        """
+        增量刷新貨幣對：只抓取本地最新日期之後的新日期，寫回後重建各期間圖表並更新最新匯率快取，
+        讓熱門貨幣對不會因快取過期而走冷路徑。本地沒有近期數據時改走完整的背景抓取。
+        返回新抓到的天數。
+        """
+        if self.jobs.is_pending(f"fetch:{buy_currency}-{sell_currency}"):
+            print(f"⏭️ {buy_currency}-{sell_currency} 的背景抓取正在進行，略過刷新。")
+            return 0
+
+        end_date = datetime.now()
+        start_date = end_date - timedelta(days=BACKGROUND_FETCH_DAYS)
+        stored = self.get_stored_rates(buy_currency, sell_currency,
+                                       start_date.strftime('%Y-%m-%d'), end_date.strftime('%Y-%m-%d'))
+        if not stored:
+            print(f"🌀 {buy_currency}-{sell_currency} 本地沒有近期數據，改為完整背景抓取。")
+            # 與 _start_background_fetch 共用 fetch:{pair} 去重 key，期間若有請求觸發抓取會併入同一個任務
+            future = self.jobs.submit(self._background_fetch_and_generate, buy_currency, sell_currency,
+                                      current_app._get_current_object(), priority, False,  # require_interest
+                                      priority=priority, pair=(buy_currency, sell_currency),
+                                      name=f"background fetch {buy_currency}-{sell_currency}",
+                                      key=f"fetch:{buy_currency}-{sell_currency}")
+            with self.jobs.released():
+                future.result()
+            return len(self.get_stored_rates(buy_currency, sell_currency,
+                                             start_date.strftime('%Y-%m-%d'), end_date.strftime('%Y-%m-%d')))
+
+        # 1. 只抓取本地最新日期之後、且規劃器認為可能有數據的日期
+        latest_stored = datetime.strptime(max(stored), '%Y-%m-%d')
+        new_dates = []
+        current_date = end_date
+        while current_date.date() > latest_stored.date():
+            new_dates.append(current_date)
+            current_date -= timedelta(days=1)
+        new_dates = self.planner.plan(buy_currency, sell_currency, new_dates)
+
+        new_rates = {}
+        futures = [self.jobs.submit(self._fetch_single_rate, d, buy_currency, sell_currency,
+                                    priority=priority, pair=(buy_currency, sell_currency),
+                                    name=f"refresh {buy_currency}-{sell_currency} {d.strftime('%Y-%m-%d')}")
+                   for d in new_dates]
+        for future in self.jobs.as_completed(futures):
+            date_str, rate = future.result()
+            if rate is not None:
+                new_rates[date_str] = rate
+        if new_rates:
+            self.store_rates(buy_currency, sell_currency, new_rates)
+            stored.update(new_rates)
+        self.planner.save()
+
+        # 2. 增量更新各期間圖表：內容未變或快取仍在的期間不會重繪
+        self.refresh_period_charts(buy_currency, sell_currency)
+
+        # 3. 以本地最新兩筆數據更新最新匯率快取
+        sorted_dates = sorted(stored)
+        latest_date_str = sorted_dates[-1]
+        trend, trend_value = None, 0
+        if len(sorted_dates) > 1:
+            trend_value = stored[latest_date_str] - stored[sorted_dates[-2]]
+            if trend_value > 0.00001: trend = 'up'
+            elif trend_value < -0.00001: trend = 'down'
+            else: trend = 'same'
+        self.latest_rate_cache.put((buy_currency, sell_currency), {
+            'date': latest_date_str,
+            'rate': stored[latest_date_str],
+            'trend': trend, 'trend_value': trend_value,
+            'updated_time': datetime.now().isoformat()
+        })
+
+        print(f"🔄 {buy_currency}-{sell_currency} 增量刷新完成：新增 {len(new_rates)} 天（嘗試 {len(new_dates)} 天）。")
+        return len(new_rates)
+
+    def refresh_period_charts(self, buy_currency, sell_currency):
+        """
+        新增數據後增量更新各期間的圖表與統計。
+        日資料期間以滑動窗口更新統計（每加入/移出一天 O(1)），內容雜湊與快取相同就不重繪；
+        有變化時發送 chart_delta 事件（加入/移出的數據點、新統計與圖表 URL），前端可直接套用。
+        長區間期間由彙總數據生成，同樣在內容未變時略過重繪。
+        返回 {period: 'unchanged' | 'rendered' | 'failed'}。
+        """
+        results = {}
+        now = datetime.now()
+        for days in CHART_GENERATION_CHECKPOINTS:
+            cache_key = f"chart_{buy_currency}_{sell_currency}_{days}"
+            with self._windows_lock:
+                window = self._get_window(days, buy_currency, sell_currency)
+                window.evict_before((now - timedelta(days=days)).strftime('%Y-%m-%d'))
+                appended, removed = window.take_delta()
+                content_hash = window.content_hash
+                stats = window.stats()
+                cached_info = self.lru_cache.get(cache_key)
+                unchanged = (cached_info is not None and cached_info.get('content_hash') == content_hash
+                             and self._chart_file_exists(cached_info))
+                series = None if unchanged else window.series()
+
+            if unchanged:
+                self.lru_cache.put(cache_key, cached_info)  # 延長快取時效
+                results[days] = 'unchanged'
+                continue
+            if not stats:
+                results[days] = 'failed'
+                continue
+
+            chart_url = self.render_chart_image(days, series[0], series[1], buy_currency, sell_currency)
+            if not chart_url:
+                results[days] = 'failed'
+                continue
+            chart_info = {
+                'chart_url': chart_url,
+                'stats': stats,
+                'generated_at': datetime.now().isoformat(),
+                'is_pinned': buy_currency == 'TWD' and sell_currency == 'HKD',
+                'content_hash': content_hash
+            }
+            self.lru_cache.put(cache_key, chart_info)
+            results[days] = 'rendered'
+            send_sse_event('chart_delta', {
+                'buy_currency': buy_currency,
+                'sell_currency': sell_currency,
+                'period': days,
+                'appended': [{'date': d, 'rate': r} for d, r in appended],
+                'removed': [d for d, _ in removed],
+                'chart_url': chart_url,
+                'stats': stats,
+                'content_hash': content_hash
+            })
+
+        for days in LONG_RANGE_PERIODS:
+            cached_info = self.lru_cache.get(f"chart_{buy_currency}_{sell_currency}_{days}")
+            chart_info = self.build_chart_with_cache(days, buy_currency, sell_currency)
+            if not chart_info:
+                results[days] = 'failed'
+            elif chart_info is cached_info:
+                results[days] = 'unchanged'
+            else:
+                results[days] = 'rendered'
+                send_sse_event('chart_ready', {
+                    'buy_currency': buy_currency,
+                    'sell_currency': sell_currency,
+                    'period': days,
+                    'chart_url': chart_info['chart_url'],
+                    'stats': chart_info['stats']
+                })
+
+        print(f"📊 {buy_currency}-{sell_currency} 增量更新圖表: {results}")
+        return results
 
     @staticmethod
     def _cleanup_charts_directory(directory, max_age_days=1):
@@ -695,7 +1658,8 @@ class ExchangeRateManager:
 
     def clear_expired_cache(self):
         """清理過期的快取項目"""
-        cleared_count = self.lru_cache.clear_expired()
+        cleared_count = (self.lru_cache.clear_expired() + self.variant_cache.clear_expired()
+                         + self.sparkline_cache.clear_expired())
         if cleared_count > 0:
             print(f"🧹 快取清理完成：圖表快取過期 {cleared_count} 項")
         return cleared_count
@@ -711,6 +1675,122 @@ class ExchangeRateManager:
             'date_range': f"{dates_str[0]} 至 {dates_str[-1]}"
         }
 
+    def _latest_from_local_data(self):
+        """從本地 TWD-HKD 數據取出最新一筆匯率及漲跌趨勢"""
+        with self.data_lock:
+            self.data.refresh()
+            last_two = self.data.tail(2)
+            if not last_two:
+                return None
+
+            latest_date_str, latest_rate, latest_updated = last_two[-1]
+
+            trend, trend_value = None, 0
+            if len(last_two) > 1:
+                previous_rate = last_two[0][1]
+                trend_value = latest_rate - previous_rate
+                if trend_value > 0.00001: trend = 'up'
+                elif trend_value < -0.00001: trend = 'down'
+                else: trend = 'same'
+
+            return {
+                'date': latest_date_str, 'rate': latest_rate, 'trend': trend,
+                'trend_value': trend_value, 'source': 'local_file',
+                'updated_time': latest_updated or datetime.now().isoformat()
+            }
+
+    def _latest_from_store(self, buy_currency, sell_currency, lookback_days=30):
+        """本地儲存中最近一筆匯率（最近 lookback_days 天內），沒有時返回 None"""
+        start_str = (datetime.now() - timedelta(days=lookback_days)).strftime('%Y-%m-%d')
+        stored = self.get_stored_rates(buy_currency, sell_currency, start_str)
+        if not stored:
+            return None
+        latest_date_str = max(stored)
+        return {'date': latest_date_str, 'rate': stored[latest_date_str], 'trend': None, 'trend_value': 0,
+                'source': 'stale_local'}
+
+    def _fetch_latest_rate(self, buy_currency, sell_currency):
+        """
+        從 API 抓取最近一個工作日的匯率並存入快取。
+        不依賴 Flask 上下文，可在背景執行緒中並行呼叫；失敗時返回 None。
+        """
+        # 尋找最近一個可能有數據的發布日（略過週末、休市日與近期確認無數據的日期）
+        current_date = self.planner.latest_publication_day(buy_currency, sell_currency)
+
+        _, conversion_rate = self._fetch_single_rate(current_date, buy_currency, sell_currency)
+        if conversion_rate is None:
+            return None
+
+        latest_data = {
+            'date': current_date.strftime('%Y-%m-%d'),
+            'rate': conversion_rate,
+            'trend': None, 'trend_value': 0,
+            'updated_time': datetime.now().isoformat()
+        }
+        self.latest_rate_cache.put((buy_currency, sell_currency), latest_data)
+        self.check_alerts(buy_currency, sell_currency, conversion_rate, latest_data['date'])
+        return latest_data
+
+    def get_latest_rates(self, pairs):
+        """
+        批次獲取多個貨幣對的最新匯率。
+        先從快取與本地數據回答，未命中的貨幣對再以互動優先級交給排程器並行抓取
+        （所有請求共用全域 rate_limiter 的速率預算）。
+        返回 (entries, missing)：entries 為 {(buy, sell): entry}，missing 為抓取失敗的貨幣對列表。
+        """
+        entries = {}
+        to_fetch = []
+
+        for buy_currency, sell_currency in pairs:
+            if (buy_currency, sell_currency) in entries:
+                continue
+            if buy_currency == 'TWD' and sell_currency == 'HKD':
+                local = self._latest_from_local_data()
+                if local:
+                    entries[(buy_currency, sell_currency)] = local
+                    continue
+            cached_rate = self.latest_rate_cache.get((buy_currency, sell_currency))
+            if cached_rate:
+                entry = cached_rate.copy()
+                entry['source'] = 'cache'
+                entries[(buy_currency, sell_currency)] = entry
+            elif (buy_currency, sell_currency) not in to_fetch:
+                to_fetch.append((buy_currency, sell_currency))
+
+        missing = []
+        if to_fetch:
+            print(f"🔄 批次最新匯率：快取未命中 {len(to_fetch)} 組，並行抓取中...")
+            future_to_pair = {
+                self.jobs.submit(self._fetch_latest_rate, buy, sell, priority=INTERACTIVE, pair=(buy, sell),
+                                 name=f"latest {buy}-{sell}", key=f"latest:{buy}-{sell}"): (buy, sell)
+                for buy, sell in to_fetch
+            }
+            for future in self.jobs.as_completed(future_to_pair):
+                pair = future_to_pair[future]
+                try:
+                    latest_data = future.result()
+                except Exception as e:
+                    print(f"❌ 批次抓取 {pair[0]}-{pair[1]} 時發生錯誤: {e}")
+                    latest_data = None
+                if latest_data:
+                    entry = latest_data.copy()
+                    entry['source'] = 'api'
+                    entries[pair] = entry
+                else:
+                    missing.append(pair)
+
+        # 計算每筆數據的新鮮度（距離更新時間的秒數）
+        now = datetime.now()
+        for entry in entries.values():
+            try:
+                updated = datetime.fromisoformat(entry['updated_time'])
+                entry['age_seconds'] = max(0, int((now - updated).total_seconds()))
+            except (KeyError, TypeError, ValueError):
+                entry['age_seconds'] = None
+
+        return entries, missing
+
+    @traced()
     def get_current_rate(self, buy_currency, sell_currency):
         """
         獲取最新匯率，整合了 TWD-HKD 本地數據、其他貨幣對的 LRU 快取和 API 後備機制。
@@ -719,35 +1799,11 @@ class ExchangeRateManager:
         # --- 優先處理 TWD-HKD: 從本地 JSON 數據獲取 ---
         if buy_currency == 'TWD' and sell_currency == 'HKD':
             current_app.logger.info(f"從本地文件獲取 TWD-HKD 最新匯率")
-            with self.data_lock:
-                if not self.data:
-                    return None
-                sorted_dates = self.get_sorted_dates()
-                if not sorted_dates:
-                    return None
-                
-                latest_date_str = sorted_dates[-1]
-                latest_data = self.data[latest_date_str]
-                latest_rate = latest_data['rate']
-                
-                trend, trend_value = None, 0
-                if len(sorted_dates) > 1:
-                    previous_date_str = sorted_dates[-2]
-                    previous_rate = self.data[previous_date_str]['rate']
-                    trend_value = latest_rate - previous_rate
-                    if trend_value > 0.00001: trend = 'up'
-                    elif trend_value < -0.00001: trend = 'down'
-                    else: trend = 'same'
-                
-                return {
-                    'date': latest_date_str, 'rate': latest_rate, 'trend': trend,
-                    'trend_value': trend_value, 'source': 'local_file',
-                    'updated_time': latest_data.get('updated', datetime.now().isoformat())
-                }
+            return self._latest_from_local_data()
 
         # --- 其他貨幣對：走 LRU 快取 -> API 抓取 的流程 ---
         cache_key = (buy_currency, sell_currency)
-        
+
         # 1. 嘗試從快取中獲取數據
         cached_rate = self.latest_rate_cache.get(cache_key)
         if cached_rate:
@@ -758,28 +1814,27 @@ class ExchangeRateManager:
 
         # 2. 如果快取未命中，則從 API 即時抓取
         current_app.logger.info(f"🔄 API LATEST (FETCH): {buy_currency}-{sell_currency} - 快取未命中，嘗試從 API 獲取...")
-        current_date = datetime.now()
-        while current_date.weekday() >= 5: # 尋找最近的工作日
-            current_date -= timedelta(days=1)
-
-        rate_data = self.get_exchange_rate(current_date, buy_currency, sell_currency)
-
-        if not rate_data or 'data' not in rate_data:
-            current_app.logger.error(f"❌ API LATEST (FAIL): {buy_currency}-{sell_currency} - API 抓取失敗。")
+        future = self.jobs.submit(self._fetch_latest_rate, buy_currency, sell_currency,
+                                  priority=INTERACTIVE, pair=cache_key,
+                                  name=f"latest {buy_currency}-{sell_currency}",
+                                  key=f"latest:{buy_currency}-{sell_currency}")
+        try:
+            latest_data = future.result(timeout=INTERACTIVE_WAIT_SECONDS)
+        except concurrent.futures.TimeoutError:
+            # 排程器忙碌：先以本地儲存的最近一筆回應，抓取任務完成後會更新快取
+            stale = self._latest_from_store(buy_currency, sell_currency)
+            if stale is None:
+                raise SchedulerBusyError(f"{buy_currency}-{sell_currency} 最新匯率排隊逾時")
+            current_app.logger.warning(f"⏳ API LATEST (STALE): {buy_currency}-{sell_currency} - 排程器忙碌，改用本地最近一筆")
+            return dict(stale, buy_currency=buy_currency, sell_currency=sell_currency)
+        if latest_data is None:
+            current_app.logger.error(f"❌ API LATEST (FAIL): {buy_currency}-{sell_currency} - API 抓取或解析失敗。")
             return None
 
-        # 3. 解析成功後，將新數據存入快取
+        # 3. 新數據已存入快取，補上期間最低匯率資訊
         try:
-            conversion_rate = float(rate_data['data']['conversionRate'])
-            latest_data = {
-                'date': current_date.strftime('%Y-%m-%d'),
-                'rate': conversion_rate,
-                'trend': None, 'trend_value': 0,
-                'updated_time': datetime.now().isoformat()
-            }
-            self.latest_rate_cache.put(cache_key, latest_data)
             current_app.logger.info(f"💾 API LATEST (STORE): {buy_currency}-{sell_currency} - 成功獲取並存入快取")
-            
+
             # 計算過去各期間最低匯率，優先 7, 30, 90, 180
             lowest_rate = None
             lowest_period = None
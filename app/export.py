@@ -0,0 +1,95 @@
+import io
+import csv
+import json
+
+try:
+    import pyarrow as pa
+except ImportError:  # Arrow 匯出為選用功能，需要安裝 pyarrow
+    pa = None
+
+# 匯出的欄位；日資料的 period_start 與 date 相同、low/high 為空，週/月彙總的 date 為區間最後一天
+EXPORT_COLUMNS = ('buy_currency', 'sell_currency', 'date', 'rate', 'granularity', 'period_start', 'low', 'high')
+
+# 每累積多少列輸出一次（也是 Arrow record batch 的大小）
+EXPORT_BATCH_ROWS = 1000
+
+FORMATS = {
+    'csv': ('text/csv; charset=utf-8', 'csv'),
+    'ndjson': ('application/x-ndjson', 'ndjson'),
+    'arrow': ('application/vnd.apache.arrow.stream', 'arrows'),
+}
+
+
+def available_formats():
+    return [fmt for fmt in FORMATS if fmt != 'arrow' or pa is not None]
+
+
+def _batches(rows, size=EXPORT_BATCH_ROWS):
+    batch = []
+    for row in rows:
+        batch.append(row)
+        if len(batch) >= size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+def stream_csv(rows):
+    buffer = io.StringIO()
+    writer = csv.writer(buffer, lineterminator='\n')
+    writer.writerow(EXPORT_COLUMNS)
+    yield buffer.getvalue()
+    for batch in _batches(rows):
+        buffer.seek(0)
+        buffer.truncate()
+        writer.writerows(batch)
+        yield buffer.getvalue()
+
+
+def stream_ndjson(rows):
+    for batch in _batches(rows):
+        yield ''.join(json.dumps(dict(zip(EXPORT_COLUMNS, row)), ensure_ascii=False) + '\n' for row in batch)
+
+
+def _arrow_schema():
+    return pa.schema([
+        ('buy_currency', pa.string()), ('sell_currency', pa.string()), ('date', pa.string()),
+        ('rate', pa.float64()), ('granularity', pa.string()), ('period_start', pa.string()),
+        ('low', pa.float64()), ('high', pa.float64()),
+    ])
+
+
+def stream_arrow(rows):
+    """Arrow IPC 串流格式：先送出 schema，之後每批一個 record batch，客戶端可邊收邊讀"""
+    schema = _arrow_schema()
+    sink = io.BytesIO()
+    writer = pa.ipc.new_stream(sink, schema)
+
+    def drain():
+        data = sink.getvalue()
+        sink.seek(0)
+        sink.truncate()
+        return data
+
+    yield drain()
+    for batch in _batches(rows):
+        columns = list(zip(*batch))
+        writer.write_batch(pa.record_batch([pa.array(column, type=field.type)
+                                            for column, field in zip(columns, schema)], schema=schema))
+        yield drain()
+    writer.close()
+    yield drain()
+
+
+def stream_rows(rows, fmt):
+    """依格式把列轉為可直接作為回應主體的產生器"""
+    if fmt == 'csv':
+        return stream_csv(rows)
+    if fmt == 'ndjson':
+        return stream_ndjson(rows)
+    if fmt == 'arrow':
+        if pa is None:
+            raise ValueError('Arrow 匯出需要安裝 pyarrow')
+        return stream_arrow(rows)
+    raise ValueError(f"不支援的匯出格式: {fmt}（可用 {', '.join(FORMATS)}）")
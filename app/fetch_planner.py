@@ -0,0 +1,201 @@
+import os
+import json
+import time
+from datetime import datetime, timedelta
+from threading import Lock
+
+from .utils import atomic_write_json
+
+# 規劃器狀態（發布日曆與負面快取）的存放位置
+PLANNER_FILE = os.path.join('data', 'fetch_planner.json')
+
+# 負面快取有效期（秒）
+NEGATIVE_TTL_SECONDS = int(os.environ.get('NEGATIVE_CACHE_TTL', 30 * 86400))  # 確定沒有發布的舊日期
+RECENT_NEGATIVE_TTL_SECONDS = 3600   # 最近幾天可能稍後才發布，只短暫記住
+FAILURE_TTL_SECONDS = 600            # 網路錯誤，稍後再試
+RECENT_DAYS = 3
+
+# 某貨幣在某星期幾累積足夠觀察次數後，才以學習結果取代預設規則（週一至週五發布）
+MIN_OBSERVATIONS = 8
+
+# 每個貨幣對記住最近幾筆抓到的匯率，用來辨識沿用前一天數值的日期
+RECENT_RATES_KEPT = 400
+
+
+class FetchPlanner:
+    def __init__(self, path=PLANNER_FILE):
+        """
+        抓取規劃器：依各貨幣學習到的發布日曆與負面快取，
+        只把可能產生新數據的日期交給抓取流程。
+        """
+        self.path = path
+        self.lock = Lock()
+        # currency -> {'new': [7 個星期幾的計數], 'none': [...]}
+        self._calendar = {}
+        # "BUY-SELL" -> {date_str: 過期時間戳}
+        self._negative = {}
+        self._seeded = set()
+        # "BUY-SELL" -> {date_str: (rate, 是否計為發布)}，只在記憶體中
+        self._recent_rates = {}
+        self._dirty = False
+        self._stats = {'planned': 0, 'skipped_calendar': 0, 'skipped_negative': 0}
+        self._load()
+
+    def _load(self):
+        if not os.path.exists(self.path):
+            return
+        try:
+            with open(self.path, 'r', encoding='utf-8') as f:
+                state = json.load(f)
+            self._calendar = state.get('calendar', {})
+            self._negative = state.get('negative', {})
+            self._seeded = set(state.get('seeded', []))
+        except (json.JSONDecodeError, IOError) as e:
+            print(f"載入抓取規劃器狀態時發生錯誤: {e}")
+
+    def save(self):
+        """有變更時才落盤，並順便清除已過期的負面快取"""
+        with self.lock:
+            if not self._dirty:
+                return
+            now = time.time()
+            for pair_key in list(self._negative):
+                entries = {d: exp for d, exp in self._negative[pair_key].items() if exp > now}
+                if entries:
+                    self._negative[pair_key] = entries
+                else:
+                    del self._negative[pair_key]
+            state = {'calendar': self._calendar, 'negative': self._negative, 'seeded': sorted(self._seeded)}
+            self._dirty = False
+        os.makedirs(os.path.dirname(self.path) or '.', exist_ok=True)
+        atomic_write_json(self.path, state, ensure_ascii=False)
+
+    def _observe(self, currency, weekday, published):
+        """記錄一次觀察（內部方法，不加鎖）"""
+        counts = self._calendar.setdefault(currency, {'new': [0] * 7, 'none': [0] * 7})
+        counts['new' if published else 'none'][weekday] += 1
+        self._dirty = True
+
+    def _reclassify_as_carried(self, currency, weekday):
+        """把先前記為發布的一次觀察改記為沿用前值（內部方法，不加鎖）"""
+        counts = self._calendar.setdefault(currency, {'new': [0] * 7, 'none': [0] * 7})
+        counts['new'][weekday] = max(0, counts['new'][weekday] - 1)
+        counts['none'][weekday] += 1
+        self._dirty = True
+
+    def _publishes_on(self, currency, weekday):
+        """依學習結果判斷該貨幣在星期幾是否會發布新匯率（內部方法，不加鎖）"""
+        counts = self._calendar.get(currency)
+        if counts:
+            new, none = counts['new'][weekday], counts['none'][weekday]
+            if new + none >= MIN_OBSERVATIONS:
+                return new >= none
+        return weekday < 5
+
+    def is_publication_day(self, buy_currency, sell_currency, date):
+        """兩種貨幣都會在該星期幾發布新匯率時，才值得抓取"""
+        weekday = date.weekday()
+        with self.lock:
+            return self._publishes_on(buy_currency, weekday) and self._publishes_on(sell_currency, weekday)
+
+    def _is_negative(self, buy_currency, sell_currency, date_str, now):
+        """負面快取是否仍有效（內部方法，不加鎖）"""
+        expires_at = self._negative.get(f"{buy_currency}-{sell_currency}", {}).get(date_str)
+        return expires_at is not None and expires_at > now
+
+    def plan(self, buy_currency, sell_currency, dates, use_calendar=True):
+        """從候選日期中篩掉非發布日與仍在負面快取中的日期，保留原順序"""
+        now = time.time()
+        planned = []
+        skipped_calendar = skipped_negative = 0
+        with self.lock:
+            for date in dates:
+                if use_calendar and not (self._publishes_on(buy_currency, date.weekday())
+                                         and self._publishes_on(sell_currency, date.weekday())):
+                    skipped_calendar += 1
+                elif self._is_negative(buy_currency, sell_currency, date.strftime('%Y-%m-%d'), now):
+                    skipped_negative += 1
+                else:
+                    planned.append(date)
+            self._stats['planned'] += len(planned)
+            self._stats['skipped_calendar'] += skipped_calendar
+            self._stats['skipped_negative'] += skipped_negative
+        if skipped_calendar or skipped_negative:
+            print(f"🗓️ {buy_currency}-{sell_currency}: 規劃抓取 {len(planned)} 天，略過非發布日 {skipped_calendar} 天、負面快取 {skipped_negative} 天")
+        return planned
+
+    def latest_publication_day(self, buy_currency, sell_currency, date=None, max_lookback=10):
+        """從指定日期往回找最近一個可能有數據的日期"""
+        date = date or datetime.now()
+        now = time.time()
+        with self.lock:
+            for _ in range(max_lookback):
+                if (self._publishes_on(buy_currency, date.weekday()) and self._publishes_on(sell_currency, date.weekday())
+                        and not self._is_negative(buy_currency, sell_currency, date.strftime('%Y-%m-%d'), now)):
+                    return date
+                date -= timedelta(days=1)
+        return date
+
+    def record(self, buy_currency, sell_currency, date, published, rate=None):
+        """
+        記錄上游對某日期的回應：有數據或確定沒有數據。
+        有數據時傳入 rate，與 learn_from_series 相同：和前一天數值完全相同的日期視為沿用前值（例如週末），
+        不算發布新匯率；抓取順序不固定，後抓到的前一天若與已記錄的隔天相同，也會把隔天改記為沿用。
+        """
+        date_str = date.strftime('%Y-%m-%d')
+        with self.lock:
+            pair_key = f"{buy_currency}-{sell_currency}"
+            counted_as_new = published
+            if published and rate is not None:
+                recent = self._recent_rates.setdefault(pair_key, {})
+                previous = recent.get((date - timedelta(days=1)).strftime('%Y-%m-%d'))
+                counted_as_new = not (previous is not None and previous[0] == rate)
+                next_date = date + timedelta(days=1)
+                following = recent.get(next_date.strftime('%Y-%m-%d'))
+                if following is not None and following[1] and following[0] == rate:
+                    self._reclassify_as_carried(buy_currency, next_date.weekday())
+                    self._reclassify_as_carried(sell_currency, next_date.weekday())
+                    recent[next_date.strftime('%Y-%m-%d')] = (rate, False)
+                recent[date_str] = (rate, counted_as_new)
+                if len(recent) > RECENT_RATES_KEPT:
+                    for old_date in sorted(recent)[:len(recent) - RECENT_RATES_KEPT]:
+                        del recent[old_date]
+            self._observe(buy_currency, date.weekday(), counted_as_new)
+            self._observe(sell_currency, date.weekday(), counted_as_new)
+            if published:
+                self._negative.get(pair_key, {}).pop(date_str, None)
+            else:
+                is_recent = (datetime.now() - date).days < RECENT_DAYS
+                ttl = RECENT_NEGATIVE_TTL_SECONDS if is_recent else NEGATIVE_TTL_SECONDS
+                self._negative.setdefault(pair_key, {})[date_str] = time.time() + ttl
+
+    def record_failure(self, buy_currency, sell_currency, date):
+        """網路錯誤不影響發布日曆，只短暫避免立即重試"""
+        with self.lock:
+            pair_key = f"{buy_currency}-{sell_currency}"
+            self._negative.setdefault(pair_key, {})[date.strftime('%Y-%m-%d')] = time.time() + FAILURE_TTL_SECONDS
+            self._dirty = True
+
+    def learn_from_series(self, buy_currency, sell_currency, rates):
+        """
+        以既有數據初始化發布日曆（每個貨幣對只做一次）。
+        與前一天數值完全相同的日期視為沿用前值（例如週末），不算發布新匯率。
+        """
+        pair_key = f"{buy_currency}-{sell_currency}"
+        with self.lock:
+            if pair_key in self._seeded or not rates:
+                return
+            previous_date, previous_rate = None, None
+            for date_str in sorted(rates):
+                date = datetime.strptime(date_str, '%Y-%m-%d')
+                rate = rates[date_str]
+                carried = previous_date is not None and (date - previous_date).days == 1 and rate == previous_rate
+                self._observe(buy_currency, date.weekday(), not carried)
+                self._observe(sell_currency, date.weekday(), not carried)
+                previous_date, previous_rate = date, rate
+            self._seeded.add(pair_key)
+
+    def get_stats(self):
+        """規劃器統計資訊"""
+        with self.lock:
+            return dict(self._stats, negative_entries=sum(len(v) for v in self._negative.values()))
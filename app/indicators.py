@@ -0,0 +1,224 @@
+import os
+from collections import OrderedDict, namedtuple
+from threading import Lock
+
+import numpy as np
+import pandas as pd
+from numpy.lib.stride_tricks import sliding_window_view
+
+# 快取多少組 (貨幣對, 指標, 窗口) 的完整歷史計算結果
+INDICATOR_CACHE_SIZE = int(os.environ.get('INDICATOR_CACHE_SIZE', 200))
+
+# 一次最多疊加幾個指標
+MAX_INDICATORS = 5
+
+MAX_WINDOW = 365
+
+IndicatorSpec = namedtuple('IndicatorSpec', ['name', 'window'])
+
+# 指標名稱 -> (預設窗口, 輸出欄位, 是否與匯率同一刻度)
+INDICATORS = {
+    'sma': (20, ('sma',), True),
+    'ema': (20, ('ema',), True),
+    'bollinger': (20, ('middle', 'upper', 'lower'), True),
+    'volatility': (20, ('volatility',), False),
+    'pct_change': (1, ('pct_change',), False),
+}
+
+BOLLINGER_WIDTH = 2.0
+
+
+def spec_label(spec):
+    return f"{spec.name}_{spec.window}"
+
+
+def is_price_scale(spec):
+    """與匯率同一刻度的指標畫在主軸上，百分比類的指標畫在右側副軸"""
+    return INDICATORS[spec.name][2]
+
+
+def parse_indicators(value):
+    """
+    解析 indicators 參數，例如 'sma:20,ema:10,bollinger,volatility:30'（省略窗口時使用預設值）。
+    返回 IndicatorSpec 列表（去重、保留順序）；格式錯誤時拋出 ValueError。
+    """
+    specs = []
+    for item in (value or '').split(','):
+        item = item.strip().lower()
+        if not item:
+            continue
+        name, _, window = item.partition(':')
+        if name not in INDICATORS:
+            raise ValueError(f"不支援的指標: {name}（可用 {', '.join(INDICATORS)}）")
+        try:
+            window = int(window) if window else INDICATORS[name][0]
+        except ValueError:
+            raise ValueError(f"{name} 的窗口必須是整數")
+        if not 1 <= window <= MAX_WINDOW or (window < 2 and name not in ('pct_change', 'ema')):
+            raise ValueError(f"{name} 的窗口超出範圍")
+        specs.append(IndicatorSpec(name, window))
+    specs = list(dict.fromkeys(specs))
+    if len(specs) > MAX_INDICATORS:
+        raise ValueError(f"一次最多 {MAX_INDICATORS} 個指標")
+    return specs
+
+
+def _rolling(values, window):
+    """長度不足窗口的開頭補 NaN，返回形狀為 (len(values), window) 的滑動視圖（不複製數據）"""
+    padded = np.concatenate((np.full(window - 1, np.nan), values))
+    return sliding_window_view(padded, window)
+
+
+def compute(spec, rates, seed=None):
+    """
+    以 NumPy 計算整段序列的指標，返回 {欄位: 與 rates 等長的 float64 陣列}，數據不足之處為 NaN。
+    seed 只用於 EMA：延伸計算時傳入前一天的 EMA 值，接續遞迴。
+    """
+    name, window = spec
+    rates = np.asarray(rates, dtype='float64')
+    if name == 'sma':
+        return {'sma': _rolling(rates, window).mean(axis=1)}
+    if name == 'ema':
+        # EMA 是遞迴定義，交給 pandas 的 C 實作；有 seed 時把它放在開頭再去掉
+        if seed is not None and not np.isnan(seed):
+            values = pd.Series(np.concatenate(([seed], rates))).ewm(span=window, adjust=False).mean().to_numpy()[1:]
+        else:
+            values = pd.Series(rates).ewm(span=window, adjust=False).mean().to_numpy()
+        return {'ema': values}
+    if name == 'bollinger':
+        windows = _rolling(rates, window)
+        middle = windows.mean(axis=1)
+        deviation = windows.std(axis=1)
+        return {'middle': middle, 'upper': middle + BOLLINGER_WIDTH * deviation,
+                'lower': middle - BOLLINGER_WIDTH * deviation}
+    returns = np.full(len(rates), np.nan)
+    if name == 'pct_change':
+        if len(rates) > window:
+            returns[window:] = (rates[window:] / rates[:-window] - 1) * 100
+        return {'pct_change': returns}
+    if name == 'volatility':
+        # 日報酬率（%）的滾動標準差
+        if len(rates) > 1:
+            returns[1:] = (rates[1:] / rates[:-1] - 1) * 100
+        return {'volatility': _rolling(returns, window).std(axis=1, ddof=1)}
+    raise ValueError(f"不支援的指標: {name}")
+
+
+def lookback(spec):
+    """延伸計算時需要的前置數據點數（EMA 改以前一天的值接續）"""
+    name, window = spec
+    if name == 'ema':
+        return 0
+    if name == 'volatility':
+        return window
+    return window - 1 if name != 'pct_change' else window
+
+
+class _Entry:
+    __slots__ = ('dates', 'rates', 'values')
+
+    def __init__(self, dates, rates, values):
+        self.dates = dates      # datetime64[D] 陣列
+        self.rates = rates      # float64 陣列
+        self.values = values    # {欄位: float64 陣列}
+
+
+class IndicatorCache:
+    def __init__(self, capacity=INDICATOR_CACHE_SIZE):
+        """
+        以 (買入, 賣出, 指標, 窗口) 為鍵快取整段日資料歷史的指標值。
+        新的日期寫入時只用最後 lookback 個數據點算出新增的部分接在尾端，不重算整段；
+        補入較舊的日期時捨棄該貨幣對的快取，下次使用時重建。
+        """
+        self.capacity = capacity
+        self.lock = Lock()
+        self._entries = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.extensions = 0
+
+    def get(self, buy_currency, sell_currency, spec, load_series):
+        """返回 _Entry；未命中時以 load_series() -> (日期, rates) 取得完整歷史並計算（日期可為字串或 datetime64）"""
+        key = (buy_currency, sell_currency, spec.name, spec.window)
+        with self.lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return entry
+            self.misses += 1
+        dates_str, rates = load_series()
+        dates = np.asarray(dates_str, dtype='datetime64[D]')
+        rates = np.asarray(rates, dtype='float64')
+        entry = _Entry(dates, rates, compute(spec, rates))
+        with self.lock:
+            self._entries[key] = entry
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.capacity:
+                self._entries.popitem(last=False)
+        return entry
+
+    def extend(self, buy_currency, sell_currency, rates):
+        """新數據 {date_str: rate} 寫入後，延伸該貨幣對所有已快取的指標"""
+        if not rates:
+            return
+        new_dates_str = sorted(rates)
+        new_dates = np.array(new_dates_str, dtype='datetime64[D]')
+        new_rates = np.array([rates[d] for d in new_dates_str], dtype='float64')
+        with self.lock:
+            for key in [k for k in self._entries if k[0] == buy_currency and k[1] == sell_currency]:
+                entry = self._entries[key]
+                if len(entry.dates) and new_dates[0] <= entry.dates[-1]:
+                    del self._entries[key]
+                    continue
+                spec = IndicatorSpec(key[2], key[3])
+                tail = lookback(spec)
+                context = entry.rates[len(entry.rates) - tail:] if tail else entry.rates[:0]
+                seed = entry.values['ema'][-1] if spec.name == 'ema' and len(entry.rates) else None
+                added = compute(spec, np.concatenate((context, new_rates)), seed=seed)
+                self._entries[key] = _Entry(
+                    np.concatenate((entry.dates, new_dates)),
+                    np.concatenate((entry.rates, new_rates)),
+                    {field: np.concatenate((values, added[field][len(context):]))
+                     for field, values in entry.values.items()})
+                self.extensions += 1
+
+    def invalidate(self, buy_currency, sell_currency):
+        with self.lock:
+            for key in [k for k in self._entries if k[0] == buy_currency and k[1] == sell_currency]:
+                del self._entries[key]
+
+    def get_stats(self):
+        with self.lock:
+            total = self.hits + self.misses
+            return {
+                'total_items': len(self._entries),
+                'total_requests': total,
+                'cache_hits': self.hits,
+                'hit_rate': round(self.hits / total * 100, 2) if total else 0,
+                'extensions': self.extensions,
+            }
+
+
+def to_dates(dates_str):
+    """'YYYY-MM-DD' 字串列表轉為 datetime64[D] 陣列（同一次請求的多個指標共用）"""
+    return np.array(dates_str, dtype='datetime64[D]')
+
+
+def align(entry, wanted):
+    """取出 entry 中指定日期（datetime64[D] 陣列）的指標值，日期不在歷史中時為 NaN"""
+    if not len(entry.dates):
+        return {field: np.full(len(wanted), np.nan) for field in entry.values}
+    positions = np.searchsorted(entry.dates, wanted).clip(0, len(entry.dates) - 1)
+    found = entry.dates[positions] == wanted
+    return {field: np.where(found, values[positions], np.nan) for field, values in entry.values.items()}
+
+
+def compute_for_dates(spec, dates, rates, wanted):
+    """直接以序列本身計算（不經快取）並對齊到 wanted；dates、wanted 皆為 datetime64[D] 陣列"""
+    return align(_Entry(dates, None, compute(spec, rates)), wanted)
+
+
+def to_json(values):
+    """四捨五入到 6 位小數，NaN 轉為 None"""
+    return [None if v != v else v for v in np.round(values, 6).tolist()]
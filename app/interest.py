@@ -0,0 +1,72 @@
+import os
+import time
+from threading import Lock
+
+# 最近一次請求後，貨幣對仍被視為「有人關注」的秒數
+INTEREST_TTL_SECONDS = int(os.environ.get('INTEREST_TTL', 30))
+
+
+class InterestTracker:
+    def __init__(self, ttl_seconds=INTEREST_TTL_SECONDS):
+        """
+        追蹤哪些貨幣對仍有人關注：SSE 客戶端正在查看的貨幣對，以及最近被請求過的貨幣對。
+        背景抓取據此判斷是否該繼續消耗共用的速率預算。
+        """
+        self.ttl_seconds = ttl_seconds
+        self.lock = Lock()
+        self._last_requested = {}  # (buy, sell) -> 最近一次請求的時間戳
+        self._watching = {}        # SSE client_id -> (buy, sell)
+        self._clients = set()      # 目前連線中的 SSE client_id
+
+    def touch(self, buy_currency, sell_currency):
+        """記錄一次對該貨幣對的請求"""
+        with self.lock:
+            self._last_requested[(buy_currency, sell_currency)] = time.time()
+
+    def register(self, client_id):
+        """SSE 客戶端連線；只有已連線的客戶端可以登記關注"""
+        with self.lock:
+            self._clients.add(client_id)
+
+    def watch(self, client_id, buy_currency, sell_currency):
+        """
+        SSE 客戶端切換到某貨幣對（每個客戶端同時只關注一組）。
+        client_id 不是連線中的 SSE 客戶端時不登記並返回 False，避免關注永遠不會被撤銷。
+        """
+        with self.lock:
+            if client_id not in self._clients:
+                return False
+            self._watching[client_id] = (buy_currency, sell_currency)
+            self._last_requested[(buy_currency, sell_currency)] = time.time()
+            return True
+
+    def unwatch(self, client_id):
+        """SSE 客戶端斷線"""
+        with self.lock:
+            self._clients.discard(client_id)
+            self._watching.pop(client_id, None)
+
+    def is_interested(self, buy_currency, sell_currency):
+        """仍有 SSE 客戶端在看，或最近 ttl_seconds 內有人請求過"""
+        pair = (buy_currency, sell_currency)
+        with self.lock:
+            if pair in self._watching.values():
+                return True
+            last_requested = self._last_requested.get(pair)
+            return last_requested is not None and time.time() - last_requested < self.ttl_seconds
+
+    def snapshot(self):
+        """各貨幣對的關注者數量與距離最近一次請求的秒數"""
+        now = time.time()
+        with self.lock:
+            pairs = {}
+            for pair in self._watching.values():
+                entry = pairs.setdefault(f"{pair[0]}-{pair[1]}", {'watchers': 0, 'last_request_age': None})
+                entry['watchers'] += 1
+            for pair, last_requested in self._last_requested.items():
+                age = now - last_requested
+                if age >= self.ttl_seconds and pair not in self._watching.values():
+                    continue
+                entry = pairs.setdefault(f"{pair[0]}-{pair[1]}", {'watchers': 0, 'last_request_age': None})
+                entry['last_request_age'] = round(age, 1)
+            return pairs
@@ -0,0 +1,399 @@
+import os
+import time
+import itertools
+from collections import OrderedDict, deque
+from concurrent.futures import Future, wait, FIRST_COMPLETED
+from contextlib import contextmanager
+from threading import Condition, Lock, Thread, local
+
+from . import metrics, tracing
+
+# 優先級（數字越小越優先）
+INTERACTIVE = 0   # 使用者正在等待的圖表/匯率
+PROGRESSIVE = 1   # 背景抓取中漸進生成的期間與其餘日期
+WARMUP = 2        # 預熱快取等推測性工作
+BACKFILL = 3      # 維護與回填
+
+PRIORITY_NAMES = {
+    INTERACTIVE: 'interactive',
+    PROGRESSIVE: 'progressive',
+    WARMUP: 'warmup',
+    BACKFILL: 'backfill',
+}
+
+# 全域同時執行的任務上限，以及單一貨幣對同時執行的上限（公平性）
+MAX_WORKERS = int(os.environ.get('JOB_MAX_WORKERS', 8))
+MAX_PER_PAIR = int(os.environ.get('JOB_MAX_PER_PAIR', 3))
+
+
+class SchedulerBusyError(RuntimeError):
+    """請求等待排程任務超過時限（排程器被背景工作佔滿），由路由轉為 503"""
+
+
+def default_class_limits(max_workers):
+    """各優先級同時執行的上限，避免推測性工作佔滿所有工作槽"""
+    return {
+        INTERACTIVE: max_workers,
+        PROGRESSIVE: max(1, max_workers - 1),
+        WARMUP: max(1, max_workers // 2),
+        BACKFILL: max(1, max_workers // 4),
+    }
+
+
+class Job:
+    def __init__(self, job_id, fn, args, priority, pair, name, key):
+        self.id = job_id
+        self.fn = fn
+        self.args = args
+        self.priority = priority
+        self.pair = pair
+        self.name = name or getattr(fn, '__name__', 'job')
+        self.key = key
+        self.future = Future()
+        self.enqueued_at = time.time()
+        self.started_at = None
+        self.holding_slot = False
+        self.trace = tracing.current()  # 提交任務的請求，任務內的 span 記到同一個 Trace
+
+    def to_dict(self, now):
+        if self.started_at is None:
+            state = 'queued'
+        else:
+            state = 'running' if self.holding_slot else 'waiting'
+        return {
+            'id': self.id,
+            'name': self.name,
+            'priority': PRIORITY_NAMES[self.priority],
+            'pair': f"{self.pair[0]}-{self.pair[1]}" if self.pair else None,
+            'state': state,
+            'queued_seconds': round((self.started_at or now) - self.enqueued_at, 3),
+            'running_seconds': round(now - self.started_at, 3) if self.started_at else None,
+        }
+
+
+class JobScheduler:
+    def __init__(self, max_workers=MAX_WORKERS, max_per_pair=MAX_PER_PAIR, class_limits=None):
+        """
+        統一的背景工作排程器：抓取、繪圖與預熱都經由這裡執行。
+        依優先級挑選任務；同一優先級內各貨幣對輪流出隊，並限制全域、各優先級與單一貨幣對的並行數。
+        任務由固定的工作執行緒從佇列取出執行（執行緒重複使用，不為每個任務建立新執行緒）；
+        任務在 released() 中等待子任務時會暫時多一條工作執行緒頂替，取回工作槽後再收回。
+        """
+        self.max_workers = max_workers
+        self.max_per_pair = max_per_pair
+        self.class_limits = dict(class_limits or default_class_limits(max_workers))
+        self.app = None
+
+        self.lock = Lock()
+        self._changed = Condition(self.lock)  # 有新任務或工作槽釋出時通知工作執行緒與等待取回工作槽的任務
+        # priority -> OrderedDict(pair -> deque[Job])，出隊後把貨幣對移到尾端以輪流服務
+        self._queues = {priority: OrderedDict() for priority in PRIORITY_NAMES}
+        self._by_key = {}    # key -> 排隊或執行中的 Job，用於去重
+        self._queued = {}    # Future -> 排隊中的 Job，用於取消
+        self._running = {}   # job_id -> Job
+        self._running_per_pair = {}
+        self._running_per_class = {priority: 0 for priority in PRIORITY_NAMES}
+        self._active = 0     # 佔用工作槽的任務數
+        self._resuming = 0   # 子任務完成後等待取回工作槽的任務數（優先於新任務）
+        # 等待取回工作槽的任務預留的各優先級、各貨幣對名額，新任務入場時一併計入
+        self._resuming_per_class = {priority: 0 for priority in PRIORITY_NAMES}
+        self._resuming_per_pair = {}
+        self._waiting = 0    # 在 released() 中讓出工作槽的任務數（各自佔住一條執行緒）
+        self._workers = 0    # 存活的工作執行緒數，目標為 max_workers + _waiting
+        self._idle_workers = 0
+        self._worker_ids = itertools.count(1)
+        self._ids = itertools.count(1)
+        self._local = local()
+        self._stats = {'submitted': 0, 'completed': 0, 'failed': 0, 'cancelled': 0, 'deduplicated': 0, 'promoted': 0}
+
+    def init_app(self, app):
+        """設定 Flask app，之後每個任務都在 app_context 中執行"""
+        self.app = app
+
+    # --- 提交與調整 ---
+
+    def submit(self, fn, *args, priority=PROGRESSIVE, pair=None, name=None, key=None):
+        """
+        提交任務並返回 Future。
+        帶 key 的任務在排隊或執行期間不會重複建立，重複提交時返回同一個 Future，並視需要提升其優先級。
+        """
+        with self.lock:
+            if key is not None and key in self._by_key:
+                job = self._by_key[key]
+                self._stats['deduplicated'] += 1
+                if job.started_at is None and priority < job.priority:
+                    self._requeue(job, priority)
+                    self._dispatch()
+                return job.future
+
+            job = Job(next(self._ids), fn, args, priority, pair, name, key)
+            self._queues[priority].setdefault(pair, deque()).append(job)
+            self._queued[job.future] = job
+            if key is not None:
+                self._by_key[key] = job
+            self._stats['submitted'] += 1
+            self._dispatch()
+        return job.future
+
+    def is_pending(self, key):
+        """帶此 key 的任務是否仍在排隊或執行中"""
+        with self.lock:
+            return key in self._by_key
+
+    def promote(self, pair, priority):
+        """將某貨幣對所有優先級低於 priority 的排隊任務提升到 priority，返回提升的任務數"""
+        promoted = 0
+        with self.lock:
+            for current in sorted(PRIORITY_NAMES):
+                if current <= priority:
+                    continue
+                jobs = self._queues[current].pop(pair, None)
+                if not jobs:
+                    continue
+                for job in jobs:
+                    job.priority = priority
+                self._queues[priority].setdefault(pair, deque()).extend(jobs)
+                promoted += len(jobs)
+            if promoted:
+                self._stats['promoted'] += promoted
+                self._dispatch()
+        return promoted
+
+    def cancel(self, futures):
+        """取消仍在排隊的任務（已開始執行的不受影響），返回取消的任務數"""
+        cancelled = 0
+        with self.lock:
+            for future in futures:
+                job = self._queued.pop(future, None)
+                if job is None or not future.cancel():
+                    continue
+                jobs = self._queues[job.priority].get(job.pair)
+                if jobs is not None:
+                    jobs.remove(job)
+                    if not jobs:
+                        del self._queues[job.priority][job.pair]
+                self._forget(job)
+                cancelled += 1
+            self._stats['cancelled'] += cancelled
+        return cancelled
+
+    def _requeue(self, job, priority):
+        """把排隊中的任務移到新的優先級（內部方法，不加鎖）"""
+        jobs = self._queues[job.priority].get(job.pair)
+        if jobs is not None:
+            jobs.remove(job)
+            if not jobs:
+                del self._queues[job.priority][job.pair]
+        job.priority = priority
+        self._queues[priority].setdefault(job.pair, deque()).append(job)
+        self._stats['promoted'] += 1
+
+    # --- 派送 ---
+
+    def _admissible(self, priority, pair, reserved=True):
+        """
+        該優先級與貨幣對是否還有名額（內部方法，不加鎖）。
+        新任務入場時 reserved=True，把等待取回工作槽的任務預留的名額也算進去，讓它們優先。
+        """
+        running_class = self._running_per_class[priority]
+        running_pair = self._running_per_pair.get(pair, 0) if pair is not None else 0
+        if reserved:
+            running_class += self._resuming_per_class[priority]
+            running_pair += self._resuming_per_pair.get(pair, 0) if pair is not None else 0
+        if running_class >= self.class_limits.get(priority, self.max_workers):
+            return False
+        return pair is None or running_pair < self.max_per_pair
+
+    def _next_job(self):
+        """依優先級、各類上限與貨幣對輪替挑出下一個可執行的任務（內部方法，不加鎖）"""
+        for priority in sorted(PRIORITY_NAMES):
+            if not self._admissible(priority, None):
+                continue
+            queue = self._queues[priority]
+            for pair in list(queue):
+                if not self._admissible(priority, pair):
+                    continue
+                jobs = queue.pop(pair)
+                job = jobs.popleft()
+                if jobs:
+                    queue[pair] = jobs  # 移到尾端，下次先服務其他貨幣對
+                del self._queued[job.future]
+                return job
+        return None
+
+    def _start_next(self):
+        """在工作槽上限內取出下一個任務並佔用工作槽，沒有可執行的任務時返回 None（內部方法，不加鎖）"""
+        while self._active + self._resuming < self.max_workers:
+            job = self._next_job()
+            if job is None:
+                return None
+            if job.future.cancelled():
+                self._forget(job)
+                self._stats['cancelled'] += 1
+                continue
+            job.started_at = time.time()
+            metrics.JOB_WAIT_SECONDS.observe(job.started_at - job.enqueued_at, PRIORITY_NAMES[job.priority])
+            self._running[job.id] = job
+            self._take_slot(job)
+            return job
+        return None
+
+    def _dispatch(self):
+        """喚醒閒置的工作執行緒，必要時補足到目標數量（內部方法，不加鎖）"""
+        target = self.max_workers + self._waiting
+        queued = len(self._queued)
+        while self._workers < target and self._idle_workers < queued:
+            self._workers += 1
+            self._idle_workers += 1
+            Thread(target=self._worker, daemon=True, name=f"JobWorker-{next(self._worker_ids)}").start()
+        self._changed.notify_all()
+
+    def _worker(self):
+        """工作執行緒：反覆取出任務執行；超出目標數量（頂替的任務已取回工作槽）時結束"""
+        with self.lock:
+            while True:
+                job = self._start_next()
+                if job is None:
+                    if self._workers > self.max_workers + self._waiting:
+                        self._workers -= 1
+                        self._idle_workers -= 1
+                        return
+                    self._changed.wait()
+                    continue
+                self._idle_workers -= 1
+                self.lock.release()
+                try:
+                    self._run(job)
+                finally:
+                    self.lock.acquire()
+                    self._idle_workers += 1
+
+    def _take_slot(self, job):
+        self._active += 1
+        self._running_per_class[job.priority] += 1
+        if job.pair is not None:
+            self._running_per_pair[job.pair] = self._running_per_pair.get(job.pair, 0) + 1
+        job.holding_slot = True
+
+    def _release_slot(self, job):
+        self._active -= 1
+        self._running_per_class[job.priority] -= 1
+        if job.pair is not None:
+            self._running_per_pair[job.pair] -= 1
+            if not self._running_per_pair[job.pair]:
+                del self._running_per_pair[job.pair]
+        job.holding_slot = False
+        self._changed.notify_all()
+
+    def _forget(self, job):
+        if job.key is not None and self._by_key.get(job.key) is job:
+            del self._by_key[job.key]
+
+    def _run(self, job):
+        self._local.job = job
+        failed = False
+        try:
+            if job.future.set_running_or_notify_cancel():
+                if job.trace is not None:
+                    job.trace.add('job_queue', job.started_at - job.enqueued_at)
+                try:
+                    with tracing.attached(job.trace):
+                        if self.app is not None:
+                            with self.app.app_context():
+                                result = job.fn(*job.args)
+                        else:
+                            result = job.fn(*job.args)
+                except BaseException as e:
+                    job.future.set_exception(e)
+                    failed = True
+                    print(f"❌ 排程任務失敗 ({job.name}): {e}")
+                else:
+                    job.future.set_result(result)
+        finally:
+            self._local.job = None
+            metrics.JOB_RUN_SECONDS.observe(time.time() - job.started_at, PRIORITY_NAMES[job.priority])
+            with self.lock:
+                if job.holding_slot:
+                    self._release_slot(job)
+                del self._running[job.id]
+                self._forget(job)
+                self._stats['failed' if failed else 'completed'] += 1
+                self._changed.notify_all()
+
+    # --- 任務內等待子任務 ---
+
+    def current_job(self):
+        """目前執行緒正在執行的任務（不在排程器中時為 None）"""
+        return getattr(self._local, 'job', None)
+
+    @contextmanager
+    def released(self):
+        """
+        在任務中等待子任務時暫時讓出工作槽，避免父任務佔滿工作槽造成死鎖；
+        等待期間多一條工作執行緒頂替這個任務佔住的執行緒。
+        離開時經由與新任務相同的入場檢查（全域、優先級與貨幣對上限）取回工作槽，且優先於尚未開始的任務。
+        """
+        job = self.current_job()
+        if job is None or not job.holding_slot:
+            yield
+            return
+        with self.lock:
+            self._release_slot(job)
+            self._waiting += 1
+            self._dispatch()
+        try:
+            yield
+        finally:
+            with self.lock:
+                self._resuming += 1
+                self._resuming_per_class[job.priority] += 1
+                if job.pair is not None:
+                    self._resuming_per_pair[job.pair] = self._resuming_per_pair.get(job.pair, 0) + 1
+                while not (self._active < self.max_workers and self._admissible(job.priority, job.pair, reserved=False)):
+                    self._changed.wait()
+                self._resuming -= 1
+                self._resuming_per_class[job.priority] -= 1
+                if job.pair is not None:
+                    self._resuming_per_pair[job.pair] -= 1
+                    if not self._resuming_per_pair[job.pair]:
+                        del self._resuming_per_pair[job.pair]
+                self._waiting -= 1
+                self._take_slot(job)
+                self._changed.notify_all()  # 多出的頂替執行緒可以結束
+
+    def as_completed(self, futures, should_cancel=None, poll_seconds=5):
+        """
+        同 concurrent.futures.as_completed，但等待期間會讓出目前任務的工作槽。
+        should_cancel 返回 True 時取消其餘仍在排隊的任務；已在執行的任務仍會完成並返回，被取消的則不會出現。
+        """
+        pending = set(futures)
+        while pending:
+            with self.released():
+                done, pending = wait(pending, timeout=poll_seconds if should_cancel else None,
+                                     return_when=FIRST_COMPLETED)
+            if pending and should_cancel is not None and should_cancel():
+                self.cancel(pending)
+                pending = {future for future in pending if not future.cancelled()}
+            yield from done
+
+    # --- 觀察 ---
+
+    def snapshot(self):
+        """列出排隊與執行中的任務，以及各項上限與統計"""
+        now = time.time()
+        with self.lock:
+            queued = [job.to_dict(now) for priority in sorted(PRIORITY_NAMES)
+                      for jobs in self._queues[priority].values() for job in jobs]
+            running = [job.to_dict(now) for job in sorted(self._running.values(), key=lambda j: j.id)]
+            return {
+                'running': running,
+                'queued': queued,
+                'queue_depths': {PRIORITY_NAMES[p]: sum(len(jobs) for jobs in self._queues[p].values())
+                                 for p in sorted(PRIORITY_NAMES)},
+                'active_slots': self._active,
+                'worker_threads': self._workers,
+                'max_workers': self.max_workers,
+                'max_per_pair': self.max_per_pair,
+                'class_limits': {PRIORITY_NAMES[p]: limit for p, limit in sorted(self.class_limits.items())},
+                'stats': dict(self._stats),
+            }
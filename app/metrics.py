@@ -0,0 +1,191 @@
+import time
+import bisect
+from contextlib import contextmanager
+from threading import Lock
+
+# 預設延遲分桶（秒），涵蓋快取命中到慢速上游請求
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _format_labels(labelnames, values, extra=()):
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(labelnames, values)]
+    pairs.extend(f'{name}="{_escape(value)}"' for name, value in extra)
+    return '{' + ','.join(pairs) + '}' if pairs else ''
+
+
+def _format_value(value):
+    if value == float('inf'):
+        return '+Inf'
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Histogram:
+    def __init__(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        """
+        Prometheus 直方圖。observe 只做一次二分搜尋與一次加鎖累加，
+        累積分桶在匯出時才計算，熱路徑上幾乎沒有額外成本。
+        """
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(sorted(buckets))
+        self.lock = Lock()
+        self._series = {}  # label 值 tuple -> [各分桶計數（最後一格為 +Inf）, 總和]
+
+    def observe(self, value, *label_values):
+        index = bisect.bisect_left(self.buckets, value)
+        with self.lock:
+            series = self._series.get(label_values)
+            if series is None:
+                series = self._series[label_values] = [[0] * (len(self.buckets) + 1), 0.0]
+            series[0][index] += 1
+            series[1] += value
+
+    @contextmanager
+    def time(self, *label_values):
+        """計時 with 區塊並記錄"""
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - started, *label_values)
+
+    def collect(self):
+        with self.lock:
+            snapshot = [(labels, list(counts), total) for labels, (counts, total) in self._series.items()]
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} histogram"]
+        for labels, counts, total in sorted(snapshot):
+            cumulative = 0
+            for bound, count in zip((*self.buckets, float('inf')), counts):
+                cumulative += count
+                lines.append(f"{self.name}_bucket{_format_labels(self.labelnames, labels, [('le', _format_value(float(bound)))])} {cumulative}")
+            lines.append(f"{self.name}_sum{_format_labels(self.labelnames, labels)} {_format_value(total)}")
+            lines.append(f"{self.name}_count{_format_labels(self.labelnames, labels)} {cumulative}")
+        return lines
+
+
+class Counter:
+    def __init__(self, name, documentation, labelnames=()):
+        """Prometheus 計數器（只增不減）"""
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.lock = Lock()
+        self._values = {}
+
+    def inc(self, *label_values, amount=1):
+        with self.lock:
+            self._values[label_values] = self._values.get(label_values, 0) + amount
+
+    def collect(self):
+        with self.lock:
+            snapshot = sorted(self._values.items())
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} counter"]
+        lines.extend(f"{self.name}{_format_labels(self.labelnames, labels)} {_format_value(value)}" for labels, value in snapshot)
+        return lines
+
+
+def gauge_lines(name, documentation, samples, metric_type='gauge'):
+    """以 [(labels dict, value)] 產生即時量測值（在匯出時才計算）"""
+    lines = [f"# HELP {name} {documentation}", f"# TYPE {name} {metric_type}"]
+    for labels, value in samples:
+        lines.append(f"{name}{_format_labels(labels.keys(), labels.values())} {_format_value(value)}")
+    return lines
+
+
+# --- 全域指標 ---
+
+UPSTREAM_REQUEST_SECONDS = Histogram(
+    'fx_upstream_request_seconds', '上游匯率 API 請求耗時（不含速率限制等待）', ['outcome'])
+UPSTREAM_SKIPPED = Counter(
+    'fx_upstream_skipped_total', '因熔斷暫停而未送出的上游請求數', ['reason'])
+RATE_LIMIT_WAIT_SECONDS = Histogram(
+    'fx_rate_limit_wait_seconds', '上游請求在共用速率限制器前等待的時間')
+CHART_RENDER_SECONDS = Histogram(
+    'fx_chart_render_seconds', 'matplotlib 繪製並存檔圖表的耗時', ['period'])
+HTTP_REQUEST_SECONDS = Histogram(
+    'fx_http_request_seconds', 'HTTP 端點處理耗時', ['endpoint', 'method', 'status'])
+JOB_WAIT_SECONDS = Histogram(
+    'fx_job_queue_wait_seconds', '背景任務從排隊到開始執行的等待時間', ['priority'])
+JOB_RUN_SECONDS = Histogram(
+    'fx_job_run_seconds', '背景任務執行耗時（含等待子任務）', ['priority'])
+RESPONSE_RAW_BYTES = Counter(
+    'fx_response_raw_bytes_total', '壓縮回應的原始位元組數（body 為一般回應，sse 為事件串流，export 為匯出串流）', ['kind', 'encoding'])
+RESPONSE_SENT_BYTES = Counter(
+    'fx_response_sent_bytes_total', '壓縮回應實際送出的位元組數', ['kind', 'encoding'])
+ALERTS_TRIGGERED = Counter(
+    'fx_alerts_triggered_total', '被觸發的匯率提醒數', ['direction'])
+ALERT_WEBHOOK_DELIVERIES = Counter(
+    'fx_alert_webhook_deliveries_total', '匯率提醒 webhook 推送次數', ['outcome'])
+
+REGISTRY = [
+    UPSTREAM_REQUEST_SECONDS, UPSTREAM_SKIPPED, RATE_LIMIT_WAIT_SECONDS, CHART_RENDER_SECONDS,
+    HTTP_REQUEST_SECONDS, JOB_WAIT_SECONDS, JOB_RUN_SECONDS, RESPONSE_RAW_BYTES, RESPONSE_SENT_BYTES,
+    ALERTS_TRIGGERED, ALERT_WEBHOOK_DELIVERIES,
+]
+
+
+def collect_runtime(manager, sse_clients, sse_lock):
+    """匯出時才讀取的即時狀態：快取命中率、背景任務、熔斷狀態與 SSE 連線"""
+    lines = []
+
+    caches = {'chart': manager.lru_cache, 'chart_variant': manager.variant_cache,
+              'sparkline': manager.sparkline_cache, 'indicator': manager.indicator_cache,
+              'latest_rate': manager.latest_rate_cache}
+    cache_stats = {name: cache.get_stats() for name, cache in caches.items()}
+    lines += gauge_lines('fx_cache_requests_total', '快取查詢次數',
+                         [({'cache': name}, s['total_requests']) for name, s in cache_stats.items()], 'counter')
+    lines += gauge_lines('fx_cache_hits_total', '快取命中次數',
+                         [({'cache': name}, s['cache_hits']) for name, s in cache_stats.items()], 'counter')
+    lines += gauge_lines('fx_cache_hit_ratio', '快取命中率（0-1）',
+                         [({'cache': name}, s['hit_rate'] / 100) for name, s in cache_stats.items()])
+    lines += gauge_lines('fx_cache_items', '快取中的項目數',
+                         [({'cache': name}, s['total_items']) for name, s in cache_stats.items()])
+
+    series_memory = manager.series_memory()
+    lines += gauge_lines('fx_series_points', '記憶體中各貨幣對的日資料筆數',
+                         [({'pair': f'{b}-{s}'}, days) for (b, s), (days, _, _) in sorted(series_memory.items())])
+    lines += gauge_lines('fx_series_memory_bytes', '各貨幣對日資料序列佔用的行程私有位元組數',
+                         [({'pair': f'{b}-{s}'}, size) for (b, s), (_, size, _) in sorted(series_memory.items())])
+    lines += gauge_lines('fx_series_mapped_bytes', '各貨幣對以 mmap 共用的二進位序列檔大小',
+                         [({'pair': f'{b}-{s}'}, size) for (b, s), (_, _, size) in sorted(series_memory.items())])
+
+    lines += gauge_lines('fx_alerts_registered', '已登記的匯率提醒數', [({}, manager.alerts.count())])
+
+    jobs = manager.jobs.snapshot()
+    lines += gauge_lines('fx_jobs_running', '佔用工作槽的背景任務數', [({}, jobs['active_slots'])])
+    lines += gauge_lines('fx_jobs_waiting', '正在等待子任務、暫時讓出工作槽的背景任務數',
+                         [({}, sum(1 for job in jobs['running'] if job['state'] == 'waiting'))])
+    lines += gauge_lines('fx_jobs_queued', '排隊中的背景任務數',
+                         [({'priority': priority}, depth) for priority, depth in jobs['queue_depths'].items()])
+    lines += gauge_lines('fx_jobs_total', '背景任務累計數',
+                         [({'outcome': outcome}, jobs['stats'][outcome])
+                          for outcome in ('completed', 'failed', 'cancelled', 'deduplicated')], 'counter')
+
+    with manager._pause_lock:
+        paused = manager._network_paused and time.time() < manager._pause_until
+        remaining = max(0.0, manager._pause_until - time.time()) if paused else 0.0
+    lines += gauge_lines('fx_upstream_paused', '上游熔斷暫停中為 1', [({}, int(paused))])
+    lines += gauge_lines('fx_upstream_pause_remaining_seconds', '熔斷暫停剩餘秒數', [({}, round(remaining, 1))])
+
+    with sse_lock:
+        queues = list(sse_clients)
+    lines += gauge_lines('fx_sse_clients', '目前的 SSE 連線數', [({}, len(queues))])
+    lines += gauge_lines('fx_sse_queued_messages', '所有 SSE 客戶端隊列中尚未送出的訊息數',
+                         [({}, sum(q.qsize() for q in queues))])
+    return lines
+
+
+def render(manager, sse_clients, sse_lock):
+    """產生 Prometheus 文字格式的完整輸出"""
+    lines = []
+    for metric in REGISTRY:
+        lines += metric.collect()
+    lines += collect_runtime(manager, sse_clients, sse_lock)
+    return '\n'.join(lines) + '\n'
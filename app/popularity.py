@@ -0,0 +1,88 @@
+import os
+import json
+import time
+from threading import Lock
+
+from .utils import atomic_write_json
+
+# 貨幣對熱門度的存放位置
+POPULARITY_FILE = os.path.join('data', 'popularity.json')
+
+# 熱門度半衰期（秒）：一週前的存取只算一半
+HALF_LIFE_SECONDS = int(os.environ.get('POPULARITY_HALF_LIFE', 7 * 86400))
+
+# 分數低於此值的貨幣對在存檔時移除，避免檔案無限增長
+MIN_SCORE = 0.05
+
+
+class PopularityTracker:
+    def __init__(self, path=POPULARITY_FILE, half_life_seconds=HALF_LIFE_SECONDS):
+        """
+        以指數衰減計數追蹤各貨幣對的存取頻率，供定時刷新挑選熱門貨幣對。
+        分數只在存取與查詢時按經過時間衰減，不需要定期掃描。
+        """
+        self.path = path
+        self.half_life_seconds = half_life_seconds
+        self.lock = Lock()
+        self._scores = {}  # "BUY-SELL" -> {'score': float, 'updated': 時間戳, 'hits': int}
+        self._dirty = False
+        self._load()
+
+    def _load(self):
+        if not os.path.exists(self.path):
+            return
+        try:
+            with open(self.path, 'r', encoding='utf-8') as f:
+                self._scores = json.load(f)
+        except (json.JSONDecodeError, IOError) as e:
+            print(f"載入貨幣對熱門度時發生錯誤: {e}")
+
+    def save(self):
+        """有變更時才落盤，並移除已衰減到可忽略的貨幣對"""
+        now = time.time()
+        with self.lock:
+            if not self._dirty:
+                return
+            self._scores = {key: entry for key, entry in self._scores.items()
+                            if self._decayed(entry, now) >= MIN_SCORE}
+            state = dict(self._scores)
+            self._dirty = False
+        os.makedirs(os.path.dirname(self.path) or '.', exist_ok=True)
+        atomic_write_json(self.path, state, ensure_ascii=False, sort_keys=True)
+
+    def _decayed(self, entry, now):
+        """按經過時間衰減後的分數（內部方法，不加鎖）"""
+        return entry['score'] * 0.5 ** ((now - entry['updated']) / self.half_life_seconds)
+
+    def record(self, buy_currency, sell_currency, weight=1.0):
+        """記錄一次存取"""
+        now = time.time()
+        key = f"{buy_currency}-{sell_currency}"
+        with self.lock:
+            entry = self._scores.get(key)
+            if entry is None:
+                self._scores[key] = {'score': weight, 'updated': now, 'hits': 1}
+            else:
+                entry['score'] = self._decayed(entry, now) + weight
+                entry['updated'] = now
+                entry['hits'] += 1
+            self._dirty = True
+
+    def top(self, n, exclude=()):
+        """返回分數最高的 n 個貨幣對 [(buy, sell, score)]"""
+        now = time.time()
+        with self.lock:
+            ranked = sorted(((self._decayed(entry, now), key) for key, entry in self._scores.items()), reverse=True)
+        result = []
+        for score, key in ranked:
+            parts = key.split('-')
+            if len(parts) != 2:
+                # 舊版本可能記錄過格式錯誤的鍵，略過即可，存檔時會隨衰減移除
+                continue
+            buy_currency, sell_currency = parts
+            if (buy_currency, sell_currency) in exclude:
+                continue
+            result.append((buy_currency, sell_currency, round(score, 3)))
+            if len(result) >= n:
+                break
+        return result
@@ -0,0 +1,151 @@
+import os
+import re
+import sys
+import time
+import _thread
+import threading
+from collections import Counter
+from datetime import datetime
+from threading import Lock
+
+from .utils import temp_path
+
+# 取樣結果的存放位置（folded stack 格式，可直接交給 flamegraph.pl / speedscope）
+PROFILES_DIR = os.path.join('data', 'profiles')
+
+# 單次取樣時間上限與預設取樣間隔
+MAX_PROFILE_SECONDS = int(os.environ.get('PROFILER_MAX_SECONDS', 300))
+DEFAULT_INTERVAL_MS = 10
+MIN_INTERVAL_MS = 1
+
+# 葉節點落在這些模組時視為閒置等待（鎖、隊列、socket），預設不計入
+IDLE_MODULES = {'threading.py', 'queue.py', 'selectors.py', 'socket.py', 'socketserver.py', 'ssl.py', 'hub.py'}
+
+_THREAD_SUFFIX = re.compile(r'[-_]\d+$')
+
+
+def _native_thread_api():
+    """
+    取得未被 gevent monkey patch 的執行緒與 sleep。
+    取樣器必須是真正的 OS 執行緒，才能在 greenlet 佔用 CPU 時照常取樣。
+    """
+    try:
+        from gevent import monkey
+        if monkey.is_module_patched('threading'):
+            return (monkey.get_original('_thread', 'start_new_thread'),
+                    monkey.get_original('_thread', 'get_ident'),
+                    monkey.get_original('time', 'sleep'))
+    except ImportError:
+        pass
+    return _thread.start_new_thread, _thread.get_ident, time.sleep
+
+
+def _frame_label(frame):
+    code = frame.f_code
+    return f"{os.path.basename(code.co_filename)}:{code.co_name}"
+
+
+def _fold(frame, root):
+    """把堆疊轉為由根到葉、以分號分隔的字串"""
+    labels = []
+    while frame is not None:
+        labels.append(_frame_label(frame))
+        frame = frame.f_back
+    labels.append(root)
+    labels.reverse()
+    return ';'.join(labels)
+
+
+class SamplingProfiler:
+    def __init__(self, output_dir=PROFILES_DIR):
+        """
+        管理員觸發的堆疊取樣器：在指定時間窗內定期讀取所有執行緒的堆疊，
+        輸出 folded stack 檔案。只在取樣期間有成本，平時不影響任何請求。
+        """
+        self.output_dir = output_dir
+        self.lock = Lock()
+        self._current = None  # 取樣中的狀態
+        self._last = None     # 上一次完成的結果
+
+    def start(self, seconds, interval_ms=DEFAULT_INTERVAL_MS, include_idle=False):
+        """開始取樣，已有取樣在進行時拋出 RuntimeError"""
+        seconds = max(1, min(MAX_PROFILE_SECONDS, int(seconds)))
+        interval = max(MIN_INTERVAL_MS, int(interval_ms)) / 1000
+        with self.lock:
+            if self._current is not None:
+                raise RuntimeError('已有取樣正在進行')
+            name = f"profile_{datetime.now().strftime('%Y%m%d-%H%M%S')}.folded"
+            self._current = {
+                'file': name,
+                'started_at': datetime.now().isoformat(),
+                'seconds': seconds,
+                'interval_ms': interval * 1000,
+                'include_idle': include_idle,
+            }
+            status = dict(self._current)
+        start_new_thread, get_ident, sleep = _native_thread_api()
+        start_new_thread(self._sample, (name, seconds, interval, include_idle, get_ident, sleep))
+        print(f"🔬 開始取樣 {seconds} 秒（間隔 {interval * 1000:.0f} ms）: {name}")
+        return status
+
+    def _sample(self, name, seconds, interval, include_idle, get_ident, sleep):
+        own_ident = get_ident()
+        stacks = Counter()
+        samples = 0
+        deadline = time.perf_counter() + seconds
+        try:
+            while time.perf_counter() < deadline:
+                thread_names = {t.ident: t.name for t in threading.enumerate()}
+                for ident, frame in sys._current_frames().items():
+                    if ident == own_ident:
+                        continue
+                    if not include_idle and os.path.basename(frame.f_code.co_filename) in IDLE_MODULES:
+                        continue
+                    root = _THREAD_SUFFIX.sub('', thread_names.get(ident, 'thread'))
+                    stacks[_fold(frame, root)] += 1
+                samples += 1
+                sleep(interval)
+            path = self._write(name, stacks)
+            result = {'file': name, 'path': path, 'samples': samples, 'stacks': len(stacks),
+                      'top_functions': self._top_functions(stacks)}
+            print(f"🔬 取樣完成: {path}（{samples} 次取樣，{len(stacks)} 種堆疊）")
+        except Exception as e:
+            result = {'file': name, 'error': str(e)}
+            print(f"❌ 取樣失敗: {e}")
+        with self.lock:
+            self._last = {**self._current, **result, 'finished_at': datetime.now().isoformat()}
+            self._current = None
+
+    def _write(self, name, stacks):
+        os.makedirs(self.output_dir, exist_ok=True)
+        path = os.path.join(self.output_dir, name)
+        tmp_path = temp_path(path)
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            for stack, count in stacks.most_common():
+                f.write(f"{stack} {count}\n")
+        os.replace(tmp_path, path)
+        return path
+
+    @staticmethod
+    def _top_functions(stacks, n=10):
+        """葉節點（自身時間）最多的函數"""
+        leaves = Counter()
+        for stack, count in stacks.items():
+            leaves[stack.rsplit(';', 1)[-1]] += count
+        total = sum(leaves.values()) or 1
+        return [{'function': label, 'samples': count, 'percent': round(count / total * 100, 1)}
+                for label, count in leaves.most_common(n)]
+
+    def status(self):
+        with self.lock:
+            return {
+                'running': dict(self._current) if self._current else None,
+                'last': dict(self._last) if self._last else None,
+            }
+
+    def list_profiles(self):
+        """列出已輸出的取樣檔（新到舊）"""
+        if not os.path.isdir(self.output_dir):
+            return []
+        names = sorted((n for n in os.listdir(self.output_dir) if n.endswith('.folded')), reverse=True)
+        return [{'file': n, 'size': os.path.getsize(os.path.join(self.output_dir, n))} for n in names]
@@ -0,0 +1,408 @@
+import os
+import sys
+import json
+import mmap
+import time
+import bisect
+import struct
+from array import array
+from datetime import date, datetime
+
+import numpy as np
+
+from .utils import temp_path
+
+# 是否在 JSON 旁維護二進位欄式檔（.fxs）並以 mmap 共用；關閉時每個行程各自解析 JSON
+BINARY_SERIES = os.environ.get('BINARY_SERIES', '1').lower() not in ('0', 'false', 'no')
+
+BINARY_EXT = '.fxs'
+
+# 檔頭：魔術字、格式版本、旗標、天數、保留欄位（小端序，共 16 位元組）
+# 其後依序為 int32 日期序數、float64 匯率（對齊到 8 位元組）、可選的 uint32 更新時間
+_MAGIC = b'FXS1'
+_VERSION = 1
+_HEADER = struct.Struct('<4sHHII')
+_FLAG_UPDATED = 0x1
+
+_EPOCH_ORDINAL = date(1970, 1, 1).toordinal()
+
+
+def to_ordinal(date_str):
+    """'YYYY-MM-DD' -> 日期序數"""
+    return date.fromisoformat(date_str).toordinal()
+
+
+def to_date_str(ordinal):
+    return date.fromordinal(ordinal).isoformat()
+
+
+def _to_epoch(updated):
+    """ISO 時間字串 -> 整數秒（缺值或格式錯誤時為 0）"""
+    if not updated:
+        return 0
+    try:
+        return int(datetime.fromisoformat(updated).timestamp())
+    except (TypeError, ValueError):
+        return 0
+
+
+def _to_iso(epoch):
+    return datetime.fromtimestamp(epoch).isoformat() if epoch else None
+
+
+def binary_path(json_path):
+    """JSON 數據檔對應的二進位欄式檔路徑"""
+    return os.path.splitext(json_path)[0] + BINARY_EXT
+
+
+def _signature(path):
+    """用來判斷檔案是否已被替換的 (inode, 修改時間, 大小)，檔案不存在時為 None"""
+    try:
+        st = os.stat(path)
+    except OSError:
+        return None
+    return st.st_ino, st.st_mtime_ns, st.st_size
+
+
+def _layout(count, has_updated):
+    """各欄在檔案中的起始位置與檔案總長度"""
+    rates_offset = _HEADER.size + 4 * count
+    rates_offset += -rates_offset % 8
+    updated_offset = rates_offset + 8 * count
+    return _HEADER.size, rates_offset, updated_offset, updated_offset + (4 * count if has_updated else 0)
+
+
+class RateSeries:
+    __slots__ = ('_ordinals', '_rates', '_updated', '_path', '_signature', '_mapped_bytes')
+
+    def __init__(self, track_updated=True):
+        """
+        單一貨幣對的日匯率序列，以三個平行的緊湊陣列保存並按日期排序：
+        日期序數 array('i')、匯率 array('d')，以及可選的更新時間 array('I')（Unix 秒）。
+        每天約 16 位元組，取代每天數百位元組的 {date_str: {'rate', 'updated'}} 字典。
+        同時提供字典式的相容介面（以日期字串為鍵、值為 {'rate', 'updated'}），
+        讀取時才產生該字典，修改它不會寫回序列。
+
+        由 map_file() 建立時三個欄位是直接指向 mmap 的 memoryview，不解析也不複製，
+        多個 worker 行程共用同一份分頁快取；第一次寫入時才複製成行程私有的陣列。
+        """
+        self._ordinals = array('i')
+        self._rates = array('d')
+        self._updated = array('I') if track_updated else None
+        self._path = None
+        self._signature = None
+        self._mapped_bytes = 0
+
+    @classmethod
+    def map_file(cls, path):
+        """以唯讀 mmap 開啟二進位欄式檔；檔案不存在、版本不符或損毀時返回 None"""
+        series = cls()
+        return series if series._map(path) else None
+
+    def _map(self, path):
+        signature = _signature(path)
+        if signature is None or signature[2] < _HEADER.size:
+            return False
+        try:
+            with open(path, 'rb') as f:
+                mapped = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        except (OSError, ValueError) as e:
+            print(f"映射 {path} 時發生錯誤: {e}")
+            return False
+        magic, version, flags, count, _ = _HEADER.unpack_from(mapped)
+        has_updated = bool(flags & _FLAG_UPDATED)
+        ordinals_offset, rates_offset, updated_offset, end = _layout(count, has_updated)
+        if magic != _MAGIC or version != _VERSION or len(mapped) != end:
+            mapped.close()  # 檔案已由 with 關閉；無效的映射立即釋放，不留待回收
+            return False
+        # mmap 不在此關閉：memoryview 持有它的引用，序列改映射新檔或被回收後才釋放
+        view = memoryview(mapped)
+        self._ordinals = view[ordinals_offset:ordinals_offset + 4 * count].cast('i')
+        self._rates = view[rates_offset:updated_offset].cast('d')
+        self._updated = view[updated_offset:end].cast('I') if has_updated else None
+        self._path = path
+        self._signature = signature
+        self._mapped_bytes = end
+        return True
+
+    def write_file(self, path):
+        """寫出二進位欄式檔（先寫暫存檔再 os.replace，已映射舊檔的行程不受影響）"""
+        count = len(self._ordinals)
+        has_updated = self._updated is not None
+        ordinals_offset, rates_offset, updated_offset, end = _layout(count, has_updated)
+        tmp_path = temp_path(path)
+        with open(tmp_path, 'wb') as f:
+            f.write(_HEADER.pack(_MAGIC, _VERSION, _FLAG_UPDATED if has_updated else 0, count, 0))
+            f.write(memoryview(self._ordinals).cast('B'))
+            f.write(b'\0' * (rates_offset - ordinals_offset - 4 * count))
+            f.write(memoryview(self._rates).cast('B'))
+            if has_updated:
+                f.write(memoryview(self._updated).cast('B'))
+        os.replace(tmp_path, path)
+
+    def refresh(self):
+        """已映射的序列在檔案被其他行程替換後改映射新檔；未映射（或已轉為私有陣列）時不做事"""
+        if self._path is None:
+            return False
+        signature = _signature(self._path)
+        if signature is None or signature == self._signature:
+            return False
+        return self._map(self._path)
+
+    @property
+    def mapped(self):
+        return self._path is not None
+
+    def _materialize(self):
+        """寫入前把映射的欄位複製成私有陣列（copy-on-write）"""
+        if self._path is None:
+            return
+        self._ordinals = array('i', self._ordinals.tobytes())
+        self._rates = array('d', self._rates.tobytes())
+        if self._updated is not None:
+            self._updated = array('I', self._updated.tobytes())
+        self._path = None
+        self._signature = None
+        self._mapped_bytes = 0
+
+    @classmethod
+    def from_json_dict(cls, data, track_updated=True):
+        """由 {date_str: {'rate': float, 'updated': iso}}（JSON 檔案格式）建立"""
+        series = cls(track_updated)
+        items = sorted(data.items())
+        series._ordinals.extend(to_ordinal(d) for d, _ in items)
+        series._rates.extend(float(entry['rate']) for _, entry in items)
+        if series._updated is not None:
+            series._updated.extend(_to_epoch(entry.get('updated')) for _, entry in items)
+        return series
+
+    def to_json_dict(self):
+        """轉回 JSON 檔案格式，既有的數據檔與工具不必修改"""
+        result = {}
+        for i, ordinal in enumerate(self._ordinals):
+            entry = {'rate': self._rates[i]}
+            updated = _to_iso(self._updated[i]) if self._updated is not None else None
+            if updated:
+                entry['updated'] = updated
+            result[to_date_str(ordinal)] = entry
+        return result
+
+    def _index(self, date_str):
+        """日期在陣列中的位置，不存在時為 -1"""
+        ordinal = to_ordinal(date_str)
+        i = bisect.bisect_left(self._ordinals, ordinal)
+        return i if i < len(self._ordinals) and self._ordinals[i] == ordinal else -1
+
+    def _bounds(self, start_str=None, end_str=None):
+        """以二分搜尋取得 [start_str, end_str]（含頭尾）對應的索引範圍"""
+        lo = 0 if start_str is None else bisect.bisect_left(self._ordinals, to_ordinal(start_str))
+        hi = len(self._ordinals) if end_str is None else bisect.bisect_right(self._ordinals, to_ordinal(end_str))
+        return lo, max(lo, hi)
+
+    # --- 寫入 ---
+
+    def put(self, date_str, rate, updated=None):
+        """寫入一天的匯率（updated 為 Unix 秒，省略時為現在），返回是否為新增的日期"""
+        self._materialize()
+        ordinal = to_ordinal(date_str)
+        updated = int(time.time() if updated is None else updated)
+        if not self._ordinals or ordinal > self._ordinals[-1]:
+            # 最常見的情況：新的一天接在尾端
+            i, added = len(self._ordinals), True
+        else:
+            i = bisect.bisect_left(self._ordinals, ordinal)
+            added = not (i < len(self._ordinals) and self._ordinals[i] == ordinal)
+        if added:
+            self._ordinals.insert(i, ordinal)
+            self._rates.insert(i, float(rate))
+            if self._updated is not None:
+                self._updated.insert(i, updated)
+        else:
+            self._rates[i] = float(rate)
+            if self._updated is not None:
+                self._updated[i] = updated
+        return added
+
+    def update_rates(self, rates, updated=None):
+        """寫入 {date_str: rate}，返回新增的日期數"""
+        updated = int(time.time() if updated is None else updated)
+        return sum(self.put(date_str, rate, updated) for date_str, rate in sorted(rates.items()))
+
+    def pop_before(self, cutoff_str):
+        """移除並返回早於 cutoff_str 的 {date_str: rate}"""
+        hi = bisect.bisect_left(self._ordinals, to_ordinal(cutoff_str))
+        if hi:
+            self._materialize()
+        expired = {to_date_str(self._ordinals[i]): self._rates[i] for i in range(hi)}
+        if hi:
+            del self._ordinals[:hi]
+            del self._rates[:hi]
+            if self._updated is not None:
+                del self._updated[:hi]
+        return expired
+
+    # --- 讀取 ---
+
+    def rate(self, date_str, default=None):
+        i = self._index(date_str)
+        return self._rates[i] if i >= 0 else default
+
+    def items_between(self, start_str=None, end_str=None):
+        """按日期排序的 [(date_str, rate)]，可選擇以日期字串限定範圍（含頭尾）"""
+        lo, hi = self._bounds(start_str, end_str)
+        return [(to_date_str(self._ordinals[i]), self._rates[i]) for i in range(lo, hi)]
+
+    def iter_between(self, start_str=None, end_str=None):
+        """
+        逐筆產生 (date_str, rate)，不先建立整段清單。已映射時直接走訪 mmap 視圖；
+        私有陣列先切出範圍的緊湊副本（每天 12 位元組），走訪期間的寫入不影響結果。
+        """
+        lo, hi = self._bounds(start_str, end_str)
+        return zip(map(to_date_str, self._ordinals[lo:hi]), self._rates[lo:hi])
+
+    def datetimes_between(self, start_str=None, end_str=None):
+        """([datetime], [rate])，可選擇以日期字串限定範圍（含頭尾）；直接由日期序數建立，不經字串轉換"""
+        lo, hi = self._bounds(start_str, end_str)
+        return [datetime.fromordinal(ordinal) for ordinal in self._ordinals[lo:hi]], list(self._rates[lo:hi])
+
+    def rates_between(self, start_str=None, end_str=None):
+        """{date_str: rate}，可選擇以日期字串限定範圍（含頭尾）"""
+        return dict(self.items_between(start_str, end_str))
+
+    def columns(self, start_str=None, end_str=None):
+        """
+        (datetime64[D] 日期陣列, float64 匯率陣列)，可選擇以日期字串限定範圍（含頭尾）。
+        已映射時匯率是直接指向 mmap 的 NumPy 視圖（不複製）；私有陣列則返回副本，避免陣列之後無法伸縮。
+        """
+        lo, hi = self._bounds(start_str, end_str)
+        ordinals = np.frombuffer(self._ordinals, dtype='int32')[lo:hi]
+        rates = np.frombuffer(self._rates, dtype='float64')[lo:hi]
+        if self._path is None:
+            ordinals, rates = ordinals.copy(), rates.copy()
+        return (ordinals - _EPOCH_ORDINAL).astype('datetime64[D]'), rates
+
+    def tail(self, n):
+        """最後 n 天的 [(date_str, rate, updated_iso)]"""
+        start = max(0, len(self._ordinals) - n)
+        return [(to_date_str(self._ordinals[i]), self._rates[i],
+                 _to_iso(self._updated[i]) if self._updated is not None else None)
+                for i in range(start, len(self._ordinals))]
+
+    @property
+    def first_date(self):
+        return to_date_str(self._ordinals[0]) if self._ordinals else None
+
+    @property
+    def last_date(self):
+        return to_date_str(self._ordinals[-1]) if self._ordinals else None
+
+    def memory_usage(self):
+        """行程私有的位元組數：序列物件與三個陣列（含緩衝區）；已映射時只有物件本身，數據在共用的分頁快取中"""
+        total = sys.getsizeof(self) + sys.getsizeof(self._ordinals) + sys.getsizeof(self._rates)
+        if self._updated is not None:
+            total += sys.getsizeof(self._updated)
+        return total
+
+    @property
+    def mapped_bytes(self):
+        """映射的二進位檔大小（未映射時為 0）"""
+        return self._mapped_bytes
+
+    # --- 字典式相容介面 ---
+
+    def __len__(self):
+        return len(self._ordinals)
+
+    def __contains__(self, date_str):
+        try:
+            return self._index(date_str) >= 0
+        except (TypeError, ValueError):
+            return False
+
+    def __iter__(self):
+        return (to_date_str(ordinal) for ordinal in self._ordinals)
+
+    def keys(self):
+        return list(self)
+
+    def _entry(self, i):
+        entry = {'rate': self._rates[i]}
+        if self._updated is not None:
+            entry['updated'] = _to_iso(self._updated[i])
+        return entry
+
+    def values(self):
+        return [self._entry(i) for i in range(len(self._ordinals))]
+
+    def items(self):
+        return [(to_date_str(ordinal), self._entry(i)) for i, ordinal in enumerate(self._ordinals)]
+
+    def __getitem__(self, date_str):
+        i = self._index(date_str)
+        if i < 0:
+            raise KeyError(date_str)
+        return self._entry(i)
+
+    def get(self, date_str, default=None):
+        try:
+            return self[date_str]
+        except (KeyError, TypeError, ValueError):
+            return default
+
+    def __setitem__(self, date_str, entry):
+        """接受 {'rate': float, 'updated': iso} 或直接的匯率數值"""
+        if isinstance(entry, dict):
+            self.put(date_str, entry['rate'], _to_epoch(entry.get('updated')) or None)
+        else:
+            self.put(date_str, entry)
+
+    def __delitem__(self, date_str):
+        i = self._index(date_str)
+        if i < 0:
+            raise KeyError(date_str)
+        self._materialize()
+        del self._ordinals[i]
+        del self._rates[i]
+        if self._updated is not None:
+            del self._updated[i]
+
+    def __repr__(self):
+        mapped = f", 映射 {self._path}" if self._path else ''
+        return f"RateSeries({len(self)} 天, {self.first_date} ~ {self.last_date}{mapped})"
+
+
+def load_series(json_path):
+    """
+    載入 JSON 數據檔對應的序列。二進位欄式檔存在且不比 JSON 舊時直接映射（不解析）；
+    否則解析 JSON，並寫出二進位檔後改為映射它，讓之後啟動的行程都能共用。
+    JSON 仍是權威格式，二進位檔只是可隨時重建的衍生檔。
+    """
+    bin_path = binary_path(json_path)
+    json_signature = _signature(json_path)
+    if BINARY_SERIES:
+        bin_signature = _signature(bin_path)
+        if bin_signature is not None and (json_signature is None or bin_signature[1] >= json_signature[1]):
+            series = RateSeries.map_file(bin_path)
+            if series is not None:
+                return series
+            print(f"⚠️ {bin_path} 版本不符或已損毀，改由 JSON 重建")
+    if json_signature is None:
+        return RateSeries()
+    with open(json_path, 'r', encoding='utf-8') as f:
+        series = RateSeries.from_json_dict(json.load(f))
+    if BINARY_SERIES:
+        save_binary(series, json_path)
+    return series
+
+
+def save_binary(series, json_path):
+    """JSON 寫入後呼叫：更新二進位欄式檔並讓本行程改映射它（失敗只記錄，下次由 JSON 重建）"""
+    if not BINARY_SERIES:
+        return
+    bin_path = binary_path(json_path)
+    try:
+        series.write_file(bin_path)
+    except OSError as e:
+        print(f"寫入 {bin_path} 時發生錯誤: {e}")
+        return
+    series._map(bin_path)
@@ -0,0 +1,126 @@
+import os
+import json
+from threading import Lock
+
+from .rate_series import RateSeries, load_series, save_binary
+from .utils import atomic_write_json
+
+# 多貨幣對歷史數據的存放目錄（每個貨幣對一個 JSON 檔）
+STORE_DIR = os.path.join('data', 'rates')
+
+
+class RateStore:
+    def __init__(self, base_dir=STORE_DIR):
+        """
+        以貨幣對為單位的本地匯率儲存。
+        檔案格式與 TWD-HKD_180d.json 相同：{ 'YYYY-MM-DD': {'rate': float, 'updated': iso 字串} }，
+        載入後在記憶體中以緊湊的 RateSeries 保存；旁邊的 .fxs 二進位檔以 mmap 映射，
+        多個 worker 行程共用同一份數據，其他行程寫入後下次存取時自動改映射新檔。
+        """
+        self.base_dir = base_dir
+        self._series = {}  # (buy, sell) -> RateSeries
+        self.lock = Lock()
+
+    def _path(self, buy_currency, sell_currency):
+        return os.path.join(self.base_dir, f"{buy_currency}-{sell_currency}.json")
+
+    def _load(self, buy_currency, sell_currency):
+        """載入貨幣對數據到記憶體（內部方法，不加鎖）"""
+        key = (buy_currency, sell_currency)
+        series = self._series.get(key)
+        if series is not None:
+            series.refresh()
+            return series
+        try:
+            series = load_series(self._path(buy_currency, sell_currency))
+        except (json.JSONDecodeError, IOError) as e:
+            print(f"載入 {buy_currency}-{sell_currency} 數據時發生錯誤: {e}")
+            series = RateSeries()
+        self._series[key] = series
+        return series
+
+    def _save(self, buy_currency, sell_currency):
+        """以先寫暫存檔再替換的方式保存，避免中斷時留下半個檔案（內部方法，不加鎖）"""
+        os.makedirs(self.base_dir, exist_ok=True)
+        path = self._path(buy_currency, sell_currency)
+        series = self._series[(buy_currency, sell_currency)]
+        atomic_write_json(path, series.to_json_dict(), ensure_ascii=False, indent=2, sort_keys=True)
+        save_binary(series, path)
+
+    def get_rates(self, buy_currency, sell_currency, start_str=None, end_str=None):
+        """返回 {date_str: rate}，可選擇以 'YYYY-MM-DD' 字串限定範圍（含頭尾）"""
+        with self.lock:
+            return self._load(buy_currency, sell_currency).rates_between(start_str, end_str)
+
+    def sorted_rates(self, buy_currency, sell_currency, start_str=None, end_str=None):
+        """
+        按日期排序的 [(date_str, rate)]。尚未載入的貨幣對直接映射（或讀取）檔案、不放進常駐快取，
+        大量匯出多組貨幣對時記憶體不會隨匯出的貨幣對數累積。
+        """
+        series = self._read_series(buy_currency, sell_currency)
+        return series.items_between(start_str, end_str) if series is not None else []
+
+    def iter_rates(self, buy_currency, sell_currency, start_str=None, end_str=None):
+        """同 sorted_rates，但逐筆產生 (date_str, rate)，不建立整段清單（見 RateSeries.iter_between）"""
+        series = self._read_series(buy_currency, sell_currency)
+        return series.iter_between(start_str, end_str) if series is not None else iter(())
+
+    def _read_series(self, buy_currency, sell_currency):
+        """唯讀取用的序列：已載入的直接使用，否則臨時映射（或讀取）檔案；讀取失敗時返回 None"""
+        with self.lock:
+            series = self._series.get((buy_currency, sell_currency))
+            if series is not None:
+                series.refresh()
+                return series
+            try:
+                return load_series(self._path(buy_currency, sell_currency))
+            except (json.JSONDecodeError, IOError) as e:
+                print(f"讀取 {buy_currency}-{sell_currency} 數據時發生錯誤: {e}")
+                return None
+
+    def columns(self, buy_currency, sell_currency, start_str=None, end_str=None):
+        """(datetime64[D] 日期陣列, float64 匯率陣列)；已映射時匯率不複製，見 RateSeries.columns"""
+        with self.lock:
+            return self._load(buy_currency, sell_currency).columns(start_str, end_str)
+
+    def missing_dates(self, buy_currency, sell_currency, date_strs):
+        """找出尚未儲存的日期"""
+        with self.lock:
+            series = self._load(buy_currency, sell_currency)
+            return [d for d in date_strs if d not in series]
+
+    def put_rates(self, buy_currency, sell_currency, rates):
+        """寫入 {date_str: rate} 並落盤，返回新增的筆數"""
+        if not rates:
+            return 0
+        with self.lock:
+            added = self._load(buy_currency, sell_currency).update_rates(rates)
+            self._save(buy_currency, sell_currency)
+            return added
+
+    def pop_before(self, buy_currency, sell_currency, cutoff_str):
+        """移除並返回早於 cutoff_str 的 {date_str: rate}（用於保留期到期時的折疊）"""
+        with self.lock:
+            expired = self._load(buy_currency, sell_currency).pop_before(cutoff_str)
+            if expired:
+                self._save(buy_currency, sell_currency)
+            return expired
+
+    def pairs(self):
+        """列出已有儲存數據的貨幣對"""
+        pairs = set()
+        with self.lock:
+            pairs.update(key for key, series in self._series.items() if series)
+        if os.path.isdir(self.base_dir):
+            for filename in os.listdir(self.base_dir):
+                name, ext = os.path.splitext(filename)
+                parts = name.split('-')
+                if ext == '.json' and len(parts) == 2:
+                    pairs.add((parts[0], parts[1]))
+        return sorted(pairs)
+
+    def memory_usage(self):
+        """已載入的各貨幣對 {(buy, sell): (天數, 私有位元組數, 映射位元組數)}"""
+        with self.lock:
+            return {key: (len(series), series.memory_usage(), series.mapped_bytes)
+                    for key, series in self._series.items()}
@@ -0,0 +1,171 @@
+import os
+import json
+from datetime import datetime, timedelta
+from threading import Lock
+
+from .utils import atomic_write_json
+
+# 降採樣彙總數據的存放目錄（每個貨幣對一個 JSON 檔）
+ROLLUP_DIR = os.path.join('data', 'rollups')
+
+WEEKLY = 'weekly'
+MONTHLY = 'monthly'
+
+
+def bucket_key(date_str, tier):
+    """返回日期所屬彙總區間的鍵：週為該週週一，月為該月1日"""
+    date_obj = datetime.strptime(date_str, '%Y-%m-%d')
+    if tier == WEEKLY:
+        return (date_obj - timedelta(days=date_obj.weekday())).strftime('%Y-%m-%d')
+    return date_obj.strftime('%Y-%m-01')
+
+
+def new_bucket(date_str, rate):
+    """以單日匯率建立 OHLC 區間"""
+    return {
+        'open': rate, 'high': rate, 'low': rate, 'close': rate,
+        'sum': rate, 'count': 1,
+        'first': date_str, 'last': date_str
+    }
+
+
+def merge_bucket(bucket, other):
+    """將 other 合併進 bucket（原地修改），兩者可為任意先後順序"""
+    if other['first'] < bucket['first']:
+        bucket['open'] = other['open']
+        bucket['first'] = other['first']
+    if other['last'] > bucket['last']:
+        bucket['close'] = other['close']
+        bucket['last'] = other['last']
+    bucket['high'] = max(bucket['high'], other['high'])
+    bucket['low'] = min(bucket['low'], other['low'])
+    bucket['sum'] += other['sum']
+    bucket['count'] += other['count']
+    return bucket
+
+
+def aggregate(rates, tier):
+    """將 {date_str: rate} 彙總為 {bucket_key: bucket}"""
+    buckets = {}
+    for date_str in sorted(rates):
+        key = bucket_key(date_str, tier)
+        point = new_bucket(date_str, rates[date_str])
+        if key in buckets:
+            merge_bucket(buckets[key], point)
+        else:
+            buckets[key] = point
+    return buckets
+
+
+def _spanned_dates(buckets):
+    """舊版彙總檔沒有記錄折疊過的日期，以各區間 first~last 之間的每一天近似"""
+    dates = set()
+    for bucket in buckets:
+        day = datetime.strptime(bucket['first'], '%Y-%m-%d')
+        last = datetime.strptime(bucket['last'], '%Y-%m-%d')
+        while day <= last:
+            dates.add(day.strftime('%Y-%m-%d'))
+            day += timedelta(days=1)
+    return dates
+
+
+def merge_buckets(target, buckets):
+    """將多個區間合併進 target 字典（原地修改）"""
+    for key, bucket in buckets.items():
+        if key in target:
+            merge_bucket(target[key], bucket)
+        else:
+            target[key] = dict(bucket)
+    return target
+
+
+class RollupStore:
+    def __init__(self, base_dir=ROLLUP_DIR):
+        """
+        分層保留的彙總數據：超過原始保留期的日資料折疊成週 OHLC，
+        週資料再超過週保留期後折疊成月 OHLC。
+        另記錄已折疊過的日期：同一天重複折疊時略過（避免重複計入 sum/count），
+        回填也能以日為單位判斷哪些日期仍缺。
+        """
+        self.base_dir = base_dir
+        self._rollups = {}  # (buy, sell) -> {'weekly': {...}, 'monthly': {...}, 'folded': {date_str, ...}}
+        self.lock = Lock()
+
+    def _path(self, buy_currency, sell_currency):
+        return os.path.join(self.base_dir, f"{buy_currency}-{sell_currency}.json")
+
+    def _load(self, buy_currency, sell_currency):
+        """載入貨幣對彙總數據（內部方法，不加鎖）"""
+        key = (buy_currency, sell_currency)
+        if key not in self._rollups:
+            rollup = {WEEKLY: {}, MONTHLY: {}, 'folded': set()}
+            path = self._path(buy_currency, sell_currency)
+            if os.path.exists(path):
+                try:
+                    with open(path, 'r', encoding='utf-8') as f:
+                        loaded = json.load(f)
+                    rollup[WEEKLY] = loaded.get(WEEKLY, {})
+                    rollup[MONTHLY] = loaded.get(MONTHLY, {})
+                    if 'folded' in loaded:
+                        rollup['folded'] = set(loaded['folded'])
+                    else:
+                        rollup['folded'] = _spanned_dates(list(rollup[WEEKLY].values()) + list(rollup[MONTHLY].values()))
+                except (json.JSONDecodeError, IOError) as e:
+                    print(f"載入 {buy_currency}-{sell_currency} 彙總數據時發生錯誤: {e}")
+            self._rollups[key] = rollup
+        return self._rollups[key]
+
+    def _save(self, buy_currency, sell_currency):
+        os.makedirs(self.base_dir, exist_ok=True)
+        path = self._path(buy_currency, sell_currency)
+        rollup = self._rollups[(buy_currency, sell_currency)]
+        state = {WEEKLY: rollup[WEEKLY], MONTHLY: rollup[MONTHLY], 'folded': sorted(rollup['folded'])}
+        atomic_write_json(path, state, ensure_ascii=False, sort_keys=True)
+
+    def fold(self, buy_currency, sell_currency, rates, weekly_cutoff_str):
+        """
+        增量折疊：將過期的日資料併入週區間，並把結束於 weekly_cutoff_str 之前的週區間併入月區間。
+        已折疊過的日期會略過，重複呼叫不會重複計入。返回 (折疊的日資料筆數, 轉為月資料的週區間數)。
+        """
+        with self.lock:
+            rollup = self._load(buy_currency, sell_currency)
+            rates = {d: rate for d, rate in rates.items() if d not in rollup['folded']}
+            merge_buckets(rollup[WEEKLY], aggregate(rates, WEEKLY))
+            rollup['folded'].update(rates)
+
+            # 跨月的週區間整段歸入其起始月份
+            aged_weeks = [key for key, bucket in rollup[WEEKLY].items() if bucket['last'] < weekly_cutoff_str]
+            for key in aged_weeks:
+                bucket = rollup[WEEKLY].pop(key)
+                merge_buckets(rollup[MONTHLY], {bucket_key(bucket['first'], MONTHLY): bucket})
+
+            if rates or aged_weeks:
+                self._save(buy_currency, sell_currency)
+            return len(rates), len(aged_weeks)
+
+    def get_buckets(self, buy_currency, sell_currency, tier, start_str=None, end_str=None):
+        """取出指定層級、與範圍相交的區間副本；月層級也會納入尚未轉換的週區間"""
+        with self.lock:
+            rollup = self._load(buy_currency, sell_currency)
+            result = {}
+            merge_buckets(result, rollup[tier])
+            if tier == MONTHLY:
+                for bucket in rollup[WEEKLY].values():
+                    merge_buckets(result, {bucket_key(bucket['first'], MONTHLY): bucket})
+        return {
+            key: bucket for key, bucket in result.items()
+            if (start_str is None or bucket['last'] >= start_str) and (end_str is None or bucket['first'] <= end_str)
+        }
+
+    def get_points(self, buy_currency, sell_currency, start_str=None, end_str=None):
+        """按時間順序取出與範圍相交的所有週/月區間（不做跨層合併），tier 欄位標示所屬層級"""
+        with self.lock:
+            rollup = self._load(buy_currency, sell_currency)
+            buckets = [dict(b, tier=tier) for tier in (MONTHLY, WEEKLY) for b in rollup[tier].values()
+                       if (start_str is None or b['last'] >= start_str) and (end_str is None or b['first'] <= end_str)]
+        return sorted(buckets, key=lambda b: b['last'])
+
+    def is_covered(self, buy_currency, sell_currency, date_str):
+        """該日期本身是否已被折疊進彙總數據（用於回填時略過已彙總的日期；同一週/月內未折疊的日期仍會回填）"""
+        with self.lock:
+            return date_str in self._load(buy_currency, sell_currency)['folded']
@@ -1,35 +1,150 @@
-from flask import Blueprint, render_template, request, jsonify, Response, current_app
+from flask import Blueprint, render_template, request, jsonify, Response, current_app, g, send_from_directory, stream_with_context
 from datetime import datetime
 import time
+import json
 import queue
 import schedule
+import os
 import uuid
+import hashlib
+import hmac
 
 from .sse import sse_clients, sse_lock, sse_stream
-from .scheduler import scheduled_update
+from .scheduler import scheduled_update, POPULAR_REFRESH_TOP_N
+from .exchange_rate_manager import RAW_RETENTION_DAYS
+from .job_scheduler import INTERACTIVE, SchedulerBusyError
+from . import metrics, tracing
+from .profiler import SamplingProfiler, DEFAULT_INTERVAL_MS
+from .chart_variants import parse_variant
+from .sparklines import MAX_SPARKLINE_PAIRS
+from .comparison import MAX_COMPARE_PAIRS
+from .alerts import DIRECTIONS
+from .indicators import parse_indicators
+from . import export
 
 bp = Blueprint('main', __name__)
 
 SERVER_INSTANCE_ID = str(uuid.uuid4())
 
+# SSE 是長連線，處理時間沒有意義，不列入端點延遲
+UNTIMED_ENDPOINTS = {'main.sse_events'}
+
+# 取樣分析只開放給管理者：需設定此值並帶 X-Admin-Token 標頭，未設定時端點一律拒絕
+PROFILER_TOKEN = os.environ.get('PROFILER_TOKEN')
+
+# 排程器忙碌回 503 時建議客戶端等待的秒數
+BUSY_RETRY_AFTER_SECONDS = 5
+
+profiler = SamplingProfiler()
+
+@bp.before_request
+def start_request_timer():
+    g.request_started = time.perf_counter()
+    if request.endpoint not in UNTIMED_ENDPOINTS:
+        tracing.start()
+
+@bp.after_request
+def record_request_duration(response):
+    started = g.pop('request_started', None)
+    if started is not None and request.endpoint not in UNTIMED_ENDPOINTS:
+        metrics.HTTP_REQUEST_SECONDS.observe(time.perf_counter() - started,
+                                             request.endpoint, request.method, str(response.status_code))
+    trace, total = tracing.finish()
+    if trace is not None:
+        response.headers['Server-Timing'] = trace.server_timing(total)
+    return response
+
+def _with_timing(payload):
+    """帶 debug=1 時在回應中附上各 span 的耗時分解"""
+    trace = tracing.current()
+    if trace is not None and request.args.get('debug', '').lower() in ('1', 'true', 'timing'):
+        payload['timing'] = trace.breakdown()
+    return payload
+
 @bp.route('/')
 def index():
-    """主頁面"""
-    return render_template('index.html')
+    """主頁面（資源網址帶內容指紋，頁面本身每次都要重新驗證，部署後才會拿到新的網址）"""
+    response = current_app.make_response(render_template('index.html'))
+    response.headers['Cache-Control'] = 'no-cache'
+    return response
 
 @bp.route('/test')
 def test_page():
     """API 測試頁面"""
     return current_app.send_static_file('api_test.html')
 
+DEFAULT_POINT_BUDGET = 500
+MIN_POINT_BUDGET = 10
+MAX_POINT_BUDGET = 5000
+MAX_RANGE_DAYS = 366 * 20
+
+def _parse_date_range(args):
+    """
+    解析 start/end 參數（YYYY-MM-DD）。
+    兩者皆未提供時返回 (None, None)；格式錯誤或範圍不合理時拋出 ValueError。
+    """
+    start_str, end_str = args.get('start'), args.get('end')
+    if not start_str and not end_str:
+        return None, None
+    end_date = datetime.strptime(end_str, '%Y-%m-%d') if end_str else datetime.now()
+    if not start_str:
+        raise ValueError('指定 end 時必須同時提供 start')
+    start_date = datetime.strptime(start_str, '%Y-%m-%d')
+    if start_date > end_date:
+        raise ValueError('start 不能晚於 end')
+    if (end_date - start_date).days > MAX_RANGE_DAYS:
+        raise ValueError(f'日期範圍不可超過 {MAX_RANGE_DAYS} 天')
+    return start_date.strftime('%Y-%m-%d'), end_date.strftime('%Y-%m-%d')
+
+def _parse_point_budget(args, default=DEFAULT_POINT_BUDGET):
+    """解析點數預算參數 points，並限制在合理範圍內"""
+    try:
+        points = int(args.get('points', default))
+    except (TypeError, ValueError):
+        points = default
+    return max(MIN_POINT_BUDGET, min(MAX_POINT_BUDGET, points))
+
+def _chart_etag(chart_data):
+    version = f"{chart_data.get('chart_url')}|{chart_data.get('content_hash', '')}"
+    return hashlib.blake2b(version.encode('utf-8'), digest_size=8).hexdigest()
+
+def _busy_response(error, start_time):
+    """排程器忙碌、請求等待逾時：回 503 並建議稍後重試（任務仍會在背景完成並寫入快取）"""
+    current_app.logger.warning(f"⏳ SCHEDULER BUSY: {error}")
+    response = jsonify({
+        'error': '伺服器忙碌中，請稍後再試',
+        'busy': True,
+        'processing_time': round(time.time() - start_time, 3),
+    })
+    response.status_code = 503
+    response.headers['Retry-After'] = str(BUSY_RETRY_AFTER_SECONDS)
+    return response
+
 @bp.route('/api/chart')
 def get_chart():
-    """獲取圖表API - 支援多幣種並統一使用伺服器快取"""
+    """
+    獲取圖表API - 支援多幣種並統一使用伺服器快取，可用 start/end 指定任意日期範圍。
+    format（png/webp/svg）、width、dpi 可要求較小或不同格式的圖表變體。
+    pairs=A-B,C-D 指定兩組以上貨幣對時輸出比較圖，rebase=1 換算成起點=100 的指數。
+    indicators=sma:20,ema:10,bollinger,volatility,pct_change 疊加技術指標（比較圖不支援）。
+    """
     start_time = time.time()
     
     period = request.args.get('period', '7')
     buy_currency = request.args.get('buy_currency', 'TWD')
     sell_currency = request.args.get('sell_currency', 'HKD')
+    compare_pairs = []
+    if request.args.get('pairs'):
+        compare_pairs, invalid = _parse_pair_list(request.args)
+        if invalid or not compare_pairs:
+            return jsonify({'error': '貨幣對格式無效（例如 pairs=TWD-HKD,USD-JPY）', 'invalid': invalid}), 400
+        if len(compare_pairs) > MAX_COMPARE_PAIRS:
+            return jsonify({'error': f'一張比較圖最多 {MAX_COMPARE_PAIRS} 組貨幣對', 'requested': len(compare_pairs)}), 400
+        if len(compare_pairs) == 1:
+            # 只有一組時就是一般圖表
+            (buy_currency, sell_currency), compare_pairs = compare_pairs[0], []
+    for pair in compare_pairs or [(buy_currency, sell_currency)]:
+        _record_popularity(*pair)
 
     try:
         days = int(period)
@@ -37,13 +152,63 @@ def get_chart():
         days = 7
 
     try:
-        chart_data = current_app.manager.create_chart(days, buy_currency, sell_currency)
+        start_str, end_str = _parse_date_range(request.args)
+    except ValueError as e:
+        return jsonify({'error': f'日期範圍無效: {e}', 'currency_pair': f"{buy_currency}-{sell_currency}"}), 400
+
+    try:
+        variant = parse_variant(request.args)
+    except ValueError as e:
+        return jsonify({'error': f'圖表格式無效: {e}', 'currency_pair': f"{buy_currency}-{sell_currency}"}), 400
+
+    try:
+        indicators = parse_indicators(request.args.get('indicators'))
+    except ValueError as e:
+        return jsonify({'error': f'指標參數無效: {e}', 'currency_pair': f"{buy_currency}-{sell_currency}"}), 400
+    if indicators and compare_pairs:
+        return jsonify({'error': '比較圖不支援疊加指標'}), 400
+
+    try:
+        if compare_pairs:
+            rebase = request.args.get('rebase', '').lower() in ('1', 'true', 'yes')
+            chart_data = current_app.manager.create_comparison_chart(compare_pairs, days, start_str, end_str,
+                                                                     rebase, variant)
+            unavailable_pairs = (chart_data or {}).get('unavailable_pairs')
+            if unavailable_pairs:
+                # 期間早於背景抓取能補的範圍，重新請求也不會有數據
+                return jsonify({
+                    'error': '本地尚無這些貨幣對在指定期間的數據',
+                    'no_data': True,
+                    'unavailable_pairs': unavailable_pairs,
+                    'currency_pair': ','.join(unavailable_pairs),
+                    'processing_time': round(time.time() - start_time, 3)
+                }), 404
+            pending_pairs = (chart_data or {}).get('pending_pairs')
+            if pending_pairs:
+                # 缺少數據的貨幣對已在背景並行抓取，完成後會送出各自的 chart_ready 事件
+                return jsonify({
+                    'no_data': True,
+                    'pending_pairs': pending_pairs,
+                    'message': f"正在抓取 {', '.join(pending_pairs)} 的數據，完成後請重新請求比較圖"
+                }), 202
+        elif start_str:
+            max_points = _parse_point_budget(request.args)
+            chart_data = current_app.manager.create_range_chart(start_str, end_str, buy_currency, sell_currency,
+                                                                max_points, variant, indicators)
+        else:
+            chart_data = current_app.manager.create_chart(days, buy_currency, sell_currency)
+            chart_data = current_app.manager.chart_variant(days, buy_currency, sell_currency, chart_data, variant,
+                                                           indicators)
         processing_time = time.time() - start_time
         
         if chart_data and chart_data.get('chart_url'):
             chart_data['processing_time'] = round(processing_time, 3)
             chart_data['processing_time_ms'] = round(processing_time * 1000, 1)
-            return jsonify(chart_data)
+            # 圖表網址含數據雜湊與變體，可作為內容版本；前端帶 If-None-Match 確認時，未變就回 304
+            response = jsonify(_with_timing(dict(chart_data)))
+            response.set_etag(_chart_etag(chart_data), weak=True)
+            response.headers['Cache-Control'] = 'no-cache'
+            return response.make_conditional(request)
         else:
             # 提供更詳細的錯誤信息
             data_count = len(current_app.manager.data) if hasattr(current_app.manager, 'data') else 0
@@ -53,10 +218,12 @@ def get_chart():
                 'processing_time': round(processing_time, 3),
                 'data_available': data_count,
                 'period_requested': days,
-                'currency_pair': f"{buy_currency}-{sell_currency}"
+                'currency_pair': ','.join(f"{b}-{s}" for b, s in compare_pairs) or f"{buy_currency}-{sell_currency}"
             }
             return jsonify(error_details), 500
             
+    except SchedulerBusyError as e:
+        return _busy_response(e, start_time)
     except Exception as e:
         processing_time = time.time() - start_time
         current_app.logger.error(f"處理圖表請求時發生未預期的錯誤: {e}", exc_info=True)
@@ -68,6 +235,55 @@ def get_chart():
         }
         return jsonify(error_details), 500
 
+@bp.route('/api/series')
+def get_series():
+    """獲取匯率序列數據API（JSON），以 LTTB 降採樣至點數預算內；indicators 附帶對齊的技術指標數值"""
+    start_time = time.time()
+
+    buy_currency = request.args.get('buy_currency', 'TWD')
+    sell_currency = request.args.get('sell_currency', 'HKD')
+    _record_popularity(buy_currency, sell_currency)
+    try:
+        days = int(request.args.get('period', '7'))
+    except ValueError:
+        days = 7
+
+    try:
+        start_str, end_str = _parse_date_range(request.args)
+    except ValueError as e:
+        return jsonify({'error': f'日期範圍無效: {e}', 'currency_pair': f"{buy_currency}-{sell_currency}"}), 400
+    max_points = _parse_point_budget(request.args)
+    try:
+        indicators = parse_indicators(request.args.get('indicators'))
+    except ValueError as e:
+        return jsonify({'error': f'指標參數無效: {e}', 'currency_pair': f"{buy_currency}-{sell_currency}"}), 400
+
+    try:
+        series = current_app.manager.get_series(buy_currency, sell_currency, days=days,
+                                                start_str=start_str, end_str=end_str, max_points=max_points,
+                                                indicators=indicators)
+        processing_time = time.time() - start_time
+        if not series:
+            return jsonify({
+                'error': '本地尚無此貨幣對在指定期間的數據',
+                'no_data': True,
+                'currency_pair': f"{buy_currency}-{sell_currency}",
+                'processing_time': round(processing_time, 3)
+            }), 404
+
+        series['processing_time'] = round(processing_time, 3)
+        series['processing_time_ms'] = round(processing_time * 1000, 1)
+        return jsonify(_with_timing(series))
+    except Exception as e:
+        processing_time = time.time() - start_time
+        current_app.logger.error(f"處理序列請求時發生未預期的錯誤: {e}", exc_info=True)
+        return jsonify({
+            'error': '伺服器內部錯誤',
+            'error_type': type(e).__name__,
+            'currency_pair': f"{buy_currency}-{sell_currency}",
+            'processing_time': round(processing_time, 3)
+        }), 500
+
 @bp.route('/api/latest_rate')
 def get_latest_rate():
     """獲取最新匯率的API端點，完全依賴 ExchangeRateManager 處理"""
@@ -75,6 +291,7 @@ def get_latest_rate():
     
     buy_currency = request.args.get('buy_currency', 'TWD')
     sell_currency = request.args.get('sell_currency', 'HKD')
+    _record_popularity(buy_currency, sell_currency)
     
     try:
         latest_data = current_app.manager.get_current_rate(buy_currency, sell_currency)
@@ -101,7 +318,7 @@ def get_latest_rate():
             latest_data['sell_currency'] = sell_currency
             latest_data['processing_time'] = round(processing_time, 3)
             latest_data['processing_time_ms'] = round(processing_time * 1000, 1)
-            return jsonify(latest_data)
+            return jsonify(_with_timing(latest_data))
         else:
             return jsonify({ 
                 'error': '無法獲取最新匯率，請稍後再試。', 
@@ -109,6 +326,8 @@ def get_latest_rate():
                 'sell_currency': sell_currency,
                 'processing_time': round(processing_time, 3)
             }), 500
+    except SchedulerBusyError as e:
+        return _busy_response(e, start_time)
     except Exception as e:
         processing_time = time.time() - start_time
         current_app.logger.error(f"💥 API LATEST (ERROR): 在獲取 {buy_currency}-{sell_currency} 時發生嚴重錯誤: {e}", exc_info=True)
@@ -119,6 +338,93 @@ def get_latest_rate():
             "processing_time": round(processing_time, 3)
         }), 500
 
+MAX_BULK_PAIRS = 100
+
+def _is_currency_code(code):
+    """檢查是否為三位大寫字母的貨幣代碼"""
+    return len(code) == 3 and code.isalpha() and code.isupper()
+
+def _record_popularity(buy_currency, sell_currency):
+    """只記錄格式正確的貨幣對，無效代碼不進入熱門度，也不會被每日刷新拿去打上游"""
+    if _is_currency_code(buy_currency) and _is_currency_code(sell_currency) and buy_currency != sell_currency:
+        current_app.manager.popularity.record(buy_currency, sell_currency)
+
+def _parse_pair_list(args):
+    """
+    解析批次貨幣對參數，支援兩種形式：
+    - base=TWD&quotes=HKD,USD,JPY
+    - pairs=TWD-HKD,USD-JPY
+    返回 (pairs, invalid)。
+    """
+    pairs, invalid = [], []
+    base = args.get('base', '').strip().upper()
+    quotes = [q.strip().upper() for q in args.get('quotes', '').split(',') if q.strip()]
+    if base:
+        for quote in quotes:
+            if _is_currency_code(base) and _is_currency_code(quote) and base != quote:
+                pairs.append((base, quote))
+            else:
+                invalid.append(f"{base}-{quote}")
+
+    for item in args.get('pairs', '').split(','):
+        item = item.strip().upper()
+        if not item:
+            continue
+        parts = item.split('-')
+        if len(parts) == 2 and all(_is_currency_code(p) for p in parts) and parts[0] != parts[1]:
+            pairs.append((parts[0], parts[1]))
+        else:
+            invalid.append(item)
+
+    # 去除重複但保留順序
+    return list(dict.fromkeys(pairs)), invalid
+
+@bp.route('/api/latest_rates')
+def get_latest_rates():
+    """批次獲取多個貨幣對最新匯率的API，返回精簡的匯率矩陣"""
+    start_time = time.time()
+
+    pairs, invalid = _parse_pair_list(request.args)
+    if not pairs:
+        return jsonify({
+            'error': '請提供 base 與 quotes，或 pairs 參數（例如 pairs=TWD-HKD,USD-JPY）',
+            'invalid': invalid
+        }), 400
+    if len(pairs) > MAX_BULK_PAIRS:
+        return jsonify({'error': f'一次最多查詢 {MAX_BULK_PAIRS} 組貨幣對', 'requested': len(pairs)}), 400
+
+    try:
+        entries, missing = current_app.manager.get_latest_rates(pairs)
+
+        # 矩陣: rates[buy][sell] = rate；meta 以 "BUY-SELL" 為鍵存放來源與新鮮度
+        rates, meta = {}, {}
+        for (buy, sell), entry in entries.items():
+            rates.setdefault(buy, {})[sell] = entry['rate']
+            meta[f"{buy}-{sell}"] = {
+                'date': entry.get('date'),
+                'source': entry.get('source'),
+                'updated_time': entry.get('updated_time'),
+                'age_seconds': entry.get('age_seconds')
+            }
+
+        processing_time = time.time() - start_time
+        return jsonify(_with_timing({
+            'rates': rates,
+            'meta': meta,
+            'missing': [f"{buy}-{sell}" for buy, sell in missing],
+            'invalid': invalid,
+            'requested': len(pairs),
+            'processing_time': round(processing_time, 3),
+            'processing_time_ms': round(processing_time * 1000, 1)
+        }))
+    except Exception as e:
+        processing_time = time.time() - start_time
+        current_app.logger.error(f"💥 API LATEST BULK (ERROR): 批次獲取最新匯率時發生錯誤: {e}", exc_info=True)
+        return jsonify({
+            'error': f'伺服器在處理請求時發生內部錯誤: {e}',
+            'processing_time': round(processing_time, 3)
+        }), 500
+
 @bp.route('/api/server_status')
 def server_status_api():
     """提供伺服器實例ID，用於客戶端檢測伺服器重啟"""
@@ -140,7 +446,13 @@ def get_schedule_status():
                 'is_active': len(jobs) > 0,
                 'next_run_time': next_run_time,
                 'scheduled_time': '每天 09:00',
-                'current_time': datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+                'current_time': datetime.now().strftime('%Y-%m-%d %H:%M:%S'),
+                'fetch_planner': current_app.manager.planner.get_stats(),
+                'upstream_archive': current_app.manager.archive.get_stats() if current_app.manager.archive else None,
+                'popular_pairs': [
+                    {'pair': f"{buy}-{sell}", 'score': score}
+                    for buy, sell, score in current_app.manager.popularity.top(POPULAR_REFRESH_TOP_N, exclude={('TWD', 'HKD')})
+                ]
             }
         })
     except Exception as e:
@@ -166,17 +478,18 @@ def trigger_scheduled_update():
 
 @bp.route('/api/force_cleanup_data')
 def force_cleanup_data():
-    """強制清理並更新近180天資料API"""
+    """強制清理並更新保留期內資料API（超過保留期的資料會折疊為週/月彙總）"""
     try:
-        print("🔄 強制執行180天資料清理...")
+        retention_days = RAW_RETENTION_DAYS
+        print(f"🔄 強制執行{retention_days}天資料清理...")
         old_count = len(current_app.manager.data)
-        updated_count = current_app.manager.update_data(180)
+        updated_count = current_app.manager.update_data(retention_days)
         new_count = len(current_app.manager.data)
         removed_count = old_count - new_count + updated_count
 
         message = f"清理完成！原有 {old_count} 筆資料，現有 {new_count} 筆資料"
         if removed_count > 0:
-            message += f"，已移除 {removed_count} 筆超過180天的舊資料"
+            message += f"，已將 {removed_count} 筆超過{retention_days}天的舊資料折疊為週/月彙總"
         if updated_count > 0:
             message += f"，更新了 {updated_count} 筆新資料"
 
@@ -205,7 +518,7 @@ def pregenerate_charts_api():
     
     try:
         print(f"🚀 API觸發：請求為 {buy_currency}-{sell_currency} 啟動生成/通知流程...")
-        current_app.manager.warm_up_chart_cache(buy_currency, sell_currency)
+        current_app.manager.warm_up_chart_cache(buy_currency, sell_currency, priority=INTERACTIVE)
         
         return jsonify({
             'success': True, 
@@ -219,6 +532,68 @@ def pregenerate_charts_api():
             'message': f'預生成圖表失敗: {str(e)}'
         }), 500
 
+@bp.route('/api/sparklines')
+def get_sparklines():
+    """
+    批次獲取多組貨幣對的走勢縮圖（內嵌 SVG），供歷史記錄清單使用。
+    只讀本地數據，沒有數據的貨幣對列在 missing，不會觸發背景抓取。
+    """
+    start_time = time.time()
+
+    pairs, invalid = _parse_pair_list(request.args)
+    if not pairs:
+        return jsonify({'error': '請提供 pairs 參數（例如 pairs=TWD-HKD,USD-JPY）', 'invalid': invalid}), 400
+    if len(pairs) > MAX_SPARKLINE_PAIRS:
+        return jsonify({'error': f'一次最多查詢 {MAX_SPARKLINE_PAIRS} 組貨幣對', 'requested': len(pairs)}), 400
+    try:
+        days = int(request.args.get('period', '30'))
+    except ValueError:
+        days = 30
+
+    try:
+        sparklines, missing = current_app.manager.get_sparklines(pairs, days)
+        processing_time = time.time() - start_time
+        return jsonify(_with_timing({
+            'period': days,
+            'sparklines': sparklines,
+            'missing': missing,
+            'invalid': invalid,
+            'processing_time': round(processing_time, 3),
+            'processing_time_ms': round(processing_time * 1000, 1)
+        }))
+    except Exception as e:
+        current_app.logger.error(f"生成走勢縮圖時發生錯誤: {e}", exc_info=True)
+        return jsonify({'error': '無法生成走勢縮圖', 'error_type': type(e).__name__}), 500
+
+@bp.route('/api/export')
+def export_rates():
+    """
+    串流匯出多組貨幣對的歷史匯率（CSV / NDJSON / Arrow IPC）。
+    逐組貨幣對、每批 1000 列產生輸出，記憶體用量與匯出的總列數無關。
+    """
+    pairs, invalid = _parse_pair_list(request.args)
+    if not pairs:
+        return jsonify({'error': '請提供 pairs 參數（例如 pairs=TWD-HKD,USD-JPY）', 'invalid': invalid}), 400
+    if len(pairs) > MAX_BULK_PAIRS:
+        return jsonify({'error': f'一次最多匯出 {MAX_BULK_PAIRS} 組貨幣對', 'requested': len(pairs)}), 400
+    try:
+        start_str, end_str = _parse_date_range(request.args)
+    except ValueError as e:
+        return jsonify({'error': f'日期範圍無效: {e}'}), 400
+
+    fmt = request.args.get('format', 'csv').lower()
+    if fmt not in export.available_formats():
+        message = 'Arrow 匯出需要安裝 pyarrow' if fmt == 'arrow' else f'不支援的匯出格式: {fmt}'
+        return jsonify({'error': message, 'formats': export.available_formats()}), 400
+
+    rows = current_app.manager.iter_export_rows(pairs, start_str, end_str)
+    content_type, extension = export.FORMATS[fmt]
+    filename = f"rates_{start_str or 'all'}_{end_str or 'latest'}.{extension}"
+    response = Response(stream_with_context(export.stream_rows(rows, fmt)), content_type=content_type)
+    response.headers['Content-Disposition'] = f'attachment; filename="{filename}"'
+    response.headers['Cache-Control'] = 'no-store'
+    return response
+
 @bp.route('/api/cached_pairs')
 def get_cached_pairs():
     """獲取伺服器快取中的所有貨幣對"""
@@ -229,10 +604,119 @@ def get_cached_pairs():
         current_app.logger.error(f"獲取快取貨幣對列表時發生錯誤: {e}", exc_info=True)
         return jsonify({'error': '無法獲取快取列表'}), 500
 
+@bp.route('/api/jobs')
+def get_jobs():
+    """列出背景排程器中排隊與執行中的任務，以及各貨幣對的關注度"""
+    snapshot = current_app.manager.jobs.snapshot()
+    snapshot['interest'] = current_app.manager.interest.snapshot()
+    return jsonify(snapshot)
+
+@bp.route('/api/watch', methods=['POST'])
+def watch_pair():
+    """SSE 客戶端回報目前查看的貨幣對，讓背景抓取知道仍有人在等"""
+    payload = request.get_json(silent=True) or {}
+    client_id = payload.get('client_id')
+    buy_currency = str(payload.get('buy_currency', '')).upper()
+    sell_currency = str(payload.get('sell_currency', '')).upper()
+    if not client_id or not _is_currency_code(buy_currency) or not _is_currency_code(sell_currency):
+        return jsonify({'success': False, 'message': '需要 client_id 與有效的貨幣代碼'}), 400
+    if not current_app.manager.interest.watch(str(client_id), buy_currency, sell_currency):
+        return jsonify({'success': False, 'message': 'client_id 不是連線中的 SSE 客戶端'}), 404
+    return jsonify({'success': True})
+
+@bp.route('/api/alerts', methods=['GET', 'POST'])
+def alerts():
+    """
+    GET：列出匯率提醒（可用 pairs 篩選）。
+    POST：登記提醒，JSON 參數 buy_currency、sell_currency、direction（above/below）、threshold，
+    可選 repeat（每次重新跨越都觸發）與 note。觸發時發送 SSE 的 rate_alert 事件。
+    """
+    manager = current_app.manager
+    if request.method == 'GET':
+        pairs = None
+        if request.args.get('pairs'):
+            pairs, invalid = _parse_pair_list(request.args)
+            if invalid:
+                return jsonify({'error': '貨幣對格式無效（例如 pairs=TWD-HKD,USD-JPY）', 'invalid': invalid}), 400
+        rules = manager.alerts.list(set(pairs) if pairs is not None else None)
+        return jsonify({'alerts': rules, 'count': len(rules)})
+
+    payload = request.get_json(silent=True) or {}
+    buy_currency = str(payload.get('buy_currency', '')).upper()
+    sell_currency = str(payload.get('sell_currency', '')).upper()
+    direction = str(payload.get('direction', '')).lower()
+    if not _is_currency_code(buy_currency) or not _is_currency_code(sell_currency) or buy_currency == sell_currency:
+        return jsonify({'success': False, 'message': '需要兩個不同的有效貨幣代碼'}), 400
+    if direction not in DIRECTIONS:
+        return jsonify({'success': False, 'message': f"direction 必須是 {' 或 '.join(DIRECTIONS)}"}), 400
+    try:
+        rule = manager.add_alert(buy_currency, sell_currency, direction, payload.get('threshold'),
+                                 repeat=bool(payload.get('repeat')), note=payload.get('note'))
+    except (TypeError, ValueError) as e:
+        return jsonify({'success': False, 'message': f'threshold 無效: {e}'}), 400
+    except OverflowError as e:
+        return jsonify({'success': False, 'message': str(e)}), 409
+    return jsonify({'success': True, 'alert': rule}), 201
+
+@bp.route('/api/alerts/<alert_id>', methods=['DELETE'])
+def delete_alert(alert_id):
+    """刪除匯率提醒"""
+    rule = current_app.manager.alerts.remove(alert_id)
+    if rule is None:
+        return jsonify({'success': False, 'message': '找不到此提醒'}), 404
+    current_app.manager.alerts.save()
+    return jsonify({'success': True, 'alert': rule})
+
+def _profiler_authorized():
+    token = request.headers.get('X-Admin-Token', '')
+    return bool(PROFILER_TOKEN) and hmac.compare_digest(token.encode('utf-8'), PROFILER_TOKEN.encode('utf-8'))
+
+@bp.route('/api/profile', methods=['GET', 'POST'])
+def profile():
+    """
+    GET：取樣器狀態與已輸出的檔案；POST：開始取樣。
+    參數 seconds（預設 30）、interval_ms（預設 10）、include_idle（是否計入閒置等待的堆疊）。
+    """
+    if not _profiler_authorized():
+        return jsonify({'success': False, 'message': '需要有效的 X-Admin-Token（未設定 PROFILER_TOKEN 時取樣器停用）'}), 403
+    if request.method == 'GET':
+        return jsonify({**profiler.status(), 'profiles': profiler.list_profiles()})
+
+    params = {**request.args, **(request.get_json(silent=True) or {})}
+    try:
+        seconds = int(params.get('seconds', 30))
+        interval_ms = int(params.get('interval_ms', DEFAULT_INTERVAL_MS))
+    except (TypeError, ValueError):
+        return jsonify({'success': False, 'message': 'seconds 與 interval_ms 必須是整數'}), 400
+    include_idle = str(params.get('include_idle', '')).lower() in ('1', 'true')
+    try:
+        status = profiler.start(seconds, interval_ms, include_idle)
+    except RuntimeError as e:
+        return jsonify({'success': False, 'message': str(e), **profiler.status()}), 409
+    return jsonify({'success': True, 'profile': status}), 202
+
+@bp.route('/api/profile/<name>')
+def download_profile(name):
+    """下載 folded stack 檔案（可交給 flamegraph.pl 或 speedscope）"""
+    if not _profiler_authorized():
+        return jsonify({'success': False, 'message': '需要有效的 X-Admin-Token（未設定 PROFILER_TOKEN 時取樣器停用）'}), 403
+    if not name.endswith('.folded'):
+        return jsonify({'success': False, 'message': '只能下載 .folded 檔案'}), 400
+    return send_from_directory(os.path.abspath(profiler.output_dir), name, mimetype='text/plain')
+
+@bp.route('/metrics')
+def prometheus_metrics():
+    """Prometheus 文字格式的監控指標"""
+    body = metrics.render(current_app.manager, sse_clients, sse_lock)
+    return Response(body, mimetype=None, content_type=metrics.CONTENT_TYPE)
+
 @bp.route('/api/events')
 def sse_events():
     """SSE事件端點"""
     client_queue = queue.Queue()
+    client_id = uuid.uuid4().hex
+    interest = current_app.manager.interest
+    interest.register(client_id)
 
     with sse_lock:
         sse_clients.append(client_queue)
@@ -240,11 +724,14 @@ def sse_events():
     print(f"[SSE] 新客戶端連接，目前連接數: {len(sse_clients)}")
 
     try:
-        client_queue.put("event: connected\ndata: {\"message\": \"SSE連接已建立\"}\n\n", timeout=1)
+        connected = json.dumps({'message': 'SSE連接已建立', 'client_id': client_id}, ensure_ascii=False)
+        client_queue.put(f"event: connected\ndata: {connected}\n\n", timeout=1)
     except queue.Full:
         pass
 
-    response = Response(sse_stream(client_queue), mimetype='text/event-stream')
+    # 斷線時撤銷該客戶端的關注，無人關注的背景抓取會被取消
+    response = Response(sse_stream(client_queue, on_close=lambda: interest.unwatch(client_id)),
+                        mimetype='text/event-stream')
     response.headers['Cache-Control'] = 'no-cache'
     response.headers['Connection'] = 'keep-alive'
     response.headers['Access-Control-Allow-Origin'] = '*'
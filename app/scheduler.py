@@ -1,11 +1,19 @@
+import os
 import schedule
 import time
 from datetime import datetime
 from threading import Thread
 from .sse import send_sse_event
+from .job_scheduler import WARMUP, BACKFILL
 
 _app = None
 
+# 每日增量刷新的熱門貨幣對數量，以及把刷新工作分散開來的時間窗（秒）
+POPULAR_REFRESH_TOP_N = int(os.environ.get('POPULAR_REFRESH_TOP_N', 8))
+POPULAR_REFRESH_WINDOW_SECONDS = int(os.environ.get('POPULAR_REFRESH_WINDOW', 1800))
+# 啟動時先刷新一次，時間窗較短，讓重啟後的熱門貨幣對也不必走冷路徑
+STARTUP_REFRESH_WINDOW_SECONDS = 300
+
 def scheduled_update():
     """定時更新匯率資料"""
     if not _app:
@@ -23,25 +31,28 @@ def scheduled_update():
                 print(f"[{datetime.now().strftime('%Y-%m-%d %H:%M:%S')}] 今天({today_str})的資料已存在，無需更新")
                 return
 
+            # 依發布日曆，今天不會有新匯率（例如週末）就不打上游
+            if not manager.planner.is_publication_day('TWD', 'HKD', today):
+                print(f"[{datetime.now().strftime('%Y-%m-%d %H:%M:%S')}] 今天({today_str})不是發布日，略過更新")
+                return
+
             # 只獲取今天的資料
             print(f"正在獲取 {today_str} 的匯率資料...")
-            data = manager.get_exchange_rate(today)
+            _, conversion_rate = manager._fetch_single_rate(today, 'TWD', 'HKD')
+            manager.planner.save()
 
-            if data and 'data' in data:
+            if conversion_rate is not None:
                 try:
-                    conversion_rate = float(data['data']['conversionRate'])
-                    manager.data[today_str] = {
-                        'rate': conversion_rate,
-                        'updated': datetime.now().isoformat()
-                    }
-                    manager.save_data()
+                    manager.store_rates('TWD', 'HKD', {today_str: conversion_rate})
                     print(f"[{datetime.now().strftime('%Y-%m-%d %H:%M:%S')}] 定時更新完成，成功獲取今天的匯率: {conversion_rate}")
 
-                    # 預生成所有圖表
-                    manager.warm_up_chart_cache()
+                    # 增量更新各期間圖表：只推進滑動窗口，內容未變的期間不重繪
+                    manager.refresh_period_charts('TWD', 'HKD')
 
                     # 發送SSE事件通知前端更新
                     send_sse_event('rate_updated', {
+                        'buy_currency': 'TWD',
+                        'sell_currency': 'HKD',
                         'date': today_str,
                         'rate': conversion_rate,
                         'updated_time': datetime.now().isoformat(),
@@ -56,12 +67,57 @@ def scheduled_update():
         except Exception as e:
             print(f"[{datetime.now().strftime('%Y-%m-%d %H:%M:%S')}] 定時更新失敗: {str(e)}")
 
+def refresh_popular_pairs(window_seconds=None):
+    """
+    依存取頻率挑出熱門貨幣對（TWD-HKD 另由 scheduled_update 負責），逐一增量刷新。
+    各貨幣對的刷新平均分散在時間窗內，等待期間讓出排程器的工作槽，避免一次用光速率預算。
+    """
+    if not _app:
+        return
+    window_seconds = POPULAR_REFRESH_WINDOW_SECONDS if window_seconds is None else window_seconds
+
+    with _app.app_context():
+        manager = _app.manager
+        pairs = manager.popularity.top(POPULAR_REFRESH_TOP_N, exclude={('TWD', 'HKD')})
+        if not pairs:
+            print(f"[{datetime.now().strftime('%Y-%m-%d %H:%M:%S')}] 尚無熱門貨幣對，略過刷新")
+            return
+
+        interval = window_seconds / len(pairs)
+        print(f"[{datetime.now().strftime('%Y-%m-%d %H:%M:%S')}] 開始刷新 {len(pairs)} 組熱門貨幣對，"
+              f"每組間隔 {interval:.0f} 秒: {', '.join(f'{b}-{s}' for b, s, _ in pairs)}")
+        for index, (buy_currency, sell_currency, score) in enumerate(pairs):
+            if index:
+                with manager.jobs.released():
+                    time.sleep(interval)
+            try:
+                manager.refresh_pair(buy_currency, sell_currency)
+            except Exception as e:
+                print(f"[{datetime.now().strftime('%Y-%m-%d %H:%M:%S')}] 刷新 {buy_currency}-{sell_currency} 失敗: {str(e)}")
+        manager.popularity.save()
+
+def compact_rollups():
+    """每日將超過保留期的日資料折疊為週/月彙總"""
+    if not _app:
+        return
+    with _app.app_context():
+        manager = _app.manager
+        for buy_currency, sell_currency in [('TWD', 'HKD')] + manager.store.pairs():
+            try:
+                manager.compact_pair(buy_currency, sell_currency)
+            except Exception as e:
+                print(f"[{datetime.now().strftime('%Y-%m-%d %H:%M:%S')}] 折疊 {buy_currency}-{sell_currency} 舊數據失敗: {str(e)}")
+
 def clear_cache_with_context():
     """帶上下文清理緩存"""
     if not _app:
         return
     with _app.app_context():
         _app.manager.clear_expired_cache()
+        # 順便把貨幣對熱門度與上游錄製寫回磁碟
+        _app.manager.popularity.save()
+        if _app.manager.archive is not None:
+            _app.manager.archive.save()
 
 def run_scheduler():
     """在背景執行緒中執行定時任務"""
@@ -74,9 +130,20 @@ def init_scheduler(app):
     global _app
     _app = app
     
-    schedule.every().day.at("09:00").do(scheduled_update)
-    schedule.every().hour.do(clear_cache_with_context)
+    # schedule 執行緒只負責按時投遞，實際工作交給統一的背景排程器
+    jobs = app.manager.jobs
+    schedule.every().day.at("09:00").do(jobs.submit, scheduled_update, priority=WARMUP,
+                                        name='scheduled_update', key='scheduled_update')
+    schedule.every().day.at("09:30").do(jobs.submit, refresh_popular_pairs, priority=WARMUP,
+                                        name='refresh_popular_pairs', key='refresh_popular_pairs')
+    schedule.every().day.at("03:00").do(jobs.submit, compact_rollups, priority=BACKFILL,
+                                        name='compact_rollups', key='compact_rollups')
+    schedule.every().hour.do(jobs.submit, clear_cache_with_context, priority=BACKFILL,
+                             name='clear_expired_cache', key='clear_expired_cache')
     
+    jobs.submit(refresh_popular_pairs, STARTUP_REFRESH_WINDOW_SECONDS, priority=WARMUP,
+                name='refresh_popular_pairs', key='refresh_popular_pairs')
+
     scheduler_thread = Thread(target=run_scheduler, daemon=True)
     scheduler_thread.start()
     print("✅ 定時任務已啟動。") 
\ No newline at end of file
@@ -0,0 +1,59 @@
+import os
+
+import numpy as np
+
+# 縮圖尺寸（CSS 像素）與每條折線的點數；點數固定，繪製成本與期間長度無關
+SPARKLINE_WIDTH = 120
+SPARKLINE_HEIGHT = 32
+SPARKLINE_POINTS = int(os.environ.get('SPARKLINE_POINTS', 48))
+SPARKLINE_PADDING = 2
+
+# 單次請求最多幾組貨幣對
+MAX_SPARKLINE_PAIRS = 50
+
+STROKE_COLOR = '#2E86AB'
+
+
+def resample_matrix(series_list, points=SPARKLINE_POINTS):
+    """
+    把多條長度不同的序列一次重採樣為 (條數, points) 的矩陣，再逐列正規化到 [0, 1]。
+    所有序列先串接成一維陣列，各列的取樣位置換算為全域的小數索引後一起線性內插，
+    不需逐條呼叫 np.interp。每條序列至少需要 2 點。
+    """
+    lengths = np.fromiter((len(s) for s in series_list), dtype=np.int64, count=len(series_list))
+    flat = np.concatenate([np.asarray(s, dtype=np.float64) for s in series_list])
+    offsets = np.concatenate(([0], np.cumsum(lengths)[:-1]))
+
+    # 每列在自己的序列內均勻取 points 個位置，再加上該序列在串接陣列中的起點
+    steps = np.linspace(0.0, 1.0, points)
+    positions = offsets[:, None] + steps[None, :] * (lengths[:, None] - 1)
+    lower = np.floor(positions).astype(np.int64)
+    upper = np.minimum(lower + 1, (offsets + lengths - 1)[:, None])
+    weight = positions - lower
+    values = flat[lower] * (1 - weight) + flat[upper] * weight
+
+    low = values.min(axis=1, keepdims=True)
+    span = values.max(axis=1, keepdims=True) - low
+    # 完全持平的序列畫在中線
+    normalized = np.where(span > 0, (values - low) / np.where(span > 0, span, 1), 0.5)
+    return normalized
+
+
+def render_sparklines(series_list, width=SPARKLINE_WIDTH, height=SPARKLINE_HEIGHT, points=SPARKLINE_POINTS):
+    """返回與 series_list 對應的內嵌 SVG 字串列表（座標一次算完，只有輸出字串時逐列處理）"""
+    if not series_list:
+        return []
+    normalized = resample_matrix(series_list, points)
+    xs = np.linspace(SPARKLINE_PADDING, width - SPARKLINE_PADDING, points)
+    ys = SPARKLINE_PADDING + (1 - normalized) * (height - 2 * SPARKLINE_PADDING)
+
+    x_text = [f"{x:.1f}" for x in xs]
+    svgs = []
+    for row in np.round(ys, 1):
+        coords = ' '.join(f"{x},{y:g}" for x, y in zip(x_text, row))
+        svgs.append(
+            f'<svg xmlns="http://www.w3.org/2000/svg" width="{width}" height="{height}" viewBox="0 0 {width} {height}">'
+            f'<polyline fill="none" stroke="{STROKE_COLOR}" stroke-width="1.5" stroke-linejoin="round" points="{coords}"/>'
+            f'</svg>'
+        )
+    return svgs
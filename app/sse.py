@@ -19,8 +19,8 @@ def send_sse_event(event_type, data):
                 # 雖然理論上不會發生，但作為預防措施
                 print(f"[SSE] 警告：客戶端隊列已滿，訊息可能遺失。")
 
-def sse_stream(client_queue):
-    """SSE數據流生成器"""
+def sse_stream(client_queue, on_close=None):
+    """SSE數據流生成器；on_close 會在客戶端斷線後呼叫"""
     try:
         while True:
             try:
@@ -40,4 +40,6 @@ def sse_stream(client_queue):
                 print(f"[SSE] 客戶端已清除，剩餘連接數: {len(sse_clients)}")
             except ValueError:
                 # 如果隊列因為某些原因已經被移除，忽略錯誤
-                pass 
\ No newline at end of file
+                pass
+        if on_close:
+            on_close() 
\ No newline at end of file
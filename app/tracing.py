@@ -0,0 +1,121 @@
+import time
+from contextlib import contextmanager
+from functools import wraps
+from threading import Lock, local
+
+_local = local()
+
+
+class Trace:
+    def __init__(self):
+        """
+        單一請求的耗時分解：同名 span 累加時間與次數。
+        巢狀 span 的時間互相包含（例如 get_current_rate 包含 get_exchange_rate）。
+        """
+        self.started = time.perf_counter()
+        self.lock = Lock()
+        self.closed = False
+        self._spans = {}  # name -> [總秒數, 次數]，dict 保留首次出現的順序
+
+    def add(self, name, seconds):
+        with self.lock:
+            if self.closed:
+                return  # 請求已回應，背景任務後續的 span 不再記錄
+            span = self._spans.get(name)
+            if span is None:
+                self._spans[name] = [seconds, 1]
+            else:
+                span[0] += seconds
+                span[1] += 1
+
+    def close(self):
+        with self.lock:
+            self.closed = True
+        return time.perf_counter() - self.started
+
+    def breakdown(self):
+        """返回 [{'name', 'duration_ms', 'count'}]（用於除錯欄位）"""
+        with self.lock:
+            spans = list(self._spans.items())
+        return [{'name': name, 'duration_ms': round(seconds * 1000, 2), 'count': count}
+                for name, (seconds, count) in spans]
+
+    def server_timing(self, total_seconds=None):
+        """產生 Server-Timing 標頭值"""
+        with self.lock:
+            spans = list(self._spans.items())
+        parts = [f"{_token(name)};dur={seconds * 1000:.2f}" + (f';desc="x{count}"' if count > 1 else '')
+                 for name, (seconds, count) in spans]
+        if total_seconds is not None:
+            parts.append(f"total;dur={total_seconds * 1000:.2f}")
+        return ', '.join(parts)
+
+
+def _token(name):
+    """Server-Timing 的 metric 名稱只能是 token 字元"""
+    return ''.join(ch if ch.isalnum() or ch in '-_.' else '_' for ch in name)
+
+
+def current():
+    """目前執行緒所屬的 Trace（沒有時為 None）"""
+    return getattr(_local, 'trace', None)
+
+
+def start():
+    """為目前執行緒（請求）建立新的 Trace"""
+    trace = Trace()
+    _local.trace = trace
+    return trace
+
+
+def finish():
+    """結束目前執行緒的 Trace，返回 (trace, 總秒數)"""
+    trace = current()
+    _local.trace = None
+    if trace is None:
+        return None, None
+    return trace, trace.close()
+
+
+@contextmanager
+def attached(trace):
+    """在其他執行緒（例如排程任務）中沿用請求的 Trace"""
+    previous = current()
+    _local.trace = trace
+    try:
+        yield
+    finally:
+        _local.trace = previous
+
+
+@contextmanager
+def span(name):
+    """記錄 with 區塊的耗時；沒有 Trace 時幾乎沒有成本"""
+    trace = current()
+    if trace is None:
+        yield
+        return
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        trace.add(name, time.perf_counter() - started)
+
+
+def traced(name=None):
+    """將函數的耗時記為 span 的裝飾器"""
+    def decorator(fn):
+        span_name = name or fn.__name__
+
+        @wraps(fn)
+        def wrapper(*args, **kwargs):
+            trace = current()
+            if trace is None:
+                return fn(*args, **kwargs)
+            started = time.perf_counter()
+            try:
+                return fn(*args, **kwargs)
+            finally:
+                trace.add(span_name, time.perf_counter() - started)
+        return wrapper
+    return decorator
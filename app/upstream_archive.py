@@ -0,0 +1,149 @@
+import os
+import gzip
+import json
+import time
+import atexit
+from datetime import datetime
+from threading import Lock
+
+from .utils import temp_path
+
+# 上游模式：live（預設，直接連線）、record（連線並錄製）、replay（只從錄製檔回放，不連網）
+UPSTREAM_MODE = os.environ.get('RATE_UPSTREAM_MODE', 'live').lower()
+
+# 錄製檔位置
+FIXTURE_FILE = os.environ.get('RATE_UPSTREAM_FIXTURE', os.path.join('data', 'upstream_fixture.json.gz'))
+
+# 回放時按錄製延遲的倍數等待（0 表示不等待，1 表示重現錄製時的延遲）
+REPLAY_LATENCY_SCALE = float(os.environ.get('RATE_REPLAY_LATENCY', 0))
+
+# 錄製時每累積多少筆新記錄就落盤一次（結束時也會落盤）
+SAVE_EVERY = 50
+
+MODES = ('live', 'record', 'replay')
+
+
+class UpstreamArchive:
+    def __init__(self, path=FIXTURE_FILE, mode='record', latency_scale=REPLAY_LATENCY_SCALE):
+        """
+        上游請求的錄製與回放。
+        錄製檔只保留每個 (貨幣對, 日期) 的匯率與延遲：
+        {"pairs": {"TWD-HKD": {"2025-01-02": [匯率或 null, 延遲毫秒]}}}，以 gzip 壓縮。
+        null 代表上游確認當天沒有發布；網路錯誤不錄製，回放時也不會重現。
+        """
+        if mode not in ('record', 'replay'):
+            raise ValueError(f"未知的上游模式: {mode}")
+        self.path = path
+        self.mode = mode
+        self.latency_scale = latency_scale
+        self.lock = Lock()
+        self._pairs = {}
+        self._unsaved = 0
+        self._stats = {'recorded': 0, 'replayed': 0, 'missed': 0}
+        self._missed_pairs = set()
+        self._load()
+        if mode == 'record':
+            atexit.register(self.save)
+
+    @classmethod
+    def from_env(cls):
+        """依環境變數建立；live 模式返回 None"""
+        if UPSTREAM_MODE not in MODES:
+            print(f"⚠️ 未知的 RATE_UPSTREAM_MODE={UPSTREAM_MODE}，改用 live")
+            return None
+        if UPSTREAM_MODE == 'live':
+            return None
+        archive = cls(FIXTURE_FILE, UPSTREAM_MODE)
+        print(f"📼 上游{'回放' if archive.replaying else '錄製'}模式: {archive.path}（{archive.size()} 筆）")
+        return archive
+
+    @property
+    def replaying(self):
+        return self.mode == 'replay'
+
+    def _load(self):
+        if not os.path.exists(self.path):
+            if self.replaying:
+                print(f"⚠️ 找不到錄製檔 {self.path}，回放模式下所有上游請求都會失敗")
+            return
+        try:
+            with gzip.open(self.path, 'rt', encoding='utf-8') as f:
+                state = json.load(f)
+            self._pairs = state.get('pairs', {})
+        except (OSError, json.JSONDecodeError) as e:
+            print(f"載入上游錄製檔時發生錯誤: {e}")
+
+    def save(self):
+        """有新記錄時才落盤（寫入暫存檔後替換）"""
+        with self.lock:
+            if not self._unsaved:
+                return
+            state = {
+                'version': 1,
+                'recorded_at': datetime.now().isoformat(timespec='seconds'),
+                'pairs': {pair: dict(sorted(dates.items())) for pair, dates in sorted(self._pairs.items())},
+            }
+            self._unsaved = 0
+        os.makedirs(os.path.dirname(self.path) or '.', exist_ok=True)
+        tmp_path = temp_path(self.path)
+        with gzip.open(tmp_path, 'wt', encoding='utf-8') as f:
+            json.dump(state, f, separators=(',', ':'))
+        os.replace(tmp_path, self.path)
+
+    def record(self, buy_currency, sell_currency, date_str, data, latency_seconds):
+        """錄製一次成功的上游回應（含「當天沒有發布」）"""
+        rate = None
+        if isinstance(data, dict) and isinstance(data.get('data'), dict):
+            try:
+                rate = float(data['data']['conversionRate'])
+            except (KeyError, TypeError, ValueError):
+                rate = None
+        with self.lock:
+            self._pairs.setdefault(f"{buy_currency}-{sell_currency}", {})[date_str] = [rate, round(latency_seconds * 1000, 1)]
+            self._stats['recorded'] += 1
+            self._unsaved += 1
+            should_save = self._unsaved >= SAVE_EVERY
+        if should_save:
+            self.save()
+
+    def replay(self, buy_currency, sell_currency, date_str):
+        """
+        以錄製結果模擬 get_exchange_rate 的返回值。
+        有匯率時返回含 data.conversionRate 的 dict，沒有發布時返回不含 data 的 dict，沒錄到則返回 None（同網路失敗）。
+        """
+        pair_key = f"{buy_currency}-{sell_currency}"
+        with self.lock:
+            entry = self._pairs.get(pair_key, {}).get(date_str)
+            if entry is None:
+                self._stats['missed'] += 1
+                first_miss = pair_key not in self._missed_pairs
+                self._missed_pairs.add(pair_key)
+            else:
+                self._stats['replayed'] += 1
+        if entry is None:
+            if first_miss:
+                print(f"📼 錄製檔中沒有 {pair_key} {date_str}，回放模式下視為上游失敗（同貨幣對不再提示）")
+            return None
+
+        rate, latency_ms = entry
+        if self.latency_scale and latency_ms:
+            time.sleep(latency_ms / 1000 * self.latency_scale)
+        if rate is None:
+            return {'type': 'error', 'errorMessage': 'Rate not available (replayed)'}
+        return {'data': {'conversionRate': rate, 'fxDate': date_str,
+                         'transCurr': buy_currency, 'crdhldBillCurr': sell_currency}}
+
+    def size(self):
+        with self.lock:
+            return sum(len(dates) for dates in self._pairs.values())
+
+    def get_stats(self):
+        with self.lock:
+            return {
+                'mode': self.mode,
+                'path': self.path,
+                'pairs': len(self._pairs),
+                'entries': sum(len(dates) for dates in self._pairs.values()),
+                'latency_scale': self.latency_scale,
+                **self._stats,
+            }
@@ -1,4 +1,7 @@
+import os
+import json
 import time
+import threading
 from threading import Lock
 
 # LRU Cache 類別
@@ -177,6 +180,12 @@ class RateLimiter:
         self.last_request_time = 0
         self.lock = Lock()
 
+    def set_rate(self, max_requests_per_second):
+        """調整每秒最大請求數（例如離峰回填時放寬或收緊速率預算）"""
+        with self.lock:
+            self.max_requests_per_second = max_requests_per_second
+            self.min_interval = 1.0 / max_requests_per_second
+
     def wait_if_needed(self):
         """如果需要的話，等待以符合速率限制"""
         with self.lock:
@@ -187,4 +196,23 @@ class RateLimiter:
                 sleep_time = self.min_interval - time_since_last
                 time.sleep(sleep_time)
 
-            self.last_request_time = time.time() 
\ No newline at end of file
+            self.last_request_time = time.time()
+
+
+# 原子寫檔
+def temp_path(path):
+    """與目標同目錄的暫存檔名，帶行程與執行緒編號，多個行程或執行緒同時保存同一檔案時不會互相覆蓋"""
+    return f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+
+
+def atomic_write_json(path, state, **dump_kwargs):
+    """先寫暫存檔再 os.replace，讀取端不會看到寫到一半的檔案；寫入失敗時移除暫存檔"""
+    tmp_path = temp_path(path)
+    try:
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(state, f, **dump_kwargs)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+    os.replace(tmp_path, path)
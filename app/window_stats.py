@@ -0,0 +1,116 @@
+import hashlib
+from collections import deque
+
+# 累計加減多少次後重新精確求和，避免浮點誤差累積
+RESYNC_EVERY = 512
+
+_HASH_MASK = (1 << 64) - 1
+
+
+def entry_hash(date_str, rate, band=None):
+    """單一數據點的 64 位元雜湊"""
+    text = f"{date_str}|{rate!r}" if band is None else f"{date_str}|{rate!r}|{band[0]!r}|{band[1]!r}"
+    return int.from_bytes(hashlib.blake2b(text.encode('utf-8'), digest_size=8).digest(), 'big')
+
+
+def series_hash(dates_str, rates, bands=None):
+    """
+    序列的內容雜湊：各數據點雜湊的 XOR。
+    與 SlidingWindowStats 增量維護的結果一致，加入或移除一點都只需一次 XOR。
+    """
+    value = 0
+    for i, date_str in enumerate(dates_str):
+        value ^= entry_hash(date_str, rates[i], bands[i] if bands else None)
+    return f"{value & _HASH_MASK:016x}"
+
+
+class SlidingWindowStats:
+    def __init__(self, dates_str=(), rates=()):
+        """
+        固定期間的滑動窗口：日期只會從尾端加入、從頭端移出。
+        總和、最大/最小值（單調佇列）與內容雜湊都以均攤 O(1) 更新，
+        並記錄自上次 take_delta() 以來加入與移出的數據點。
+        """
+        self._points = deque()
+        self._max = deque()  # 單調遞減，隊首為目前最大值
+        self._min = deque()  # 單調遞增，隊首為目前最小值
+        self._sum = 0.0
+        self._hash = 0
+        self._ops = 0
+        self._appended = []
+        self._removed = []
+        for date_str, rate in zip(dates_str, rates):
+            self.append(date_str, rate)
+        self.take_delta()
+
+    def __len__(self):
+        return len(self._points)
+
+    @property
+    def last_date(self):
+        return self._points[-1][0] if self._points else None
+
+    def append(self, date_str, rate):
+        """在尾端加入新的一天，日期必須晚於目前最後一天"""
+        if self._points and date_str <= self._points[-1][0]:
+            raise ValueError(f"{date_str} 不晚於窗口最後一天 {self._points[-1][0]}")
+        point = (date_str, rate)
+        self._points.append(point)
+        while self._max and self._max[-1][1] <= rate:
+            self._max.pop()
+        self._max.append(point)
+        while self._min and self._min[-1][1] >= rate:
+            self._min.pop()
+        self._min.append(point)
+        self._sum += rate
+        self._hash ^= entry_hash(date_str, rate)
+        self._appended.append(point)
+        self._count_op()
+
+    def evict_before(self, start_str):
+        """移出早於 start_str 的數據點，返回移出的筆數"""
+        evicted = 0
+        while self._points and self._points[0][0] < start_str:
+            point = self._points.popleft()
+            if self._max and self._max[0] is point:
+                self._max.popleft()
+            if self._min and self._min[0] is point:
+                self._min.popleft()
+            self._sum -= point[1]
+            self._hash ^= entry_hash(*point)
+            self._removed.append(point)
+            self._count_op()
+            evicted += 1
+        return evicted
+
+    def _count_op(self):
+        self._ops += 1
+        if self._ops >= RESYNC_EVERY:
+            self._sum = sum(rate for _, rate in self._points)
+            self._ops = 0
+
+    @property
+    def content_hash(self):
+        return f"{self._hash & _HASH_MASK:016x}"
+
+    def series(self):
+        """返回 (dates_str, rates) 列表（用於繪圖）"""
+        return [d for d, _ in self._points], [r for _, r in self._points]
+
+    def stats(self):
+        """與 ExchangeRateManager._calculate_stats 相同格式的統計數據"""
+        if not self._points:
+            return None
+        return {
+            'max_rate': self._max[0][1],
+            'min_rate': self._min[0][1],
+            'avg_rate': self._sum / len(self._points),
+            'data_points': len(self._points),
+            'date_range': f"{self._points[0][0]} 至 {self._points[-1][0]}"
+        }
+
+    def take_delta(self):
+        """取出並清空自上次呼叫以來加入與移出的數據點"""
+        appended, removed = self._appended, self._removed
+        self._appended, self._removed = [], []
+        return appended, removed
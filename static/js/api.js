@@ -1,9 +1,152 @@
 // static/js/api.js
+
+// 圖表寬度以 300px 為級距向上取整，讓相近螢幕共用同一份伺服器快取；最寬與預設圖表相同
+const CHART_WIDTH_STEP = 300;
+const CHART_MAX_WIDTH = 1500;
+
+const supportsWebp = (() => {
+  try {
+    return document.createElement('canvas').toDataURL('image/webp').startsWith('data:image/webp');
+  } catch (e) {
+    return false;
+  }
+})();
+
+// 依圖表容器的實際像素寬度與瀏覽器支援的格式，決定要向伺服器要求的圖表變體
+export function chartVariantParams() {
+  const container = document.getElementById('chart-container');
+  const cssWidth = (container && container.clientWidth) || window.innerWidth;
+  const pixels = cssWidth * (window.devicePixelRatio || 1);
+  const width = Math.min(CHART_MAX_WIDTH, Math.ceil(pixels / CHART_WIDTH_STEP) * CHART_WIDTH_STEP);
+  return { format: supportsWebp ? 'webp' : 'png', width };
+}
+
+// --- 圖表回應的持久快取（IndexedDB） ---
+// 以 貨幣對/期間/圖表變體 為鍵保存 /api/chart 的回應與 ETag。
+// 新鮮期內直接使用、不發請求；過期或被 SSE 事件標記為過時後，帶 If-None-Match 向伺服器確認，
+// 內容未變時伺服器回 304，只需一個很小的往返。
+const CHART_DB_NAME = 'fx-chart-cache';
+const CHART_STORE = 'charts';
+const CHART_FRESH_MS = 10 * 60 * 1000;
+const CHART_KEEP_MS = 7 * 24 * 60 * 60 * 1000;
+
+let chartDbPromise = null;
+const memoryChartCache = new Map(); // IndexedDB 不可用（例如隱私模式）時的退路
+
+function requestToPromise(request) {
+  return new Promise((resolve, reject) => {
+    request.onsuccess = () => resolve(request.result);
+    request.onerror = () => reject(request.error);
+  });
+}
+
+function openChartDb() {
+  if (!chartDbPromise) {
+    chartDbPromise = new Promise((resolve) => {
+      if (!window.indexedDB) return resolve(null);
+      const request = indexedDB.open(CHART_DB_NAME, 1);
+      request.onupgradeneeded = () => {
+        const store = request.result.createObjectStore(CHART_STORE, { keyPath: 'key' });
+        store.createIndex('pair', 'pair');
+      };
+      request.onsuccess = () => {
+        const db = request.result;
+        pruneChartDb(db);
+        resolve(db);
+      };
+      request.onerror = () => {
+        console.warn('無法開啟圖表快取資料庫，改用記憶體快取:', request.error);
+        resolve(null);
+      };
+    });
+  }
+  return chartDbPromise;
+}
+
+// 清掉太久沒用到的項目，避免資料庫無限成長
+function pruneChartDb(db) {
+  const store = db.transaction(CHART_STORE, 'readwrite').objectStore(CHART_STORE);
+  store.openCursor().onsuccess = (event) => {
+    const cursor = event.target.result;
+    if (!cursor) return;
+    if (Date.now() - cursor.value.savedAt > CHART_KEEP_MS) cursor.delete();
+    cursor.continue();
+  };
+}
+
+async function readChartEntry(key) {
+  const db = await openChartDb();
+  if (!db) return memoryChartCache.get(key) || null;
+  try {
+    const store = db.transaction(CHART_STORE, 'readonly').objectStore(CHART_STORE);
+    return (await requestToPromise(store.get(key))) || null;
+  } catch (e) {
+    return memoryChartCache.get(key) || null;
+  }
+}
+
+async function writeChartEntry(entry) {
+  memoryChartCache.set(entry.key, entry);
+  const db = await openChartDb();
+  if (!db) return;
+  try {
+    const store = db.transaction(CHART_STORE, 'readwrite').objectStore(CHART_STORE);
+    await requestToPromise(store.put(entry));
+  } catch (e) {
+    console.warn('寫入圖表快取失敗:', e);
+  }
+}
+
+/**
+ * 把快取中的圖表標記為過時（保留 ETag，下次請求仍可得到 304）。
+ * 省略 period 時標記整個貨幣對，連貨幣對都省略時標記全部（例如 SSE 重新連線後可能漏收事件）。
+ */
+export async function invalidateChartCache(fromCurrency = null, toCurrency = null, period = null) {
+  const pair = fromCurrency && toCurrency ? `${fromCurrency}-${toCurrency}` : null;
+  const matches = (entry) =>
+    (!pair || entry.pair === pair) && (period == null || String(entry.period) === String(period));
+
+  memoryChartCache.forEach(entry => {
+    if (matches(entry)) entry.stale = true;
+  });
+  const db = await openChartDb();
+  if (!db) return;
+  const store = db.transaction(CHART_STORE, 'readwrite').objectStore(CHART_STORE);
+  const request = pair ? store.index('pair').openCursor(IDBKeyRange.only(pair)) : store.openCursor();
+  request.onsuccess = (event) => {
+    const cursor = event.target.result;
+    if (!cursor) return;
+    if (matches(cursor.value) && !cursor.value.stale) cursor.update({ ...cursor.value, stale: true });
+    cursor.continue();
+  };
+}
+
 export async function fetchChart(period, fromCurrency = 'TWD', toCurrency = 'HKD', forceLive = false) {
-  const params = new URLSearchParams({ period, buy_currency: fromCurrency, sell_currency: toCurrency, force_live: forceLive });
-  const res = await fetch(`/api/chart?${params}`);
+  const variant = chartVariantParams();
+  const key = `${fromCurrency}-${toCurrency}_${period}_${variant.format}-${variant.width}`;
+  const cached = await readChartEntry(key);
+  if (cached && !cached.stale && !forceLive && Date.now() - cached.savedAt < CHART_FRESH_MS) {
+    return cached.data;
+  }
+
+  const params = new URLSearchParams({
+    period, buy_currency: fromCurrency, sell_currency: toCurrency, force_live: forceLive, ...variant
+  });
+  const headers = cached && cached.etag ? { 'If-None-Match': cached.etag } : {};
+  const res = await fetch(`/api/chart?${params}`, { headers });
+  if (res.status === 304 && cached) {
+    await writeChartEntry({ ...cached, stale: false, savedAt: Date.now() });
+    return cached.data;
+  }
   if (!res.ok) throw new Error('圖表載入失敗');
-  return await res.json();
+  const data = await res.json();
+  const etag = res.headers.get('ETag');
+  if (data.chart_url && etag) {
+    await writeChartEntry({
+      key, pair: `${fromCurrency}-${toCurrency}`, period: String(period), etag, data, stale: false, savedAt: Date.now()
+    });
+  }
+  return data;
 }
 
 export async function loadLatestRate(fromCurrency = 'TWD', toCurrency = 'HKD') {
@@ -20,8 +163,38 @@ export function triggerPregeneration(fromCurrency = 'TWD', toCurrency = 'HKD') {
     .catch(error => console.error('❌ 預生成錯誤:', error));
 }
 
+// 一次取得多組貨幣對的走勢縮圖（內嵌 SVG），伺服器單次最多 50 組
+const MAX_SPARKLINE_PAIRS = 50;
+
+export async function fetchSparklines(pairs, period = 30) {
+  const params = new URLSearchParams({
+    pairs: pairs.slice(0, MAX_SPARKLINE_PAIRS).map(pair => `${pair.buy_currency}-${pair.sell_currency}`).join(','),
+    period
+  });
+  const res = await fetch(`/api/sparklines?${params}`);
+  if (!res.ok) throw new Error('走勢縮圖載入失敗');
+  return await res.json();
+}
+
 export async function fetchCachedPairs() {
   const res = await fetch('/api/cached_pairs');
   if (!res.ok) throw new Error('獲取快取記錄失敗');
   return await res.json();
-} 
\ No newline at end of file
+} 
+
+// SSE 連線的識別碼，由 'connected' 事件提供
+let sseClientId = null;
+
+export function setSseClientId(clientId) {
+  sseClientId = clientId;
+}
+
+// 告訴伺服器目前查看的貨幣對；離開的貨幣對若已無人關注，其背景抓取會被取消
+export function watchPair(fromCurrency, toCurrency) {
+  if (!sseClientId) return;
+  fetch('/api/watch', {
+    method: 'POST',
+    headers: { 'Content-Type': 'application/json' },
+    body: JSON.stringify({ client_id: sseClientId, buy_currency: fromCurrency, sell_currency: toCurrency })
+  }).catch(error => console.warn('回報查看中的貨幣對失敗:', error));
+}
@@ -143,6 +143,10 @@ class CurrencyManager {
       const period = this.deps.currentPeriod ? this.deps.currentPeriod() : 7;
       const cacheKey = `${fromCurrency}_${toCurrency}_${period}`;
 
+      // 回報目前查看的貨幣對，讓伺服器可以取消已離開貨幣對的背景抓取
+      if (this.deps.watchPair) {
+        this.deps.watchPair(fromCurrency, toCurrency);
+      }
 
       // 步驟 1: 檢查前端短期快取
       if (this.deps.chartCache && this.deps.chartCache[cacheKey]) {
@@ -177,9 +181,8 @@ class CurrencyManager {
 
       // 先嘗試直接獲取圖表，如果失敗則使用預生成模式
       try {
-        const chartResponse = await fetch(`/api/chart?period=${period}&buy_currency=${fromCurrency}&sell_currency=${toCurrency}`);
-        if (chartResponse.ok) {
-          const chartData = await chartResponse.json();
+        const chartData = await this.deps.fetchChart(period, fromCurrency, toCurrency).catch(() => null);
+        if (chartData) {
           if (chartData.chart_url) {
             // 直接渲染圖表
             if (this.deps.renderChart) {
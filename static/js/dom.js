@@ -207,18 +207,33 @@ export function hideGlobalProgressBar(callback) {
   }, 500); // 延遲 500ms 隱藏
 }
 
+// 貨幣列表優先使用頁面內嵌的資料，沒有時再向伺服器取得（帶指紋的網址可長期快取）
+async function loadCurrencyList() {
+  const inline = document.getElementById('currency-list-data');
+  if (inline) {
+    try {
+      return JSON.parse(inline.textContent);
+    } catch (e) {
+      console.warn('內嵌的貨幣列表無法解析，改為向伺服器取得:', e);
+    }
+  }
+  const mainScript = document.getElementById('main-script');
+  const url = (mainScript && mainScript.dataset.currencyList) || '/static/currency_list.json';
+  const response = await fetch(url);
+  if (!response.ok) {
+    throw new Error(`無法載入貨幣列表：${response.statusText}`);
+  }
+  return await response.json();
+}
+
 /**
- * 從 JSON 檔案載入貨幣並填充到指定的 <select> 元素中。
+ * 載入貨幣列表並填充到指定的 <select> 元素中。
  * @param {string} fromCurrencyId - 'from' 貨幣選擇器的 ID。
  * @param {string} toCurrencyId - 'to' 貨幣選擇器的 ID。
  */
 export async function populateCurrencySelectors(fromCurrencyId, toCurrencyId) {
   try {
-    const response = await fetch('/static/currency_list.json');
-    if (!response.ok) {
-      throw new Error(`無法載入貨幣列表：${response.statusText}`);
-    }
-    const currencies = await response.json();
+    const currencies = await loadCurrencyList();
 
     const fromSelect = document.getElementById(fromCurrencyId);
     const toSelect = document.getElementById(toCurrencyId);
@@ -348,9 +363,28 @@ export function renderHistoryList(pairs, type) {
 
   listEl.innerHTML = pairs.map(pair => `
     <div class="history-item" data-buy-currency="${pair.buy_currency}" data-sell-currency="${pair.sell_currency}">
-      <span>${pair.buy_currency}</span>
-      <span class="history-arrow">→</span>
-      <span>${pair.sell_currency}</span>
+      <span class="history-pair">
+        <span>${pair.buy_currency}</span>
+        <span class="history-arrow">→</span>
+        <span>${pair.sell_currency}</span>
+      </span>
+      <span class="history-spark" data-pair="${pair.buy_currency}-${pair.sell_currency}"></span>
     </div>
   `).join('');
+}
+
+// 把批次取得的走勢縮圖填入歷史清單（沒有數據的貨幣對保持空白）
+export function renderSparklines(data) {
+  const listEl = document.getElementById('history-list');
+  if (!listEl || !data || !data.sparklines) return;
+
+  listEl.querySelectorAll('.history-spark').forEach(el => {
+    const sparkline = data.sparklines[el.dataset.pair];
+    if (!sparkline) return;
+    const change = sparkline.change_pct;
+    const changeText = change == null ? '' : `${change > 0 ? '+' : ''}${change.toFixed(2)}%`;
+    const changeClass = change > 0 ? 'up' : change < 0 ? 'down' : '';
+    el.innerHTML = `${sparkline.svg}<span class="history-change ${changeClass}">${changeText}</span>`;
+    el.title = `${sparkline.start_date} ~ ${sparkline.end_date}`;
+  });
 }
\ No newline at end of file
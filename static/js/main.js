@@ -1,4 +1,4 @@
-import { fetchChart, loadLatestRate, triggerPregeneration, fetchCachedPairs } from './api.js';
+import { fetchChart, invalidateChartCache, loadLatestRate, triggerPregeneration, fetchCachedPairs, fetchSparklines, setSseClientId, watchPair } from './api.js';
 import { 
   displayLatestRate, 
   showRateError, 
@@ -15,7 +15,8 @@ import {
   handleChartError,
   openHistoryPopup,
   closeHistoryPopup,
-  renderHistoryList
+  renderHistoryList,
+  renderSparklines
 } from './dom.js';
 import { CurrencyManager } from './currency_manager.js';
 import { userHistoryManager } from './history_manager.js';
@@ -41,7 +42,9 @@ const currencyManager = new CurrencyManager({
   updateCurrencyDisplay,
   loadLatestRate,
   handleChartError,
-  triggerPregeneration
+  triggerPregeneration,
+  watchPair,
+  fetchChart
 });
 
 // 頁面載入時自動載入圖表和最新匯率
@@ -348,6 +351,17 @@ function setupSSEConnection() {
 
   eventSource = new EventSource('/api/events');
 
+  // 連線建立後取得客戶端識別碼，並回報目前查看的貨幣對
+  eventSource.addEventListener('connected', (event) => {
+    const data = JSON.parse(event.data);
+    // 斷線期間可能漏收更新事件，持久快取全部改為下次使用前向伺服器確認
+    invalidateChartCache();
+    if (data.client_id) {
+      setSseClientId(data.client_id);
+      watchPair(currencyManager.currentFromCurrency, currencyManager.currentToCurrency);
+    }
+  });
+
   // 新增：正確監聽 'progress_update' 命名事件
   eventSource.addEventListener('progress_update', function(event) {
     const data = JSON.parse(event.data);
@@ -369,9 +383,16 @@ function setupSSEConnection() {
     }
   });
   
+  // 監聽 'rate_updated' 事件：有新匯率，該貨幣對的持久快取改為過時
+  eventSource.addEventListener('rate_updated', (event) => {
+    const data = JSON.parse(event.data);
+    invalidateChartCache(data.buy_currency, data.sell_currency);
+  });
+
   // 監聽 'chart_ready' 事件
-  eventSource.addEventListener('chart_ready', (event) => {
+  eventSource.addEventListener('chart_ready', async (event) => {
     const chartData = JSON.parse(event.data);
+    await invalidateChartCache(chartData.buy_currency, chartData.sell_currency, chartData.period);
 
     if (
       chartData.buy_currency === currencyManager.currentFromCurrency &&
@@ -396,6 +417,7 @@ function setupSSEConnection() {
           updateDateRange(chartData.stats.date_range);
           // 一旦圖表準備就緒，設定載入狀態為 false
           currencyManager.setLoading('chart', false);
+          showChartVariant(chartData);
         });
       }
     }
@@ -420,11 +442,69 @@ function setupSSEConnection() {
     }
   });
 
+  // 監聽 'chart_delta' 事件：伺服器只推進了滑動窗口，直接套用新的圖表與統計，不必重新請求
+  eventSource.addEventListener('chart_delta', async (event) => {
+    const delta = JSON.parse(event.data);
+    await invalidateChartCache(delta.buy_currency, delta.sell_currency, delta.period);
+    const cacheKey = `${delta.buy_currency}_${delta.sell_currency}_${delta.period}`;
+    chartCache[cacheKey] = {
+      ...(chartCache[cacheKey] || {}),
+      chart_url: delta.chart_url,
+      stats: delta.stats,
+      content_hash: delta.content_hash
+    };
+
+    if (
+      delta.buy_currency === currencyManager.currentFromCurrency &&
+      delta.sell_currency === currencyManager.currentToCurrency &&
+      String(delta.period) === String(currentPeriod)
+    ) {
+      renderChart(delta.chart_url, delta.stats, delta.buy_currency, delta.sell_currency, delta.period);
+      updateDateRange(delta.stats.date_range);
+      showChartVariant(delta);
+    }
+  });
+
+  // 監聽 'rate_alert' 事件：登記的匯率提醒被觸發
+  eventSource.addEventListener('rate_alert', (event) => {
+    const alert = JSON.parse(event.data);
+    showAlertNotification(alert);
+  });
+
+  // 監聽 'fetch_cancelled' 事件：伺服器認為此貨幣對已無人關注而停止抓取
+  eventSource.addEventListener('fetch_cancelled', function(event) {
+    const data = JSON.parse(event.data);
+    // 若其實仍在查看且圖表尚未載入完成，重新觸發（已抓取的日期不會重抓）
+    if (data.buy_currency === currencyManager.currentFromCurrency && data.sell_currency === currencyManager.currentToCurrency
+        && currencyManager.isChartLoading()) {
+      currencyManager.loadChart();
+    }
+  });
+
   eventSource.onerror = function () {
     eventSource.close();
   };
 }
 
+// SSE 事件帶的是預設尺寸的 PNG，先顯示它，再換成適合此螢幕的較小圖表變體（伺服器已有預設圖表，變體只需重繪一次）
+async function showChartVariant(chartData) {
+  try {
+    const variant = await fetchChart(chartData.period, chartData.buy_currency, chartData.sell_currency);
+    const cacheKey = `${chartData.buy_currency}_${chartData.sell_currency}_${chartData.period}`;
+    if (!variant.chart_url || variant.chart_url === chartData.chart_url) return;
+    chartCache[cacheKey] = variant;
+    if (
+      chartData.buy_currency === currencyManager.currentFromCurrency &&
+      chartData.sell_currency === currencyManager.currentToCurrency &&
+      String(chartData.period) === String(currentPeriod)
+    ) {
+      renderChart(variant.chart_url, variant.stats, chartData.buy_currency, chartData.sell_currency, chartData.period);
+    }
+  } catch (error) {
+    console.warn('載入圖表變體失敗，保留預設圖表:', error);
+  }
+}
+
 // 自動刷新頁面內容
 async function autoRefreshContent(updateData) {
   const { from, to } = updateData;
@@ -468,6 +548,24 @@ function showAutoUpdateNotification(updateData) {
   }, 5000);
 }
 
+// 顯示匯率提醒通知（停留較久，讓使用者看得到）
+function showAlertNotification(alert) {
+  const notification = document.createElement('div');
+  notification.className = 'auto-update-notification';
+  notification.textContent = `🔔 ${alert.message}${alert.note ? `（${alert.note}）` : ''}`;
+  document.body.appendChild(notification);
+
+  setTimeout(() => {
+    notification.classList.add('show');
+  }, 10);
+
+  setTimeout(() => {
+    notification.classList.remove('show');
+    setTimeout(() => {
+      notification.remove();
+    }, 500);
+  }, 10000);
+}
 
 function setupConfirmButton() {
   const confirmBtn = document.getElementById('confirm-currency-btn');
@@ -535,15 +633,25 @@ function setupHistoryPopup() {
     return;
   }
 
+  // 清單先顯示，縮圖以一次批次請求補上
+  const loadSparklines = (pairs) => {
+    if (!pairs || pairs.length === 0) return;
+    fetchSparklines(pairs)
+      .then(renderSparklines)
+      .catch(error => console.warn('走勢縮圖載入失敗:', error));
+  };
+
   const loadUserHistory = () => {
     const history = userHistoryManager.getHistory();
     renderHistoryList(history, 'user');
+    loadSparklines(history);
   };
 
   const loadServerHistory = async () => {
     try {
       const pairs = await fetchCachedPairs();
       renderHistoryList(pairs, 'server');
+      loadSparklines(pairs);
     } catch (error) {
       console.error('Failed to load server history:', error);
       renderHistoryList([], 'server'); // Show empty state on error
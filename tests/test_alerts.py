@@ -0,0 +1,76 @@
+import random
+
+import pytest
+
+from app.alerts import AlertEngine, ABOVE, BELOW
+
+
+@pytest.fixture
+def engine(tmp_path):
+    return AlertEngine(path=str(tmp_path / 'alerts.json'))
+
+
+def triggered_ids(triggered):
+    return sorted(rule['id'] for rule in triggered)
+
+
+def test_crossings_match_brute_force(engine):
+    rng = random.Random(3)
+    rules = [engine.add('TWD', 'HKD', rng.choice((ABOVE, BELOW)), round(rng.uniform(3.9, 4.1), 3),
+                        repeat=rng.random() < 0.5) for _ in range(300)]
+    active = {rule['id']: rule for rule in rules}
+    previous = None
+    for day in range(1, 200):
+        rate = round(rng.uniform(3.85, 4.15), 3)
+        triggered = engine.observe('TWD', 'HKD', rate, f"2026-{day // 28 + 1:02d}-{day % 28 + 1:02d}")
+
+        expected = []
+        if previous is not None:
+            for rule in active.values():
+                if rule['direction'] == ABOVE and previous < rule['threshold'] <= rate:
+                    expected.append(rule['id'])
+                elif rule['direction'] == BELOW and rate <= rule['threshold'] < previous:
+                    expected.append(rule['id'])
+        assert triggered_ids(triggered) == sorted(expected)
+        for rule_id in expected:
+            if not active[rule_id]['repeat']:
+                del active[rule_id]
+        previous = rate
+    assert engine.count() == len(active)
+
+
+def test_threshold_equal_to_previous_rate_does_not_retrigger(engine):
+    engine.observe('TWD', 'HKD', 4.00, '2026-01-01')
+    rule = engine.add('TWD', 'HKD', ABOVE, 4.05, repeat=True)
+    assert triggered_ids(engine.observe('TWD', 'HKD', 4.05, '2026-01-02')) == [rule['id']]
+    # 停在門檻上不算再次跨越
+    assert engine.observe('TWD', 'HKD', 4.05, '2026-01-03') == []
+    assert engine.observe('TWD', 'HKD', 4.10, '2026-01-04') == []
+
+
+def test_pairs_without_rules_record_baseline(engine):
+    assert engine.observe('EUR', 'CHF', 0.93, '2026-01-01') == []
+    assert engine.last_rate('EUR', 'CHF') == (0.93, '2026-01-01')
+    rule = engine.add('EUR', 'CHF', ABOVE, 0.95)
+    assert triggered_ids(engine.observe('EUR', 'CHF', 0.96, '2026-01-02')) == [rule['id']]
+
+
+def test_older_dates_do_not_trigger(engine):
+    engine.observe('TWD', 'HKD', 4.00, '2026-01-10')
+    engine.add('TWD', 'HKD', BELOW, 3.95)
+    assert engine.observe('TWD', 'HKD', 3.90, '2026-01-05') == []
+    assert engine.last_rate('TWD', 'HKD') == (4.00, '2026-01-10')
+
+
+def test_one_shot_rule_is_removed_and_state_persists(tmp_path):
+    path = str(tmp_path / 'alerts.json')
+    engine = AlertEngine(path=path)
+    engine.observe('TWD', 'HKD', 4.00, '2026-01-01')
+    once = engine.add('TWD', 'HKD', ABOVE, 4.02)
+    kept = engine.add('TWD', 'HKD', ABOVE, 4.50)
+    assert triggered_ids(engine.observe('TWD', 'HKD', 4.03, '2026-01-02')) == [once['id']]
+    engine.save()
+
+    reloaded = AlertEngine(path=path)
+    assert [rule['id'] for rule in reloaded.list()] == [kept['id']]
+    assert reloaded.last_rate('TWD', 'HKD') == (4.03, '2026-01-02')
@@ -0,0 +1,53 @@
+import csv
+import io
+import json
+from threading import Lock
+from types import SimpleNamespace
+
+from app.exchange_rate_manager import ExchangeRateManager
+from app.export import EXPORT_COLUMNS, stream_rows
+from app.rate_series import RateSeries
+from app.rate_store import RateStore
+from app.rollups import RollupStore
+
+OLD_RATES = {f"2025-06-{day:02d}": 4.0 + day / 1000 for day in range(2, 28)}
+RECENT_RATES = {f"2026-01-{day:02d}": 4.1 + day / 1000 for day in range(5, 20)}
+
+
+def exporter(tmp_path):
+    """只帶匯出需要的屬性，以未綁定方法呼叫 iter_export_rows（不啟動完整的管理器）"""
+    store = RateStore(base_dir=str(tmp_path / 'rates'))
+    store.put_rates('USD', 'JPY', RECENT_RATES)
+    rollups = RollupStore(base_dir=str(tmp_path / 'rollups'))
+    rollups.fold('USD', 'JPY', OLD_RATES, '2025-06-16')
+    data = RateSeries()
+    data.update_rates(RECENT_RATES)
+    manager = SimpleNamespace(store=store, rollups=rollups, data=data, data_lock=Lock())
+    return lambda *args: list(ExchangeRateManager.iter_export_rows(manager, *args))
+
+
+def test_rollup_rows_precede_daily_rows(tmp_path):
+    rows = exporter(tmp_path)([('USD', 'JPY')])
+    granularities = [row[4] for row in rows]
+    first_daily = granularities.index('daily')
+    assert set(granularities[:first_daily]) == {'weekly', 'monthly'}
+    assert set(granularities[first_daily:]) == {'daily'}
+    assert [(row[2], row[3]) for row in rows[first_daily:]] == sorted(RECENT_RATES.items())
+    assert sum(1 for row in rows if row[4] != 'daily') == len({row[5] for row in rows if row[4] != 'daily'})
+
+
+def test_range_and_pairs(tmp_path):
+    rows = exporter(tmp_path)([('TWD', 'HKD'), ('USD', 'JPY'), ('EUR', 'CHF')], '2026-01-10', '2026-01-12')
+    assert [(row[0], row[1], row[2]) for row in rows] == [
+        (buy, sell, f"2026-01-{day}") for buy, sell in (('TWD', 'HKD'), ('USD', 'JPY')) for day in (10, 11, 12)]
+
+
+def test_csv_and_ndjson_round_trip(tmp_path):
+    rows = exporter(tmp_path)([('USD', 'JPY')])
+    parsed = list(csv.reader(io.StringIO(''.join(stream_rows(iter(rows), 'csv')))))
+    assert tuple(parsed[0]) == EXPORT_COLUMNS
+    assert len(parsed) == len(rows) + 1
+    assert [float(line[3]) for line in parsed[1:]] == [row[3] for row in rows]
+
+    lines = ''.join(stream_rows(iter(rows), 'ndjson')).splitlines()
+    assert [json.loads(line) for line in lines] == [dict(zip(EXPORT_COLUMNS, row)) for row in rows]
@@ -0,0 +1,59 @@
+from datetime import date, timedelta
+
+import numpy as np
+import pytest
+
+from app.indicators import IndicatorCache, IndicatorSpec, INDICATORS, align, compute, parse_indicators, to_dates
+
+SPECS = [IndicatorSpec(name, window) for name in INDICATORS for window in (1, 2, 5, 20)
+         if window >= 2 or name in ('pct_change', 'ema')]
+
+
+def history(days, start='2025-01-01'):
+    first = date.fromisoformat(start)
+    dates = [(first + timedelta(days=i)).isoformat() for i in range(days)]
+    rates = 4.0 + 0.2 * np.sin(np.arange(days) / 5.0) + 0.01 * (np.arange(days) % 3)
+    return dates, rates
+
+
+@pytest.mark.parametrize('spec', SPECS, ids=lambda spec: f"{spec.name}_{spec.window}")
+def test_extension_matches_full_recompute(spec):
+    dates, rates = history(120)
+    cache = IndicatorCache()
+    cache.get('TWD', 'HKD', spec, lambda: (dates[:50], rates[:50]))
+    # 分三批延伸，包含只有一天的批次
+    for lo, hi in ((50, 51), (51, 90), (90, 120)):
+        cache.extend('TWD', 'HKD', {dates[i]: rates[i] for i in range(lo, hi)})
+
+    entry = cache.get('TWD', 'HKD', spec, lambda: pytest.fail('延伸後不應重新計算'))
+    expected = compute(spec, rates)
+    assert list(entry.dates.astype(str)) == dates
+    for field, values in expected.items():
+        np.testing.assert_allclose(entry.values[field], values, rtol=1e-10, equal_nan=True)
+
+
+def test_backfilled_older_date_drops_cached_entry():
+    dates, rates = history(30)
+    spec = IndicatorSpec('sma', 5)
+    cache = IndicatorCache()
+    cache.get('TWD', 'HKD', spec, lambda: (dates[1:], rates[1:]))
+    cache.extend('TWD', 'HKD', {dates[0]: rates[0]})
+    reloaded = []
+    cache.get('TWD', 'HKD', spec, lambda: reloaded.append(True) or (dates, rates))
+    assert reloaded
+
+
+def test_align_returns_nan_for_missing_dates():
+    dates, rates = history(10)
+    spec = IndicatorSpec('sma', 2)
+    entry = IndicatorCache().get('TWD', 'HKD', spec, lambda: (dates, rates))
+    values = align(entry, to_dates([dates[3], '2030-01-01']))['sma']
+    assert values[0] == pytest.approx((rates[2] + rates[3]) / 2)
+    assert np.isnan(values[1])
+
+
+def test_parse_indicators_defaults_and_validation():
+    assert parse_indicators('sma, ema:10,sma') == [IndicatorSpec('sma', 20), IndicatorSpec('ema', 10)]
+    for value in ('macd', 'sma:1', 'sma:x', 'sma:400', 'sma:2,sma:3,sma:4,sma:5,sma:6,sma:7'):
+        with pytest.raises(ValueError):
+            parse_indicators(value)
@@ -0,0 +1,90 @@
+import threading
+import time
+
+import pytest
+
+from app.job_scheduler import JobScheduler, INTERACTIVE, PROGRESSIVE, WARMUP, BACKFILL
+
+
+@pytest.fixture
+def scheduler():
+    return JobScheduler(max_workers=4, max_per_pair=2)
+
+
+def test_same_key_returns_same_future(scheduler):
+    gate = threading.Event()
+    first = scheduler.submit(gate.wait, 5, key='fetch:TWD-HKD')
+    second = scheduler.submit(gate.wait, 5, key='fetch:TWD-HKD')
+    assert first is second
+    gate.set()
+    assert first.result(timeout=5)
+    assert not scheduler.is_pending('fetch:TWD-HKD')
+
+
+def test_higher_priority_runs_first():
+    scheduler = JobScheduler(max_workers=1, max_per_pair=1)
+    gate = threading.Event()
+    order = []
+    blocker = scheduler.submit(gate.wait, 5, priority=INTERACTIVE)
+    futures = [scheduler.submit(order.append, priority, priority=priority)
+               for priority in (BACKFILL, WARMUP, PROGRESSIVE, INTERACTIVE)]
+    gate.set()
+    blocker.result(timeout=5)
+    for future in futures:
+        future.result(timeout=5)
+    assert order == [INTERACTIVE, PROGRESSIVE, WARMUP, BACKFILL]
+
+
+def test_caps_hold_under_load(scheduler):
+    lock = threading.Lock()
+    running = {'total': 0, 'max_total': 0, 'pairs': {}, 'max_pair': 0, 'classes': {}, 'max_class': {}}
+
+    def job(pair, priority):
+        with lock:
+            running['total'] += 1
+            running['max_total'] = max(running['max_total'], running['total'])
+            running['pairs'][pair] = running['pairs'].get(pair, 0) + 1
+            running['max_pair'] = max(running['max_pair'], running['pairs'][pair])
+            running['classes'][priority] = running['classes'].get(priority, 0) + 1
+            running['max_class'][priority] = max(running['max_class'].get(priority, 0), running['classes'][priority])
+        time.sleep(0.002)
+        with lock:
+            running['total'] -= 1
+            running['pairs'][pair] -= 1
+            running['classes'][priority] -= 1
+
+    pairs = [('TWD', 'HKD'), ('USD', 'JPY'), ('EUR', 'CHF')]
+    priorities = (INTERACTIVE, PROGRESSIVE, WARMUP, BACKFILL)
+    futures = [scheduler.submit(job, pairs[i % 3], priorities[i % 4], priority=priorities[i % 4], pair=pairs[i % 3])
+               for i in range(200)]
+    for future in futures:
+        future.result(timeout=30)
+
+    assert running['max_total'] <= scheduler.max_workers
+    assert running['max_pair'] <= scheduler.max_per_pair
+    for priority, peak in running['max_class'].items():
+        assert peak <= scheduler.class_limits[priority]
+    assert scheduler.snapshot()['worker_threads'] <= scheduler.max_workers
+
+
+def test_parent_waiting_on_children_does_not_deadlock():
+    scheduler = JobScheduler(max_workers=1, max_per_pair=1)
+
+    def parent():
+        children = [scheduler.submit(lambda i=i: i * 2, pair=('TWD', 'HKD')) for i in range(5)]
+        return sorted(future.result() for future in scheduler.as_completed(children))
+
+    assert scheduler.submit(parent, pair=('TWD', 'HKD')).result(timeout=10) == [0, 2, 4, 6, 8]
+
+
+def test_cancel_only_affects_queued_jobs():
+    scheduler = JobScheduler(max_workers=1, max_per_pair=1)
+    started, gate = threading.Event(), threading.Event()
+    running = scheduler.submit(lambda: started.set() or gate.wait(5))
+    assert started.wait(5)
+    queued = scheduler.submit(lambda: 'ran', key='late')
+    assert scheduler.cancel([running, queued]) == 1
+    gate.set()
+    assert running.result(timeout=5)
+    assert queued.cancelled()
+    assert not scheduler.is_pending('late')
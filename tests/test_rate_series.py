@@ -0,0 +1,79 @@
+import json
+
+import numpy as np
+
+from app.rate_series import RateSeries, binary_path, load_series, save_binary
+
+
+def make_series(rates):
+    series = RateSeries()
+    series.update_rates(rates, updated=1_700_000_000)
+    return series
+
+
+RATES = {'2026-01-02': 4.01, '2026-01-05': 4.03, '2026-01-06': 4.02, '2026-01-09': 4.05}
+
+
+def test_put_keeps_dates_sorted_and_overwrites():
+    series = make_series({'2026-01-05': 4.0, '2026-01-02': 3.9})
+    assert series.put('2026-01-03', 3.95)
+    assert not series.put('2026-01-05', 4.1)
+    assert series.items_between() == [('2026-01-02', 3.9), ('2026-01-03', 3.95), ('2026-01-05', 4.1)]
+
+
+def test_range_reads_agree():
+    series = make_series(RATES)
+    expected = [(d, r) for d, r in sorted(RATES.items()) if '2026-01-03' <= d <= '2026-01-06']
+    assert series.items_between('2026-01-03', '2026-01-06') == expected
+    assert list(series.iter_between('2026-01-03', '2026-01-06')) == expected
+    dates, rates = series.columns('2026-01-03', '2026-01-06')
+    assert list(dates.astype(str)) == [d for d, _ in expected]
+    np.testing.assert_array_equal(rates, [r for _, r in expected])
+
+
+def test_iter_between_is_unaffected_by_later_writes():
+    series = make_series(RATES)
+    rows = series.iter_between('2026-01-05')
+    series.pop_before('2026-01-06')
+    series.put('2026-01-07', 9.9)
+    assert list(rows) == [('2026-01-05', 4.03), ('2026-01-06', 4.02), ('2026-01-09', 4.05)]
+
+
+def test_binary_round_trip_is_mapped(tmp_path):
+    path = str(tmp_path / 'TWD-HKD.json')
+    series = make_series(RATES)
+    save_binary(series, path)
+    mapped = RateSeries.map_file(binary_path(path))
+    assert mapped is not None and mapped.mapped
+    assert mapped.items_between() == series.items_between()
+    assert mapped.to_json_dict() == series.to_json_dict()
+
+
+def test_mapped_series_copies_on_write_and_refreshes(tmp_path):
+    path = str(tmp_path / 'pair.fxs')
+    make_series(RATES).write_file(path)
+    reader = RateSeries.map_file(path)
+    writer = RateSeries.map_file(path)
+
+    writer.put('2026-01-12', 4.07)
+    assert not writer.mapped and '2026-01-12' not in reader
+    writer.write_file(path)
+    assert reader.refresh()
+    assert reader.rate('2026-01-12') == 4.07
+
+
+def test_invalid_header_is_rejected(tmp_path):
+    path = tmp_path / 'bad.fxs'
+    path.write_bytes(b'XXXX' + b'\0' * 60)
+    assert RateSeries.map_file(str(path)) is None
+
+
+def test_load_series_prefers_fresh_binary(tmp_path):
+    path = str(tmp_path / 'pair.json')
+    series = make_series(RATES)
+    with open(path, 'w', encoding='utf-8') as f:
+        json.dump(series.to_json_dict(), f)
+    save_binary(series, path)
+    loaded = load_series(path)
+    assert loaded.mapped
+    assert loaded.items_between() == sorted(RATES.items())
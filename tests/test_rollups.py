@@ -0,0 +1,73 @@
+from datetime import date, timedelta
+
+import pytest
+
+from app.rollups import RollupStore, WEEKLY, MONTHLY, aggregate
+
+
+def daily_rates(start, days):
+    first = date.fromisoformat(start)
+    return {(first + timedelta(days=i)).isoformat(): round(4.0 + 0.01 * ((i * 7) % 13), 4) for i in range(days)}
+
+
+def snapshot(store, pair=('TWD', 'HKD')):
+    """兩層區間的內容；sum 依累加順序會有浮點誤差，四捨五入後比較"""
+    return tuple({key: dict(bucket, sum=round(bucket['sum'], 9)) for key, bucket in store.get_buckets(*pair, tier).items()}
+                 for tier in (WEEKLY, MONTHLY))
+
+
+@pytest.fixture
+def store(tmp_path):
+    return RollupStore(base_dir=str(tmp_path))
+
+
+def test_fold_twice_is_idempotent(store):
+    rates = daily_rates('2026-01-05', 40)
+    assert store.fold('TWD', 'HKD', rates, '2026-01-01') == (40, 0)
+    before = snapshot(store)
+    assert store.fold('TWD', 'HKD', rates, '2026-01-01') == (0, 0)
+    assert snapshot(store) == before
+
+
+def test_fold_in_chunks_matches_single_fold(tmp_path):
+    rates = daily_rates('2026-01-01', 90)
+    whole = RollupStore(base_dir=str(tmp_path / 'whole'))
+    whole.fold('TWD', 'HKD', rates, '2025-01-01')
+
+    chunked = RollupStore(base_dir=str(tmp_path / 'chunked'))
+    dates = sorted(rates)
+    for i in range(0, len(dates), 11):
+        # 相鄰兩批互相重疊，重疊的日期不能被計入兩次
+        chunk = {d: rates[d] for d in dates[max(0, i - 3):i + 11]}
+        chunked.fold('TWD', 'HKD', chunk, '2025-01-01')
+    assert snapshot(chunked) == snapshot(whole)
+
+    # 週保留期推進後，週區間轉為月區間的結果也一致
+    for store in (whole, chunked):
+        store.fold('TWD', 'HKD', {}, '2026-02-15')
+    assert snapshot(chunked) == snapshot(whole)
+    assert sum(b['count'] for b in whole.get_buckets('TWD', 'HKD', MONTHLY).values()) == len(rates)
+
+
+def test_folded_buckets_match_full_aggregate(store):
+    rates = daily_rates('2026-03-02', 28)
+    store.fold('TWD', 'HKD', rates, '2026-01-01')
+    weekly = store.get_buckets('TWD', 'HKD', WEEKLY)
+    assert weekly == aggregate(rates, WEEKLY)
+    assert sum(bucket['count'] for bucket in weekly.values()) == len(rates)
+
+
+def test_is_covered_per_day(store):
+    store.fold('TWD', 'HKD', {'2026-03-02': 4.1, '2026-03-04': 4.2}, '2026-01-01')
+    assert store.is_covered('TWD', 'HKD', '2026-03-02')
+    assert store.is_covered('TWD', 'HKD', '2026-03-04')
+    # 同一週內沒有折疊過的日期仍要回填
+    assert not store.is_covered('TWD', 'HKD', '2026-03-03')
+
+
+def test_folded_dates_survive_reload(tmp_path):
+    rates = daily_rates('2026-03-02', 10)
+    RollupStore(base_dir=str(tmp_path)).fold('TWD', 'HKD', rates, '2026-01-01')
+    reloaded = RollupStore(base_dir=str(tmp_path))
+    assert reloaded.fold('TWD', 'HKD', rates, '2026-01-01') == (0, 0)
+    assert all(reloaded.is_covered('TWD', 'HKD', d) for d in rates)
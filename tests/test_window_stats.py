@@ -0,0 +1,54 @@
+import random
+from datetime import date, timedelta
+
+import pytest
+
+from app.window_stats import SlidingWindowStats, series_hash
+
+
+def full_stats(points):
+    rates = [rate for _, rate in points]
+    return {
+        'max_rate': max(rates),
+        'min_rate': min(rates),
+        'avg_rate': pytest.approx(sum(rates) / len(rates), rel=1e-12),
+        'data_points': len(rates),
+        'date_range': f"{points[0][0]} 至 {points[-1][0]}",
+    }
+
+
+def test_sliding_window_matches_full_recompute():
+    rng = random.Random(7)
+    first = date(2025, 1, 1)
+    days = 30
+    window = SlidingWindowStats()
+    points = []
+    for i in range(600):
+        if rng.random() < 0.2:
+            continue  # 週末與假日沒有數據
+        day = (first + timedelta(days=i)).isoformat()
+        rate = round(4.0 + rng.uniform(-0.3, 0.3), 4)
+        window.append(day, rate)
+        points.append((day, rate))
+        start = (first + timedelta(days=i - days + 1)).isoformat()
+        window.evict_before(start)
+        points = [p for p in points if p[0] >= start]
+
+        assert window.stats() == full_stats(points)
+        dates_str, rates = window.series()
+        assert list(zip(dates_str, rates)) == points
+        assert window.content_hash == series_hash(dates_str, rates)
+
+
+def test_take_delta_reports_changes_since_last_call():
+    window = SlidingWindowStats(['2026-01-01', '2026-01-02'], [4.0, 4.1])
+    assert window.take_delta() == ([], [])
+    window.append('2026-01-03', 4.2)
+    window.evict_before('2026-01-02')
+    assert window.take_delta() == ([('2026-01-03', 4.2)], [('2026-01-01', 4.0)])
+
+
+def test_append_rejects_dates_not_after_last():
+    window = SlidingWindowStats(['2026-01-02'], [4.0])
+    with pytest.raises(ValueError):
+        window.append('2026-01-02', 4.1)
@@ -0,0 +1,248 @@
+"""
+離線歷史匯率回填工具。
+
+依貨幣對清單與日期範圍，先比對本地儲存找出缺少的日期，再於速率預算內並行抓取。
+進度會寫入檢查點檔案，中斷後以相同參數重新執行即可從上次的位置繼續。
+
+用法：
+    python -m tools.backfill --pairs TWD-USD,TWD-JPY --start 2023-01-01 --end 2025-12-31
+    python -m tools.backfill --pairs TWD-USD --days 730 --upstream-url http://127.0.0.1:8001/conversion-rates
+"""
+import os
+import sys
+import json
+import time
+import argparse
+from datetime import datetime, timedelta
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+
+from app import exchange_rate_manager as erm
+from app.exchange_rate_manager import ExchangeRateManager
+from app.utils import atomic_write_json
+
+DEFAULT_CHECKPOINT = os.path.join('data', 'backfill_checkpoint.json')
+
+
+def parse_pairs(text):
+    """解析 'TWD-USD,TWD-JPY' 形式的貨幣對清單"""
+    pairs = []
+    for item in text.split(','):
+        item = item.strip().upper()
+        if not item:
+            continue
+        parts = item.split('-')
+        if len(parts) != 2 or not all(len(p) == 3 and p.isalpha() for p in parts):
+            raise argparse.ArgumentTypeError(f"無效的貨幣對: {item}（格式應為 TWD-USD）")
+        pairs.append((parts[0], parts[1]))
+    if not pairs:
+        raise argparse.ArgumentTypeError("至少需要一個貨幣對")
+    return list(dict.fromkeys(pairs))
+
+
+def parse_date(text):
+    try:
+        return datetime.strptime(text, '%Y-%m-%d')
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"無效的日期: {text}（格式應為 YYYY-MM-DD）")
+
+
+def load_checkpoint(path, job_key):
+    """載入檢查點；若參數不同則視為新的回填任務"""
+    if os.path.exists(path):
+        try:
+            with open(path, 'r', encoding='utf-8') as f:
+                checkpoint = json.load(f)
+            if checkpoint.get('job') == job_key:
+                return checkpoint
+            print("ℹ️ 檢查點屬於不同的回填任務，將重新開始。")
+        except (json.JSONDecodeError, IOError) as e:
+            print(f"⚠️ 讀取檢查點時發生錯誤，將重新開始: {e}")
+    return {'job': job_key, 'empty': {}, 'fetched': 0, 'failed': 0}
+
+
+def save_checkpoint(path, checkpoint):
+    """寫入暫存檔再替換，確保檢查點檔案始終完整"""
+    os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+    atomic_write_json(path, checkpoint, ensure_ascii=False)
+
+
+def plan_backfill(manager, pairs, start_date, end_date, checkpoint, include_weekends=False):
+    """比對本地儲存與檢查點，列出每個貨幣對仍需抓取的日期（由新到舊）"""
+    candidate_dates = []
+    current_date = end_date
+    while current_date >= start_date:
+        candidate_dates.append(current_date)
+        current_date -= timedelta(days=1)
+
+    start_str, end_str = start_date.strftime('%Y-%m-%d'), end_date.strftime('%Y-%m-%d')
+    plan = []
+    for buy_currency, sell_currency in pairs:
+        stored = manager.get_stored_rates(buy_currency, sell_currency, start_str, end_str)
+        known_empty = set(checkpoint['empty'].get(f"{buy_currency}-{sell_currency}", []))
+        missing = [d for d in candidate_dates
+                   if d.strftime('%Y-%m-%d') not in stored and d.strftime('%Y-%m-%d') not in known_empty
+                   and not manager.is_rolled_up(buy_currency, sell_currency, d.strftime('%Y-%m-%d'))]
+        # 略過發布日曆判定不會有新數據的日期，以及負面快取中的日期
+        missing = manager.planner.plan(buy_currency, sell_currency, missing, use_calendar=not include_weekends)
+        print(f"📋 {buy_currency}-{sell_currency}: 範圍內 {len(candidate_dates)} 天，本地已有 {len(stored)} 筆，待抓取 {len(missing)} 天")
+        plan.extend((buy_currency, sell_currency, d) for d in missing)
+    return plan
+
+
+def fetch_one(manager, buy_currency, sell_currency, date):
+    """
+    抓取單日匯率，區分三種結果：
+    ('ok', rate)：成功；('empty', None)：上游無此日數據；('failed', None)：網路錯誤或熔斷中，下次重試
+    """
+    data = manager.get_exchange_rate(date, buy_currency, sell_currency)
+    if data is None:
+        manager.planner.record_failure(buy_currency, sell_currency, date)
+        return 'failed', None
+    try:
+        rate = float(data['data']['conversionRate'])
+    except (KeyError, ValueError, TypeError):
+        manager.planner.record(buy_currency, sell_currency, date, published=False)
+        return 'empty', None
+    manager.planner.record(buy_currency, sell_currency, date, published=True, rate=rate)
+    return 'ok', rate
+
+
+def format_eta(seconds):
+    seconds = int(seconds)
+    hours, remainder = divmod(seconds, 3600)
+    minutes, seconds = divmod(remainder, 60)
+    return f"{hours:02d}:{minutes:02d}:{seconds:02d}"
+
+
+def run_backfill(manager, plan, checkpoint, checkpoint_path, workers=5, flush_every=25, report_interval=2.0):
+    """並行執行回填計畫，定期寫回數據與檢查點並輸出吞吐量/ETA"""
+    total = len(plan)
+    if total == 0:
+        print("✅ 沒有需要回填的日期。")
+        return checkpoint
+
+    pending_rates = {}  # (buy, sell) -> {date_str: rate}
+    done = 0
+    started_at = time.time()
+    last_report = 0
+
+    def flush():
+        for (buy_currency, sell_currency), rates in pending_rates.items():
+            manager.store_rates(buy_currency, sell_currency, rates)
+        pending_rates.clear()
+        save_checkpoint(checkpoint_path, checkpoint)
+        manager.planner.save()
+
+    def wait_for_network():
+        # 上游錯誤觸發熔斷時先暫停派送，避免整批日期被直接判為失敗
+        while manager._network_paused and time.time() < manager._pause_until:
+            remaining = manager._pause_until - time.time()
+            print(f"⏸️ 上游暫停中，{int(remaining)} 秒後繼續...")
+            time.sleep(min(30, max(1, remaining)))
+
+    plan_iter = iter(plan)
+    in_flight = {}
+    try:
+        with ThreadPoolExecutor(max_workers=workers, thread_name_prefix='Backfill') as executor:
+            while True:
+                # 保持最多 workers * 2 個進行中的請求，其餘留在計畫中，方便中斷
+                while len(in_flight) < workers * 2:
+                    item = next(plan_iter, None)
+                    if item is None:
+                        break
+                    wait_for_network()
+                    buy_currency, sell_currency, date = item
+                    in_flight[executor.submit(fetch_one, manager, buy_currency, sell_currency, date)] = item
+                if not in_flight:
+                    break
+
+                finished, _ = wait(in_flight, return_when=FIRST_COMPLETED)
+                for future in finished:
+                    buy_currency, sell_currency, date = in_flight.pop(future)
+                    date_str = date.strftime('%Y-%m-%d')
+                    try:
+                        status, rate = future.result()
+                    except Exception as e:
+                        print(f"❌ {buy_currency}-{sell_currency} {date_str}: 未知錯誤 - {e}")
+                        status, rate = 'failed', None
+
+                    done += 1
+                    if status == 'ok':
+                        pending_rates.setdefault((buy_currency, sell_currency), {})[date_str] = rate
+                        checkpoint['fetched'] += 1
+                    elif status == 'empty':
+                        checkpoint['empty'].setdefault(f"{buy_currency}-{sell_currency}", []).append(date_str)
+                    else:
+                        checkpoint['failed'] += 1
+
+                if sum(len(r) for r in pending_rates.values()) >= flush_every:
+                    flush()
+
+                now = time.time()
+                if now - last_report >= report_interval or done == total:
+                    last_report = now
+                    elapsed = max(now - started_at, 1e-6)
+                    throughput = done / elapsed
+                    eta = (total - done) / throughput if throughput > 0 else 0
+                    print(f"⏳ {done}/{total} ({done / total * 100:.1f}%) | {throughput:.2f} 天/秒 | "
+                          f"已用 {format_eta(elapsed)} | 剩餘約 {format_eta(eta)}")
+    except KeyboardInterrupt:
+        print("\n🛑 收到中斷訊號，保存進度後結束。以相同參數重新執行即可繼續。")
+        for future in in_flight:
+            future.cancel()
+        raise
+    finally:
+        flush()
+
+    return checkpoint
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='離線回填多貨幣對歷史匯率（可中斷續傳）')
+    parser.add_argument('--pairs', required=True, type=parse_pairs, help='貨幣對清單，例如 TWD-USD,TWD-JPY')
+    parser.add_argument('--start', type=parse_date, help='起始日期 YYYY-MM-DD')
+    parser.add_argument('--end', type=parse_date, help='結束日期 YYYY-MM-DD（預設今天）')
+    parser.add_argument('--days', type=int, default=365, help='未指定 --start 時，回填最近幾天（預設 365）')
+    parser.add_argument('--workers', type=int, default=5, help='並行請求數（預設 5）')
+    parser.add_argument('--rps', type=float, default=None, help='每秒最大請求數，預設沿用共用速率預算')
+    parser.add_argument('--include-weekends', action='store_true', help='忽略發布日曆，週末與休市日也嘗試抓取')
+    parser.add_argument('--checkpoint', default=DEFAULT_CHECKPOINT, help=f'檢查點檔案（預設 {DEFAULT_CHECKPOINT}）')
+    parser.add_argument('--upstream-url', default=None, help='上游 API 位址，可指向本地模擬服務')
+    args = parser.parse_args(argv)
+
+    end_date = (args.end or datetime.now()).replace(hour=0, minute=0, second=0, microsecond=0)
+    start_date = args.start or (end_date - timedelta(days=args.days))
+    if start_date > end_date:
+        parser.error('--start 不能晚於 --end')
+
+    if args.rps:
+        erm.rate_limiter.set_rate(args.rps)
+
+    manager = ExchangeRateManager(upstream_url=args.upstream_url)
+
+    job_key = {
+        'pairs': [f"{b}-{s}" for b, s in args.pairs],
+        'start': start_date.strftime('%Y-%m-%d'),
+        'end': end_date.strftime('%Y-%m-%d'),
+    }
+    checkpoint = load_checkpoint(args.checkpoint, job_key)
+
+    print(f"🚀 回填 {len(args.pairs)} 組貨幣對：{job_key['start']} 至 {job_key['end']}")
+    plan = plan_backfill(manager, args.pairs, start_date, end_date, checkpoint, args.include_weekends)
+
+    try:
+        checkpoint = run_backfill(manager, plan, checkpoint, args.checkpoint, workers=args.workers)
+    except KeyboardInterrupt:
+        return 130
+
+    # 超過日資料保留期的部分折疊為週/月彙總
+    for buy_currency, sell_currency in args.pairs:
+        manager.compact_pair(buy_currency, sell_currency)
+
+    print(f"💾 回填結束：累計成功 {checkpoint['fetched']} 筆，"
+          f"無數據 {sum(len(v) for v in checkpoint['empty'].values())} 天，失敗 {checkpoint['failed']} 次（下次執行會重試）")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,334 @@
+"""
+熱路徑基準測試，並與儲存的基準線比較；任何項目變慢超過門檻時以非零狀態結束。
+
+涵蓋：
+- LRUCache get/put（不同容量）
+- extract_local_rates（180 天與 5 年窗口）
+- render_chart_image（各期間）
+- send_sse_event 廣播給 10/100/1000 個客戶端
+- _background_fetch_and_generate 端到端（模擬上游，不連網）
+
+在暫存目錄中執行，不會動到 data/ 與 static/charts。
+基準線與機器有關：換機器或大改動後請以 --save-baseline 重新建立。
+
+用法：
+    python -m tools.bench                       # 執行全部並與基準線比較
+    python -m tools.bench --only lru sse        # 只執行名稱包含 lru 或 sse 的項目
+    python -m tools.bench --save-baseline       # 以本次結果更新基準線
+    python -m tools.bench --threshold 0.5       # 允許變慢 50%
+"""
+import os
+import sys
+import gc
+import json
+import time
+import queue
+import random
+import argparse
+import itertools
+import platform
+import tempfile
+import statistics
+from datetime import datetime, timedelta
+from unittest import mock
+
+import matplotlib
+matplotlib.use('Agg')
+import logging
+logging.getLogger('matplotlib').setLevel(logging.ERROR)
+from flask import Flask
+
+import app.exchange_rate_manager as erm
+from app.exchange_rate_manager import ExchangeRateManager
+from app.rate_series import RateSeries
+from app.utils import LRUCache, temp_path
+from app.sse import sse_clients, sse_lock, send_sse_event
+
+BASELINE_FILE = os.path.join(os.path.dirname(__file__), 'bench_baseline.json')
+
+# 預設允許的變慢比例（0.25 表示比基準線慢 25% 以內都算通過）
+DEFAULT_THRESHOLD = float(os.environ.get('BENCH_THRESHOLD', 0.25))
+
+LRU_SIZES = (100, 1000, 10000)
+EXTRACT_WINDOWS = (180, 1825)
+RENDER_PERIODS = (7, 30, 90, 180, 365)
+SSE_CLIENT_COUNTS = (10, 100, 1000)
+
+
+class Benchmark:
+    def __init__(self, name, run, number=1, repeat=5):
+        """
+        run(number) 執行 number 次操作並返回耗時（秒），可自行排除準備工作。
+        結果取 repeat 次中每次操作的最短時間，受背景雜訊影響最小；量測期間同 timeit 關閉 GC。
+        """
+        self.name = name
+        self.run = run
+        self.number = number
+        self.repeat = repeat
+
+    def measure(self):
+        gc.collect()
+        gc_was_enabled = gc.isenabled()
+        gc.disable()
+        try:
+            per_op = [self.run(self.number) / self.number for _ in range(self.repeat)]
+        finally:
+            if gc_was_enabled:
+                gc.enable()
+        return {'seconds_per_op': min(per_op), 'median': statistics.median(per_op),
+                'number': self.number, 'repeat': self.repeat}
+
+
+def _timed_loop(fn, number):
+    started = time.perf_counter()
+    for _ in range(number):
+        fn()
+    return time.perf_counter() - started
+
+
+def _synthetic_rates(days, seed=42, end=None):
+    """以隨機漫步產生 {date_str: rate}，結果固定"""
+    rng = random.Random(seed)
+    end = end or datetime.now().replace(hour=0, minute=0, second=0, microsecond=0)
+    rates, rate = {}, 0.25
+    for i in range(days, -1, -1):
+        rate *= 1 + rng.uniform(-0.004, 0.004)
+        rates[(end - timedelta(days=i)).strftime('%Y-%m-%d')] = round(rate, 6)
+    return rates
+
+
+# --- 各項基準 ---
+
+def lru_benchmarks():
+    benchmarks = []
+    for size in LRU_SIZES:
+        cache = LRUCache(capacity=size, ttl_seconds=3600)
+        for i in range(size):
+            cache.put(f"key{i}", i)
+        keys = [f"key{random.Random(size).randrange(size)}" for _ in range(1000)]
+        # 以迭代器輪流取鍵，避免把產生鍵的成本算進去
+        get_keys = itertools.cycle(keys)
+        put_keys = itertools.cycle(keys)
+        # 小容量的單次操作只有幾微秒，多跑幾次以降低計時雜訊
+        number = min(20000, 2000000 // size)
+        benchmarks.append(Benchmark(f"lru.get[{size}]", lambda n, c=cache, k=get_keys: _timed_loop(lambda: c.get(next(k)), n),
+                                    number=number))
+        benchmarks.append(Benchmark(f"lru.put[{size}]", lambda n, c=cache, k=put_keys: _timed_loop(lambda: c.put(next(k), 1), n),
+                                    number=number))
+    return benchmarks
+
+
+def extract_benchmarks(manager):
+    manager.data = RateSeries.from_json_dict(
+        {d: {'rate': r, 'updated': datetime.now().isoformat()} for d, r in _synthetic_rates(1825).items()})
+    return [Benchmark(f"extract_local_rates[{days}]",
+                      lambda n, d=days: _timed_loop(lambda: manager.extract_local_rates(d), n),
+                      number=20 if days > 365 else 100)
+            for days in EXTRACT_WINDOWS]
+
+
+def render_benchmarks(manager):
+    def run(number, days):
+        series = _synthetic_rates(days - 1, seed=days)
+        dates, rates = list(series), list(series.values())
+        elapsed = 0.0
+        for i in range(number):
+            # 每次微調最後一點，避免命中同名檔案而跳過繪圖
+            rates[-1] = round(rates[-1] + 1e-6, 6)
+            started = time.perf_counter()
+            chart_url = manager.render_chart_image(days, dates, rates, 'TWD', 'HKD')
+            elapsed += time.perf_counter() - started
+            os.remove(os.path.join(manager.charts_dir, os.path.basename(chart_url)))
+        return elapsed
+    return [Benchmark(f"render_chart_image[{days}]", lambda n, d=days: run(n, d), number=1, repeat=3)
+            for days in RENDER_PERIODS]
+
+
+def sse_benchmarks():
+    def run(number, clients):
+        queues = [queue.Queue() for _ in range(clients)]
+        with sse_lock:
+            sse_clients[:] = queues
+        payload = {'buy_currency': 'TWD', 'sell_currency': 'HKD', 'period': 30,
+                   'chart_url': '/static/charts/x.png', 'stats': {'max_rate': 0.25, 'min_rate': 0.24}}
+        try:
+            return _timed_loop(lambda: send_sse_event('chart_ready', payload), number)
+        finally:
+            with sse_lock:
+                sse_clients.clear()
+    return [Benchmark(f"sse.fanout[{clients}]", lambda n, c=clients: run(n, c), number=max(20, 20000 // clients))
+            for clients in SSE_CLIENT_COUNTS]
+
+
+class _FakeResponse:
+    def __init__(self, payload):
+        self._payload = payload
+
+    def raise_for_status(self):
+        pass
+
+    def json(self):
+        return self._payload
+
+
+def background_fetch_benchmarks(manager, flask_app, upstream_latency):
+    """以模擬的上游跑完整背景抓取：排程、進度事件、漸進繪圖、寫回與長區間圖表"""
+    rng = random.Random(7)
+
+    def fake_get(url, params=None, **kwargs):
+        if upstream_latency:
+            time.sleep(upstream_latency)
+        return _FakeResponse({'data': {'conversionRate': round(0.25 + rng.uniform(-0.01, 0.01), 6)}})
+
+    runs = iter(range(10 ** 6))
+
+    def run(number):
+        elapsed = 0.0
+        for _ in range(number):
+            # 每次用新的貨幣對，本地沒有數據，180 天全部需要抓取
+            pair = ('USD', f"B{next(runs):02d}")
+            started = time.perf_counter()
+            manager._background_fetch_and_generate(*pair, flask_app, require_interest=False)
+            elapsed += time.perf_counter() - started
+        return elapsed
+
+    def patched_run(number):
+        with mock.patch.object(erm.requests, 'get', fake_get):
+            return run(number)
+    return [Benchmark('background_fetch.e2e', patched_run, number=1, repeat=3)]
+
+
+# --- 基準線比較 ---
+
+def machine_info():
+    return {'python': platform.python_version(), 'machine': platform.machine(),
+            'system': platform.system(), 'cpus': os.cpu_count()}
+
+
+def load_baseline(path):
+    if not os.path.exists(path):
+        return None
+    with open(path, 'r', encoding='utf-8') as f:
+        return json.load(f)
+
+
+def save_baseline(path, results, previous=None):
+    """寫入基準線；只跑部分項目時保留其他項目的舊結果與個別門檻"""
+    merged = dict((previous or {}).get('results', {}))
+    merged.update({name: {'seconds_per_op': r['seconds_per_op'], 'number': r['number']} for name, r in results.items()})
+    baseline = {
+        'created_at': datetime.now().isoformat(timespec='seconds'),
+        'machine': machine_info(),
+        'thresholds': (previous or {}).get('thresholds', {}),
+        'results': dict(sorted(merged.items())),
+    }
+    tmp_path = temp_path(path)
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump(baseline, f, ensure_ascii=False, indent=2)
+        f.write('\n')
+    os.replace(tmp_path, path)
+
+
+def compare(results, baseline, threshold):
+    """返回 [(name, 目前, 基準, 比例, 狀態)] 與是否有退步"""
+    rows, regressed = [], False
+    base_results = (baseline or {}).get('results', {})
+    overrides = (baseline or {}).get('thresholds', {})
+    for name, result in results.items():
+        current = result['seconds_per_op']
+        base = base_results.get(name, {}).get('seconds_per_op')
+        if not base:
+            rows.append((name, current, None, None, 'new'))
+            continue
+        ratio = current / base
+        limit = overrides.get(name, threshold)
+        if ratio > 1 + limit:
+            status, regressed = f'REGRESSED (>{limit:.0%})', True
+        elif ratio < 1 - limit:
+            status = 'faster'
+        else:
+            status = 'ok'
+        rows.append((name, current, base, ratio, status))
+    return rows, regressed
+
+
+def _format_seconds(seconds):
+    if seconds is None:
+        return '-'
+    if seconds < 1e-3:
+        return f"{seconds * 1e6:.2f} µs"
+    if seconds < 1:
+        return f"{seconds * 1e3:.2f} ms"
+    return f"{seconds:.3f} s"
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='熱路徑基準測試與效能退步檢查')
+    parser.add_argument('--only', nargs='*', default=None, help='只執行名稱包含任一關鍵字的項目')
+    parser.add_argument('--baseline', default=BASELINE_FILE, help=f'基準線檔案（預設 {BASELINE_FILE}）')
+    parser.add_argument('--save-baseline', action='store_true', help='以本次結果更新基準線')
+    parser.add_argument('--threshold', type=float, default=DEFAULT_THRESHOLD,
+                        help=f'允許變慢的比例（預設 {DEFAULT_THRESHOLD}，可在基準線的 thresholds 中個別覆寫）')
+    parser.add_argument('--upstream-latency-ms', type=float, default=0,
+                        help='模擬上游每次請求的延遲（預設 0，只量測本服務的成本）')
+    parser.add_argument('--list', action='store_true', help='只列出項目名稱')
+    args = parser.parse_args(argv)
+
+    baseline_path = os.path.abspath(args.baseline)
+    root = tempfile.mkdtemp(prefix='bench_')
+    os.chdir(root)
+    erm.rate_limiter.set_rate(100000)
+
+    flask_app = Flask(__name__)
+    with flask_app.app_context():
+        manager = ExchangeRateManager()
+        manager.jobs.init_app(flask_app)
+        benchmarks = [
+            *lru_benchmarks(),
+            *extract_benchmarks(manager),
+            *render_benchmarks(manager),
+            *sse_benchmarks(),
+            *background_fetch_benchmarks(manager, flask_app, args.upstream_latency_ms / 1000),
+        ]
+        if args.only:
+            benchmarks = [b for b in benchmarks if any(word in b.name for word in args.only)]
+        if args.list:
+            for benchmark in benchmarks:
+                print(benchmark.name)
+            return 0
+
+        results = {}
+        for benchmark in benchmarks:
+            print(f"⏱️  {benchmark.name} ...", file=sys.stderr)
+            # 背景抓取會大量輸出進度日誌，量測期間關閉 stdout
+            with open(os.devnull, 'w') as devnull, mock.patch.object(sys, 'stdout', devnull):
+                results[benchmark.name] = benchmark.measure()
+
+    baseline = load_baseline(baseline_path)
+    rows, regressed = compare(results, baseline, args.threshold)
+
+    print()
+    print(f"{'項目':<28}{'目前':>12}{'基準':>12}{'比例':>8}  狀態")
+    for name, current, base, ratio, status in rows:
+        ratio_text = f"{ratio:.2f}x" if ratio is not None else '-'
+        print(f"{name:<30}{_format_seconds(current):>12}{_format_seconds(base):>12}{ratio_text:>8}  {status}")
+
+    if baseline and baseline.get('machine') != machine_info():
+        print(f"\n⚠️ 基準線建立於不同環境 {baseline.get('machine')}，比較結果僅供參考")
+
+    if args.save_baseline:
+        save_baseline(baseline_path, results, baseline)
+        print(f"\n💾 已更新基準線: {baseline_path}")
+        return 0
+    if baseline is None:
+        print(f"\n找不到基準線 {baseline_path}，請先以 --save-baseline 建立")
+        return 0
+    if regressed:
+        print("\n❌ 有項目超過允許的退步門檻")
+        return 1
+    print("\n✅ 全部項目都在門檻內")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,134 @@
+"""
+比較「新增一天後完整重建」與「滑動窗口增量更新」的耗時。
+
+完整重建：每個期間重新取序列、完整計算統計並繪圖（原本 scheduled_update 的做法）。
+增量更新：store_rates 推進滑動窗口後呼叫 refresh_period_charts，統計 O(1) 更新、內容未變就不重繪。
+
+在暫存目錄中以合成數據執行，不會動到 data/ 與 static/charts。
+
+用法：
+    python -m tools.bench_incremental --rounds 5
+"""
+import os
+import sys
+import time
+import random
+import argparse
+import tempfile
+from datetime import datetime, timedelta
+
+import matplotlib
+matplotlib.use('Agg')
+from flask import Flask
+
+from app.exchange_rate_manager import ExchangeRateManager, CHART_GENERATION_CHECKPOINTS, LONG_RANGE_PERIODS
+
+PAIR = ('TWD', 'USD')
+
+
+def make_manager(base_dir, history):
+    """在獨立目錄建立 manager 並寫入合成歷史數據"""
+    os.makedirs(base_dir)
+    os.chdir(base_dir)
+    manager = ExchangeRateManager()
+    manager.store_rates(*PAIR, history)
+    return manager
+
+
+def full_regeneration(manager):
+    """原本的做法：每個期間（含長區間）重新取序列、完整計算統計並繪圖"""
+    for days in [*CHART_GENERATION_CHECKPOINTS, *LONG_RANGE_PERIODS]:
+        dates_str, rates, bands = manager.get_period_series(days, *PAIR)
+        manager.render_chart_image(days, dates_str, rates, *PAIR, bands=bands)
+        manager._calculate_stats(rates, dates_str)
+
+
+def stats_only_full(manager):
+    for days in CHART_GENERATION_CHECKPOINTS:
+        dates_str, rates, _ = manager.get_period_series(days, *PAIR)
+        manager._calculate_stats(rates, dates_str)
+
+
+def stats_only_incremental(manager):
+    now = datetime.now()
+    with manager._windows_lock:
+        for days in CHART_GENERATION_CHECKPOINTS:
+            window = manager._get_window(days, *PAIR)
+            window.evict_before((now - timedelta(days=days)).strftime('%Y-%m-%d'))
+            window.take_delta()
+            window.stats()
+
+
+def timed(fn, *args):
+    started = time.perf_counter()
+    result = fn(*args)
+    return time.perf_counter() - started, result
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='比較完整重建與增量更新圖表/統計的耗時')
+    parser.add_argument('--rounds', type=int, default=5, help='模擬新增幾天（預設 5）')
+    parser.add_argument('--stats-iterations', type=int, default=200, help='只比較統計時的重複次數（預設 200）')
+    args = parser.parse_args(argv)
+
+    random.seed(42)
+    today = datetime.now().replace(hour=0, minute=0, second=0, microsecond=0)
+    # 歷史數據截止於 rounds 天前，之後每輪新增一天
+    history_end = today - timedelta(days=args.rounds)
+    history = {}
+    rate = 0.032
+    for i in range(200, -1, -1):
+        rate *= 1 + random.uniform(-0.004, 0.004)
+        history[(history_end - timedelta(days=i)).strftime('%Y-%m-%d')] = round(rate, 6)
+    new_days = []
+    for i in range(1, args.rounds + 1):
+        rate *= 1 + random.uniform(-0.004, 0.004)
+        new_days.append(((history_end + timedelta(days=i)).strftime('%Y-%m-%d'), round(rate, 6)))
+
+    root = tempfile.mkdtemp(prefix='bench_incremental_')
+    app = Flask(__name__)
+    with app.app_context():
+        full = make_manager(os.path.join(root, 'full'), history)
+        incremental = make_manager(os.path.join(root, 'incremental'), history)
+        incremental.refresh_period_charts(*PAIR)  # 建立窗口與初始圖表
+
+        full_times, incremental_times, rendered = [], [], 0
+        for date_str, new_rate in new_days:
+            os.chdir(os.path.join(root, 'full'))
+            full.store_rates(*PAIR, {date_str: new_rate})
+            elapsed, _ = timed(full_regeneration, full)
+            full_times.append(elapsed)
+
+            os.chdir(os.path.join(root, 'incremental'))
+            incremental.store_rates(*PAIR, {date_str: new_rate})
+            elapsed, results = timed(incremental.refresh_period_charts, *PAIR)
+            incremental_times.append(elapsed)
+            rendered += sum(1 for days in CHART_GENERATION_CHECKPOINTS if results.get(days) == 'rendered')
+
+        # 沒有新數據時再刷新一次：內容雜湊不變，增量路徑不會重繪
+        os.chdir(os.path.join(root, 'full'))
+        unchanged_full, _ = timed(full_regeneration, full)
+        os.chdir(os.path.join(root, 'incremental'))
+        unchanged_incremental, _ = timed(incremental.refresh_period_charts, *PAIR)
+
+        stats_full, _ = timed(lambda: [stats_only_full(full) for _ in range(args.stats_iterations)])
+        stats_incremental, _ = timed(lambda: [stats_only_incremental(incremental) for _ in range(args.stats_iterations)])
+
+    periods = len(CHART_GENERATION_CHECKPOINTS)
+    print()
+    print(f"📏 新增一天（{args.rounds} 輪，{periods} 個日資料期間 + {len(LONG_RANGE_PERIODS)} 個長區間期間）")
+    print(f"   完整重建  平均 {sum(full_times) / len(full_times) * 1000:8.1f} ms/輪")
+    print(f"   增量更新  平均 {sum(incremental_times) / len(incremental_times) * 1000:8.1f} ms/輪"
+          f"（重繪 {rendered}/{args.rounds * periods} 張日資料圖表）")
+    print("📏 沒有新數據時刷新")
+    print(f"   完整重建  {unchanged_full * 1000:8.1f} ms")
+    print(f"   增量更新  {unchanged_incremental * 1000:8.1f} ms")
+    print(f"📏 只計算統計（{args.stats_iterations} 次 × {periods} 個期間）")
+    print(f"   完整計算  {stats_full / args.stats_iterations * 1000:8.3f} ms/次")
+    print(f"   滑動窗口  {stats_incremental / args.stats_iterations * 1000:8.3f} ms/次")
+    print(f"\n暫存目錄: {root}")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
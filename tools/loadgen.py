@@ -0,0 +1,224 @@
+"""
+負載產生器：模擬 N 個同時在線的瀏覽器工作階段。
+
+每個工作階段都保持一條 SSE 連線，並反覆：回報關注的貨幣對、查最新匯率、取圖表，
+偶爾觸發預生成。結束時列出各端點的 p50/p99 延遲、錯誤數、收到的 SSE 事件，
+以及期間內模擬上游實際收到的請求數（讀取 tools.mock_upstream 的 /__stats）。
+
+用法（先啟動模擬上游與服務）：
+    python -m tools.mock_upstream --port 8001 --latency-ms 80 --max-rps 20
+    RATE_UPSTREAM_URL=http://127.0.0.1:8001/conversion-rates RATE_UPSTREAM_RPS=20 python run.py
+    python -m tools.loadgen --sessions 50 --duration 60 --upstream http://127.0.0.1:8001
+
+    # 或由負載產生器在同一行程內啟動模擬上游
+    python -m tools.loadgen --sessions 50 --start-upstream --upstream http://127.0.0.1:8001
+"""
+import sys
+import json
+import time
+import random
+import argparse
+from collections import Counter, defaultdict
+from threading import Lock, Thread, Event
+from urllib.parse import urlparse
+
+import requests
+
+from tools.mock_upstream import MockUpstream, serve
+
+DEFAULT_PAIRS = 'TWD-HKD,TWD-USD,TWD-JPY,USD-JPY,EUR-USD,TWD-EUR,GBP-USD,TWD-KRW'
+PERIODS = (7, 30, 90, 180)
+
+
+def percentile(sorted_values, pct):
+    """最近排名法的百分位數（輸入需已排序）"""
+    if not sorted_values:
+        return None
+    index = max(0, min(len(sorted_values) - 1, int(round(pct / 100 * len(sorted_values) + 0.5)) - 1))
+    return sorted_values[index]
+
+
+class Recorder:
+    def __init__(self):
+        """收集各端點的延遲與結果，以及各類 SSE 事件數"""
+        self.lock = Lock()
+        self.latencies = defaultdict(list)
+        self.outcomes = defaultdict(Counter)
+        self.events = Counter()
+
+    def record(self, endpoint, seconds, outcome):
+        with self.lock:
+            self.latencies[endpoint].append(seconds)
+            self.outcomes[endpoint][outcome] += 1
+
+    def event(self, event_type):
+        with self.lock:
+            self.events[event_type] += 1
+
+
+class Session:
+    def __init__(self, index, base_url, pairs, weights, recorder, stop, think_seconds, pregenerate_ratio):
+        self.index = index
+        self.base_url = base_url.rstrip('/')
+        self.pairs = pairs
+        self.weights = weights
+        self.recorder = recorder
+        self.stop = stop
+        self.think_seconds = think_seconds
+        self.pregenerate_ratio = pregenerate_ratio
+        self.random = random.Random(index)
+        self.http = requests.Session()
+        self.client_id = None
+        self._connected = Event()
+        self._sse_response = None
+
+    def _sse_loop(self):
+        """保持 SSE 連線並計數收到的事件"""
+        try:
+            self._sse_response = requests.get(f"{self.base_url}/api/events", stream=True, timeout=(5, None))
+            event_type = None
+            for line in self._sse_response.iter_lines(decode_unicode=True):
+                if self.stop.is_set():
+                    break
+                if line.startswith('event:'):
+                    event_type = line[6:].strip()
+                elif line.startswith('data:') and event_type:
+                    self.recorder.event(event_type)
+                    if event_type == 'connected':
+                        self.client_id = json.loads(line[5:]).get('client_id')
+                        self._connected.set()
+                    event_type = None
+        except Exception as e:
+            if not self.stop.is_set():
+                self.recorder.event(f"sse_error:{type(e).__name__}")
+        finally:
+            self._connected.set()
+
+    def _call(self, endpoint, method='GET', **kwargs):
+        started = time.perf_counter()
+        try:
+            response = self.http.request(method, f"{self.base_url}{endpoint}", timeout=60, **kwargs)
+            elapsed = time.perf_counter() - started
+            if response.status_code == 200:
+                outcome = 'ok'
+            elif response.headers.get('Content-Type', '').startswith('application/json') and response.json().get('no_data'):
+                outcome = 'pending'  # 圖表仍在背景生成，前端會等待 SSE 通知
+            else:
+                outcome = f"http_{response.status_code}"
+        except requests.RequestException as e:
+            elapsed = time.perf_counter() - started
+            outcome = type(e).__name__
+        self.recorder.record(endpoint, elapsed, outcome)
+
+    def run(self):
+        Thread(target=self._sse_loop, daemon=True, name=f"sse-{self.index}").start()
+        self._connected.wait(timeout=10)
+        while not self.stop.is_set():
+            buy_currency, sell_currency = self.random.choices(self.pairs, weights=self.weights)[0]
+            params = {'buy_currency': buy_currency, 'sell_currency': sell_currency}
+            if self.client_id:
+                self._call('/api/watch', 'POST', json={'client_id': self.client_id, **params})
+            self._call('/api/latest_rate', params=params)
+            self._call('/api/chart', params={**params, 'period': self.random.choice(PERIODS)})
+            if self.random.random() < self.pregenerate_ratio:
+                self._call('/api/pregenerate_charts', params=params)
+            self.stop.wait(self.think_seconds * self.random.uniform(0.5, 1.5))
+        if self._sse_response is not None:
+            self._sse_response.close()
+
+
+def upstream_stats(upstream_url):
+    if not upstream_url:
+        return None
+    try:
+        return requests.get(f"{upstream_url.rstrip('/')}/__stats", timeout=5).json()
+    except (requests.RequestException, ValueError):
+        return None
+
+
+def report(recorder, duration, sessions, before, after):
+    print()
+    print(f"📊 {sessions} 個工作階段，{duration:.1f} 秒")
+    print(f"{'端點':<26}{'次數':>7}{'成功':>7}{'等待':>7}{'錯誤':>7}{'p50':>10}{'p99':>10}{'最大':>10}")
+    for endpoint in sorted(recorder.latencies):
+        values = sorted(recorder.latencies[endpoint])
+        outcomes = recorder.outcomes[endpoint]
+        errors = sum(count for outcome, count in outcomes.items() if outcome not in ('ok', 'pending'))
+        print(f"{endpoint:<28}{len(values):>7}{outcomes['ok']:>7}{outcomes['pending']:>7}{errors:>7}"
+              f"{percentile(values, 50) * 1000:>9.1f}ms{percentile(values, 99) * 1000:>8.1f}ms{values[-1] * 1000:>8.1f}ms")
+        failures = {o: c for o, c in outcomes.items() if o not in ('ok', 'pending')}
+        if failures:
+            print(f"    錯誤: {failures}")
+    print(f"\n📨 SSE 事件: {dict(recorder.events.most_common())}")
+
+    if before is not None and after is not None:
+        outcomes = Counter(after['outcomes'])
+        outcomes.subtract(before['outcomes'])
+        requests_made = after['requests'] - before['requests']
+        print(f"\n🌐 上游請求: {requests_made} 次（{requests_made / duration:.1f}/秒）"
+              f"，結果: {dict((k, v) for k, v in outcomes.items() if v)}")
+    else:
+        print("\n🌐 未取得模擬上游統計（未指定 --upstream 或無法連線）")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='模擬多個瀏覽器工作階段的負載產生器')
+    parser.add_argument('--base-url', default='http://127.0.0.1:5000', help='服務位址')
+    parser.add_argument('--sessions', type=int, default=20, help='同時在線的工作階段數')
+    parser.add_argument('--duration', type=float, default=30, help='持續秒數')
+    parser.add_argument('--pairs', default=DEFAULT_PAIRS, help='貨幣對清單，越前面越常被查詢')
+    parser.add_argument('--think-seconds', type=float, default=2.0, help='每輪操作間的平均停頓')
+    parser.add_argument('--pregenerate-ratio', type=float, default=0.1, help='每輪觸發預生成的機率')
+    parser.add_argument('--ramp-seconds', type=float, default=5, help='在幾秒內逐步啟動所有工作階段')
+    parser.add_argument('--upstream', default=None, help='模擬上游位址（例如 http://127.0.0.1:8001），用於統計上游請求數')
+    parser.add_argument('--start-upstream', action='store_true', help='在本行程內啟動模擬上游（監聽 --upstream 的位址）')
+    parser.add_argument('--upstream-latency-ms', type=float, default=50, help='--start-upstream 時的上游延遲')
+    parser.add_argument('--upstream-max-rps', type=float, default=0, help='--start-upstream 時的上游每秒上限')
+    args = parser.parse_args(argv)
+
+    pairs = [tuple(item.strip().upper().split('-')) for item in args.pairs.split(',') if item.strip()]
+    weights = [1 / (rank + 1) for rank in range(len(pairs))]  # Zipf 分布：少數熱門貨幣對佔多數請求
+
+    server = None
+    if args.start_upstream:
+        if not args.upstream:
+            parser.error('--start-upstream 需要同時指定 --upstream')
+        url = urlparse(args.upstream)
+        server = serve(url.hostname, url.port, MockUpstream(latency_ms=args.upstream_latency_ms,
+                                                            jitter_ms=args.upstream_latency_ms / 2,
+                                                            max_rps=args.upstream_max_rps))
+        Thread(target=server.serve_forever, daemon=True, name='mock-upstream').start()
+        print(f"🧪 模擬上游已啟動: {args.upstream}/conversion-rates")
+
+    recorder = Recorder()
+    stop = Event()
+    before = upstream_stats(args.upstream)
+    started = time.perf_counter()
+    threads = []
+    for index in range(args.sessions):
+        session = Session(index, args.base_url, pairs, weights, recorder, stop,
+                          args.think_seconds, args.pregenerate_ratio)
+        thread = Thread(target=session.run, daemon=True, name=f"session-{index}")
+        thread.start()
+        threads.append(thread)
+        if args.ramp_seconds and args.sessions > 1:
+            time.sleep(args.ramp_seconds / args.sessions)
+
+    print(f"🚀 已啟動 {args.sessions} 個工作階段，持續 {args.duration} 秒...")
+    try:
+        stop.wait(max(0, args.duration - (time.perf_counter() - started)))
+    except KeyboardInterrupt:
+        pass
+    stop.set()
+    for thread in threads:
+        thread.join(timeout=65)
+    duration = time.perf_counter() - started
+
+    report(recorder, duration, args.sessions, before, upstream_stats(args.upstream))
+    if server is not None:
+        server.shutdown()
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
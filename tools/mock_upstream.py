@@ -0,0 +1,239 @@
+"""
+本地 Mastercard 匯率 API 模擬服務，用於離線負載測試與重現限流。
+
+- 匯率由貨幣對與日期決定（相同參數永遠得到相同結果），週末與未來日期沒有數據
+- 可設定延遲與抖動、500 錯誤與 429 注入比例，以及每秒請求上限（超過時回 429）
+- GET /__stats 返回請求統計，POST /__reset 清除統計，POST /__config 在執行中調整參數
+
+用法：
+    python -m tools.mock_upstream --port 8001 --latency-ms 80 --jitter-ms 40 --error-rate 0.01 --max-rps 20
+    RATE_UPSTREAM_URL=http://127.0.0.1:8001/conversion-rates python run.py
+"""
+import sys
+import json
+import math
+import time
+import random
+import hashlib
+import argparse
+from datetime import datetime
+from collections import Counter
+from threading import Lock
+from urllib.parse import urlparse, parse_qs
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# 可在執行中透過 /__config 調整的參數
+CONFIG_KEYS = ('latency_ms', 'jitter_ms', 'error_rate', 'throttle_rate', 'max_rps', 'publish_weekends')
+
+
+def _unit_hash(*parts):
+    """把參數雜湊為 [0, 1) 的固定值"""
+    digest = hashlib.blake2b('|'.join(parts).encode('utf-8'), digest_size=8).digest()
+    return int.from_bytes(digest, 'big') / 2 ** 64
+
+
+def deterministic_rate(buy_currency, sell_currency, date):
+    """
+    貨幣對的基準匯率落在 0.01–100 之間（對數均勻），再疊加緩慢的週期波動與每日雜訊。
+    反向貨幣對互為倒數，與真實匯率一致。
+    """
+    if buy_currency > sell_currency:
+        return round(1 / deterministic_rate(sell_currency, buy_currency, date), 6)
+    base = 10 ** (_unit_hash(buy_currency, sell_currency) * 4 - 2)
+    phase = _unit_hash(sell_currency, buy_currency) * 2 * math.pi
+    day = date.toordinal()
+    noise = _unit_hash(buy_currency, sell_currency, date.isoformat()) - 0.5
+    return round(base * (1 + 0.04 * math.sin(day / 45 + phase) + 0.006 * noise), 6)
+
+
+class MockUpstream:
+    def __init__(self, latency_ms=0, jitter_ms=0, error_rate=0.0, throttle_rate=0.0, max_rps=0,
+                 publish_weekends=False, seed=None):
+        """
+        模擬上游的狀態與統計。
+        max_rps 為 0 表示不限速；超過上限的請求直接回 429，與真實服務的限流行為相同。
+        """
+        self.latency_ms = latency_ms
+        self.jitter_ms = jitter_ms
+        self.error_rate = error_rate
+        self.throttle_rate = throttle_rate
+        self.max_rps = max_rps
+        self.publish_weekends = publish_weekends
+        self.random = random.Random(seed)
+        self.lock = Lock()
+        self._window_start = time.monotonic()
+        self._window_count = 0
+        self.reset()
+
+    def reset(self):
+        with self.lock:
+            self.started_at = time.time()
+            self.counts = Counter()
+            self.pairs = Counter()
+
+    def configure(self, **changes):
+        with self.lock:
+            for key, value in changes.items():
+                if key in CONFIG_KEYS:
+                    setattr(self, key, type(getattr(self, key))(value))
+            return self.config()
+
+    def config(self):
+        return {key: getattr(self, key) for key in CONFIG_KEYS}
+
+    def stats(self):
+        with self.lock:
+            elapsed = max(1e-9, time.time() - self.started_at)
+            return {
+                'requests': self.counts['requests'],
+                'outcomes': {k: v for k, v in self.counts.items() if k != 'requests'},
+                'by_pair': dict(self.pairs.most_common()),
+                'elapsed_seconds': round(elapsed, 3),
+                'requests_per_second': round(self.counts['requests'] / elapsed, 2),
+                'config': self.config(),
+            }
+
+    def _over_rate_cap(self):
+        """一秒的固定窗口計數（內部方法，需持有鎖）"""
+        if not self.max_rps:
+            return False
+        now = time.monotonic()
+        if now - self._window_start >= 1:
+            self._window_start, self._window_count = now, 0
+        self._window_count += 1
+        return self._window_count > self.max_rps
+
+    def handle(self, params):
+        """返回 (HTTP 狀態碼, 回應內容, 額外標頭)"""
+        buy_currency = params.get('transaction_currency', '').upper()
+        sell_currency = params.get('cardholder_billing_currency', '').upper()
+        date_str = params.get('exchange_date', '')
+
+        with self.lock:
+            self.counts['requests'] += 1
+            self.pairs[f"{buy_currency}-{sell_currency}"] += 1
+            throttled = self._over_rate_cap() or self.random.random() < self.throttle_rate
+            failed = not throttled and self.random.random() < self.error_rate
+            delay = max(0.0, self.latency_ms + self.random.uniform(-self.jitter_ms, self.jitter_ms)) / 1000
+
+        if delay:
+            time.sleep(delay)
+
+        if throttled:
+            self._count('throttled')
+            return 429, {'type': 'error', 'errorMessage': 'Too Many Requests'}, {'Retry-After': '1'}
+        if failed:
+            self._count('error')
+            return 500, {'type': 'error', 'errorMessage': 'Injected failure'}, {}
+        try:
+            date = datetime.strptime(date_str, '%Y-%m-%d').date()
+        except ValueError:
+            self._count('bad_request')
+            return 400, {'type': 'error', 'errorMessage': 'Invalid exchange_date'}, {}
+        if not (len(buy_currency) == 3 and len(sell_currency) == 3):
+            self._count('bad_request')
+            return 400, {'type': 'error', 'errorMessage': 'Invalid currency'}, {}
+
+        # 週末與未來日期沒有發布匯率：回 200 但不含 data，與上游相同
+        if date > datetime.now().date() or (date.weekday() >= 5 and not self.publish_weekends):
+            self._count('no_data')
+            return 200, {'type': 'error', 'errorCode': '104', 'errorMessage': 'Rate not available'}, {}
+
+        rate = deterministic_rate(buy_currency, sell_currency, date)
+        self._count('ok')
+        return 200, {
+            'name': 'settlement-conversion-rate',
+            'date': datetime.now().strftime('%Y-%m-%d %H:%M:%S'),
+            'type': 'Conversion rate',
+            'data': {
+                'conversionRate': rate,
+                'crdhldBillAmt': rate * float(params.get('transaction_amount', 1) or 1),
+                'fxDate': date_str,
+                'transCurr': buy_currency,
+                'crdhldBillCurr': sell_currency,
+                'transAmt': params.get('transaction_amount', '1'),
+            }
+        }, {}
+
+    def _count(self, outcome):
+        with self.lock:
+            self.counts[outcome] += 1
+
+
+def make_handler(upstream):
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = 'HTTP/1.1'
+
+        def _send(self, status, body, headers=None):
+            payload = json.dumps(body, ensure_ascii=False).encode('utf-8')
+            self.send_response(status)
+            self.send_header('Content-Type', 'application/json; charset=utf-8')
+            self.send_header('Content-Length', str(len(payload)))
+            for key, value in (headers or {}).items():
+                self.send_header(key, value)
+            self.end_headers()
+            self.wfile.write(payload)
+
+        def do_GET(self):
+            url = urlparse(self.path)
+            if url.path == '/__stats':
+                return self._send(200, upstream.stats())
+            if not url.path.endswith('/conversion-rates'):
+                return self._send(404, {'type': 'error', 'errorMessage': 'Not found'})
+            params = {key: values[0] for key, values in parse_qs(url.query).items()}
+            self._send(*upstream.handle(params))
+
+        def do_POST(self):
+            url = urlparse(self.path)
+            length = int(self.headers.get('Content-Length') or 0)
+            body = json.loads(self.rfile.read(length) or b'{}') if length else {}
+            if url.path == '/__reset':
+                upstream.reset()
+                return self._send(200, {'success': True})
+            if url.path == '/__config':
+                return self._send(200, upstream.configure(**body))
+            self._send(404, {'type': 'error', 'errorMessage': 'Not found'})
+
+        def log_message(self, format, *args):
+            pass  # 負載測試時每秒數百筆請求，不逐筆輸出
+
+    return Handler
+
+
+def serve(host, port, upstream):
+    server = ThreadingHTTPServer((host, port), make_handler(upstream))
+    server.daemon_threads = True
+    return server
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='本地 Mastercard 匯率 API 模擬服務')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8001)
+    parser.add_argument('--latency-ms', type=float, default=0, help='每次請求的平均延遲（毫秒）')
+    parser.add_argument('--jitter-ms', type=float, default=0, help='延遲的隨機抖動範圍（±毫秒）')
+    parser.add_argument('--error-rate', type=float, default=0.0, help='回 500 的比例（0-1）')
+    parser.add_argument('--throttle-rate', type=float, default=0.0, help='隨機回 429 的比例（0-1）')
+    parser.add_argument('--max-rps', type=float, default=0, help='每秒請求上限，超過回 429（0 為不限）')
+    parser.add_argument('--publish-weekends', action='store_true', help='週末也發布匯率')
+    parser.add_argument('--seed', type=int, default=None, help='注入錯誤與延遲所用的亂數種子')
+    args = parser.parse_args(argv)
+
+    upstream = MockUpstream(latency_ms=args.latency_ms, jitter_ms=args.jitter_ms, error_rate=args.error_rate,
+                            throttle_rate=args.throttle_rate, max_rps=args.max_rps,
+                            publish_weekends=args.publish_weekends, seed=args.seed)
+    server = serve(args.host, args.port, upstream)
+    print(f"🧪 模擬上游已啟動: http://{args.host}:{args.port}/conversion-rates")
+    print(f"   設定: {upstream.config()}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        print(f"📊 統計: {json.dumps(upstream.stats(), ensure_ascii=False)}")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())